@@ -0,0 +1,126 @@
+import argparse
+import sys
+from datetime import datetime
+from typing import Callable, Dict
+
+from app.data.database import engine, sessionLocal
+from app.data.migrations import run_migrations
+from app.services import export_service, partition_service
+from app.services.stats_service import rebuild_stats
+
+
+def migrate(args: argparse.Namespace) -> None:
+    # Every command migrates the database first, see main()
+    print('The database schema is up to date')
+
+
+def seal_partition(args: argparse.Namespace) -> None:
+    partition = partition_service.seal_partition(args.month, engine)
+    print(f'Sealed {args.month}: {partition["row_count"]} rows moved to {partition["file_name"]}')
+
+
+def attach_partition(args: argparse.Namespace) -> None:
+    partition_service.set_partition_state(args.month, partition_service.ATTACHED, engine)
+    print(f'Attached {args.month}')
+
+
+def detach_partition(args: argparse.Namespace) -> None:
+    partition_service.set_partition_state(args.month, partition_service.DETACHED, engine)
+    print(f'Detached {args.month}')
+
+
+def archive_partition(args: argparse.Namespace) -> None:
+    archived_path = partition_service.archive_partition(args.month, args.destination, engine)
+    print(f'Archived {args.month} to {archived_path}')
+
+
+def list_partitions(args: argparse.Namespace) -> None:
+    for partition in partition_service.list_partitions(engine):
+        print(f'{partition["month"]}  {partition["state"]:<8}  {partition["row_count"]:>10} rows  '
+              f'{partition["file_name"]}')
+
+
+def rebuild_statistics(args: argparse.Namespace) -> None:
+    db = sessionLocal()
+    try:
+        rebuild_stats(db)
+    finally:
+        db.close()
+    print('Rebuilt the statistics rollups')
+
+
+def export_dialog_data(args: argparse.Namespace) -> None:
+    db = sessionLocal()
+    try:
+        last_id = export_service.get_export_watermark(db, watermark=args.watermark)
+        filters = export_service.ExportFilters(language=args.language, customer_id=args.customer_id,
+                                               start=args.start, end=args.end, after_id=args.watermark or 0,
+                                               last_id=last_id)
+        with open(args.output, 'wb') as output:
+            for chunk in export_service.export_dialog_data(export_format=args.format, filters=filters, db=db):
+                output.write(chunk)
+    finally:
+        db.close()
+    print(f'Exported to {args.output}, pass --watermark {last_id} to export the rows added since')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m app.cli', description='Maintenance commands of the data API')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('migrate', help='apply the pending migrations of the database schema') \
+        .set_defaults(handler=migrate)
+
+    partitions = commands.add_parser('partitions', help='manage the monthly partitions of the dialog data')
+    partition_commands = partitions.add_subparsers(dest='partition_command', required=True)
+    partition_commands.add_parser('list', help='list the sealed months').set_defaults(handler=list_partitions)
+    handlers: Dict[str, Callable[[argparse.Namespace], None]] = {
+        'seal': seal_partition,
+        'attach': attach_partition,
+        'detach': detach_partition,
+        'archive': archive_partition,
+    }
+    descriptions = {
+        'seal': 'move the dialog data of a past month to its own database file',
+        'attach': 'query a sealed month again',
+        'detach': 'stop querying a sealed month, its file is kept',
+        'archive': 'detach a sealed month and move its file to another directory',
+    }
+    for name, handler in handlers.items():
+        command = partition_commands.add_parser(name, help=descriptions[name])
+        command.add_argument('month', help='month, as YYYY-MM')
+        if name == 'archive':
+            command.add_argument('destination', help='directory to move the partition file to')
+        command.set_defaults(handler=handler)
+
+    stats = commands.add_parser('stats', help='manage the rollups of the statistics')
+    stats_commands = stats.add_subparsers(dest='stats_command', required=True)
+    stats_commands.add_parser('rebuild', help='recompute the rollups from the dialog data and the consents') \
+        .set_defaults(handler=rebuild_statistics)
+
+    export = commands.add_parser('export', help='export the consented dialog data to a file')
+    export.add_argument('output', help='file to write the export to')
+    export.add_argument('--format', default='csv', choices=export_service.EXPORT_FORMATS)
+    export.add_argument('--language')
+    export.add_argument('--customer-id')
+    export.add_argument('--from', dest='start', type=datetime.fromisoformat,
+                        help='first reception time, in UTC')
+    export.add_argument('--to', dest='end', type=datetime.fromisoformat, help='reception time to stop at, in UTC')
+    export.add_argument('--watermark', type=int, help='watermark printed by the previous export')
+    export.set_defaults(handler=export_dialog_data)
+
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    run_migrations(engine)
+    try:
+        args.handler(args)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
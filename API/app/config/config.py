@@ -1,5 +1,5 @@
 import os
-from typing import List, Union
+from typing import Any, Dict, List, Literal, Optional, Union
 
 from pydantic import AnyHttpUrl, BaseSettings, validator
 
@@ -8,7 +8,52 @@ class Settings(BaseSettings):
     PROJECT_NAME: str
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = []
     DATABASE_URI: str
+    DATABASE_ASYNC: bool = False
+    ASYNC_DATABASE_URI: Optional[str] = None
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT_S: float = 30
+    SQLITE_JOURNAL_MODE: Literal['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'] = 'WAL'
+    SQLITE_SYNCHRONOUS: Literal['OFF', 'NORMAL', 'FULL', 'EXTRA'] = 'NORMAL'
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_CACHE_SIZE: int = -65536
+    SQLITE_TEMP_STORE: Literal['DEFAULT', 'FILE', 'MEMORY'] = 'MEMORY'
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
     ANOMALY_PERIOD_MS: int
+    HEALTH_PROBE_TIMEOUT_MS: int = 1000
+    HEALTH_MAX_PROBE_LATENCY_MS: int = 250
+    HEALTH_MAX_POOL_USAGE: float = 0.9
+    STREAM_BATCH_SIZE: int = 1000
+    EXPORT_BATCH_SIZE: int = 65536
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_ROUTE_SAMPLE_RATES: Dict[str, float] = {}
+    LOG_BODY_MAX_BYTES: int = 1024
+    LOG_ROUTE_BODY_MAX_BYTES: Dict[str, int] = {}
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    COMPRESSION_LEVEL: int = 6
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    QUERY_CACHE_ENABLED: bool = False
+    QUERY_CACHE_TTL_MS: int = 5000
+    QUERY_CACHE_MAX_BYTES: int = 67108864
+    CONSENT_INDEX_ENABLED: bool = False
+    INGEST_GROUP_COMMIT: bool = False
+    INGEST_GROUP_COMMIT_MAX_ROWS: int = 100
+    INGEST_GROUP_COMMIT_MAX_DELAY_MS: int = 5
+    TEMPORARY_STORE_MODE: Literal['DATABASE', 'MEMORY'] = 'DATABASE'
+    TEMPORARY_STORE_MAX_ROWS: int = 100000
+    TEMPORARY_STORE_MAX_AGE_MS: int = 60000
+    TEMPORARY_STORE_SPILL_INTERVAL_MS: int = 1000
+    RETENTION_ENABLED: bool = False
+    RETENTION_PERIOD_MS: int = 2592000000
+    RETENTION_MODE: Literal['DELETE', 'ARCHIVE'] = 'DELETE'
+    RETENTION_INTERVAL_S: float = 3600
+    RETENTION_BATCH_SIZE: int = 100
+    RETENTION_BATCH_MAX_DURATION_MS: int = 50
+    RETENTION_PAUSE_MS: int = 100
+    PARTITION_DIRECTORY: str = ''
+    PARTITION_DELETE_BATCH_SIZE: int = 10000
+    PARTITION_DELETE_PAUSE_MS: int = 100
 
     @validator("BACKEND_CORS_ORIGINS", pre=True)
     def assemble_cors_origins(cls, v: Union[str, List[str]]) -> Union[List[str], str]:
@@ -18,6 +63,21 @@ class Settings(BaseSettings):
             return v
         raise ValueError(v)
 
+    @validator("ASYNC_DATABASE_URI", always=True)
+    def assemble_async_database_uri(cls, v: Optional[str], values: Dict[str, Any]) -> Optional[str]:
+        if v is None and values.get("DATABASE_URI", "").startswith("sqlite://"):
+            return values["DATABASE_URI"].replace("sqlite://", "sqlite+aiosqlite://", 1)
+        if v is None and values.get("DATABASE_ASYNC"):
+            raise ValueError('ASYNC_DATABASE_URI is required by DATABASE_ASYNC when DATABASE_URI is not a SQLite URI')
+        return v
+
+    @validator("PARTITION_DIRECTORY", always=True)
+    def assemble_partition_directory(cls, v: str, values: Dict[str, Any]) -> str:
+        # Next to the database file by default, so that the partitions are on the same volume
+        if v == '' and values.get("DATABASE_URI", "").startswith("sqlite:///"):
+            return os.path.join(os.path.dirname(values["DATABASE_URI"][len("sqlite:///"):]), 'partitions')
+        return v or 'data/partitions'
+
     class Config:
         case_sensitive = True
         env_file = '.env.docker' if 'ENVIRONMENT' in os.environ and os.environ['ENVIRONMENT'] == 'DOCKER' else '.env'
@@ -1,9 +1,10 @@
+from typing import Any, Dict, List
+
 from fastapi import APIRouter, Body, Depends, Path
-from sqlalchemy.orm import Session
 
 import app.services.consent_service as service
-from app.data.database import get_db
-from app.data.models import ConsentModel
+from app.data.database import DatabaseSession, get_session, run_db
+from app.data.models import ConsentBatchItemModel, ConsentBatchResultModel, ConsentModel
 from app.helpers.logging_helper import LoggingRoute
 
 consent_router = APIRouter(
@@ -15,7 +16,22 @@ consent_router = APIRouter(
 
 
 @consent_router.post("/{dialogId}", response_model=ConsentModel)
-def save_user_consent(dialog_id: str = Path(None, alias="dialogId"),
-                      has_given_consent: bool = Body(default=None, embed=False),
-                      db: Session = Depends(get_db)) -> ConsentModel:
-    return service.save_user_consent(dialog_id=dialog_id, has_given_consent=has_given_consent, db=db)
+async def save_user_consent(dialog_id: str = Path(None, alias="dialogId"),
+                            has_given_consent: bool = Body(default=None, embed=False),
+                            db: DatabaseSession = Depends(get_session)) -> ConsentModel:
+    stored_dialog_data = await service.take_stored_dialog_data([dialog_id])
+    return await run_db(db, service.save_user_consent, dialog_id=dialog_id, has_given_consent=has_given_consent,
+                        stored_dialog_data=stored_dialog_data.get(dialog_id, []))
+
+
+@consent_router.post("", response_model=List[ConsentBatchResultModel])
+async def save_user_consents(consents: List[ConsentBatchItemModel],
+                             db: DatabaseSession = Depends(get_session)) -> List[Dict[str, Any]]:
+    """
+    Saves the consent decisions of many dialogs in a single transaction, e.g. when a session manager closes dialogs in
+    bursts. Decisions are checked like with POST /consents/{dialogId}, but a rejected one does not fail the others:
+    a result is returned for every decision, in the order of the request, with the status code the single consent
+    endpoint would have returned and, when it was saved, the consent.
+    """
+    stored_dialog_data = await service.take_stored_dialog_data({consent.dialog_id for consent in consents})
+    return await run_db(db, service.save_user_consents, consents=consents, stored_dialog_data=stored_dialog_data)
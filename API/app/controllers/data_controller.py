@@ -1,12 +1,26 @@
+import asyncio
+from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Path, Query
+from fastapi import APIRouter, Body, Depends, Path, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 import app.services.data_service as service
-from app.data.database import get_db
-from app.data.models import AnomalyDataModel, DialogDataCreateModel, DialogDataModel
+import app.services.export_service as export_service
+import app.services.search_service as search_service
+from app.config.config import settings
+from app.data.database import DatabaseSession, get_read_db, get_read_session, get_session, run_db
+from app.data.models import AnomalyDataModel, DialogDataBatchItemModel, DialogDataCreateModel, DialogDataModel
+from app.helpers.cache_helper import dialog_data_cache
+from app.helpers.http_cache_helper import (build_validator_headers, compute_etag, is_not_modified,
+                                           not_modified_response)
+from app.helpers.json_helper import FastJSONResponse
 from app.helpers.logging_helper import LoggingRoute
+from app.services.group_commit_service import ingest_buffer
+from app.services.temporary_store_service import temporary_store
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
 
 data_router = APIRouter(
     prefix='/data',
@@ -17,27 +31,154 @@ data_router = APIRouter(
 
 
 @data_router.post("/{customerId}/{dialogId}", response_model=DialogDataModel)
-def save_dialog_data(dialog_data: DialogDataCreateModel, customer_id: str = Path(None, alias="customerId"),
-                     dialog_id: str = Path(None, alias="dialogId"), db: Session = Depends(get_db)) -> DialogDataModel:
-    return service.save_dialog_data(dialog_data=dialog_data, customer_id=customer_id, dialog_id=dialog_id, db=db)
+async def save_dialog_data(dialog_data: DialogDataCreateModel, customer_id: str = Path(None, alias="customerId"),
+                           dialog_id: str = Path(None, alias="dialogId"),
+                           db: DatabaseSession = Depends(get_session)) -> DialogDataModel:
+    if temporary_store.enabled:
+        return temporary_store.save(dialog_data=dialog_data, customer_id=customer_id, dialog_id=dialog_id)
+
+    if settings.INGEST_GROUP_COMMIT:
+        return await asyncio.wrap_future(ingest_buffer.submit(dialog_data=dialog_data, customer_id=customer_id,
+                                                              dialog_id=dialog_id))
+
+    return await run_db(db, service.save_dialog_data, dialog_data=dialog_data, customer_id=customer_id,
+                        dialog_id=dialog_id)
+
+
+@data_router.post("/batch", response_model=List[int])
+async def save_dialog_data_batch(dialog_data_items: List[DialogDataBatchItemModel] = Body(..., min_items=1),
+                                 db: DatabaseSession = Depends(get_session)) -> List[int]:
+    """
+    Inserts the given messages, which may belong to several dialogs, in a single transaction.
+    Returns the ids assigned to the messages, in the order of the request.
+    """
+    if temporary_store.enabled:
+        return temporary_store.save_batch(dialog_data_items=dialog_data_items)
+
+    return await run_db(db, service.save_dialog_data_batch, dialog_data_items=dialog_data_items)
 
 
 @data_router.get("/", response_model=List[DialogDataModel])
-def get_dialog_data(language: Optional[str] = Query(None, alias='language'),
-                    customer_id: Optional[str] = Query(None, alias='customerId'),
-                    skip: Optional[int] = Query(None, alias='skip', ge=0),
-                    limit: Optional[int] = Query(None, alias='limit', ge=1),
-                    db: Session = Depends(get_db)) -> List[DialogDataModel]:
-    return service.get_dialog_data(language=language, customer_id=customer_id, db=db, skip=skip, limit=limit)
+async def get_dialog_data(request: Request,
+                          language: Optional[str] = Query(None, alias='language'),
+                          customer_id: Optional[str] = Query(None, alias='customerId'),
+                          skip: Optional[int] = Query(None, alias='skip', ge=0),
+                          limit: Optional[int] = Query(None, alias='limit', ge=1),
+                          cursor: Optional[str] = Query(None, alias='cursor'),
+                          stream: bool = Query(False, alias='stream'),
+                          db: DatabaseSession = Depends(get_read_session)) -> Response:
+    """
+    When a page is full, the X-Next-Cursor response header contains the cursor to pass to get the next page.
+    With stream=true, or when application/x-ndjson is accepted, rows are streamed as newline-delimited JSON as they
+    are read from the database.
+    """
+    if stream or NDJSON_MEDIA_TYPE in request.headers.get('accept', ''):
+        return StreamingResponse(
+            service.stream_dialog_data(language=language, customer_id=customer_id, db=db, skip=skip, limit=limit,
+                                       cursor=cursor),
+            media_type=NDJSON_MEDIA_TYPE
+        )
+
+    cache_key = ('dialog_data', language.lower() if language else language, customer_id, skip, limit, cursor)
+    cached_response = dialog_data_cache.get(cache_key)
+    if cached_response is not None:
+        if is_not_modified(request, cached_response.headers['ETag']):
+            return not_modified_response({**cached_response.headers, 'X-Cache': 'HIT'})
+        return cached_response.to_response()
+
+    # Read before the query, so that a result computed before an invalidation is not cached after it
+    cache_generation = dialog_data_cache.generation
+    min_id, max_id, partitions_updated_at, last_consent_at = await run_db(db, service.get_dialog_data_version)
+    headers = build_validator_headers(etag=compute_etag(cache_key, min_id, max_id, partitions_updated_at),
+                                      last_modified=last_consent_at)
+    if is_not_modified(request, headers['ETag']):
+        return not_modified_response(headers)
+
+    body, next_cursor = await run_db(db, service.get_serialized_dialog_data, language=language,
+                                     customer_id=customer_id, skip=skip, limit=limit, cursor=cursor)
+
+    if next_cursor is not None:
+        headers['X-Next-Cursor'] = next_cursor
+    dialog_data_cache.put(cache_key, generation=cache_generation, body=body, headers=headers)
+    return FastJSONResponse(content=body, headers=headers)
+
+
+@data_router.get("/export", response_class=StreamingResponse)
+async def export_dialog_data(export_format: str = Query('csv', alias='format'),
+                             language: Optional[str] = Query(None, alias='language'),
+                             customer_id: Optional[str] = Query(None, alias='customerId'),
+                             start: Optional[datetime] = Query(None, alias='from'),
+                             end: Optional[datetime] = Query(None, alias='to'),
+                             watermark: Optional[int] = Query(None, alias='watermark', ge=0),
+                             db: Session = Depends(get_read_db)) -> StreamingResponse:
+    """
+    Streams the consented data as CSV, Arrow IPC stream or Parquet, in batches of EXPORT_BATCH_SIZE rows. The
+    X-Export-Watermark response header contains the watermark to pass to the next export, to only get the rows added
+    since. Exports always run on a worker thread, with the sync storage layer, so that the conversion of the batches
+    never blocks the event loop.
+    """
+    export_service.check_export_format(export_format)
+    last_id = await run_db(db, export_service.get_export_watermark, watermark=watermark)
+    filters = export_service.ExportFilters(language=language, customer_id=customer_id, start=start, end=end,
+                                           after_id=watermark or 0, last_id=last_id)
+    file_name = f'dialog_data.{export_service.EXPORT_FILE_EXTENSIONS[export_format]}'
+    return StreamingResponse(
+        export_service.export_dialog_data(export_format=export_format, filters=filters, db=db),
+        media_type=export_service.EXPORT_MEDIA_TYPES[export_format],
+        headers={'X-Export-Watermark': str(last_id), 'Content-Disposition': f'attachment; filename="{file_name}"'}
+    )
+
+
+@data_router.get("/search", response_model=List[DialogDataModel])
+async def search_dialog_data(request: Request,
+                             search: str = Query(..., alias='q', min_length=1),
+                             language: Optional[str] = Query(None, alias='language'),
+                             customer_id: Optional[str] = Query(None, alias='customerId'),
+                             limit: int = Query(100, alias='limit', ge=1),
+                             cursor: Optional[str] = Query(None, alias='cursor'),
+                             db: DatabaseSession = Depends(get_read_session)) -> Response:
+    """
+    Full-text search over the text of the consented dialog data, using the SQLite FTS5 query syntax. Results are
+    sorted by relevance. When a page is full, the X-Next-Cursor response header contains the cursor to pass to get the
+    next page.
+    """
+    min_id, max_id, partitions_updated_at, last_consent_at = await run_db(db, service.get_dialog_data_version)
+    headers = build_validator_headers(etag=compute_etag('search', search, language, customer_id, limit, cursor,
+                                                        min_id, max_id, partitions_updated_at),
+                                      last_modified=last_consent_at)
+    if is_not_modified(request, headers['ETag']):
+        return not_modified_response(headers)
+
+    body, next_cursor = await run_db(db, search_service.get_serialized_search_results, search=search,
+                                     language=language, customer_id=customer_id, limit=limit, cursor=cursor)
+    if next_cursor is not None:
+        headers['X-Next-Cursor'] = next_cursor
+
+    return FastJSONResponse(content=body, headers=headers)
 
 
 @data_router.get("/anomaly", response_model=List[AnomalyDataModel])
-def get_anomalies(db: Session = Depends(get_db)) -> List[AnomalyDataModel]:
+async def get_anomalies(request: Request,
+                        limit: Optional[int] = Query(None, alias='limit', ge=1),
+                        cursor: Optional[str] = Query(None, alias='cursor'),
+                        db: DatabaseSession = Depends(get_read_session)) -> Response:
     """
     Additional endpoint that checks whether conversational data has been stored for a long time without receiving
     related consent information. No consent information does not mean that the user allows us to use his data,
     nor does it mean that he refuses consent.
     This endpoint could be used by any data administrator to be informed about the presence of old data. This person
     could then decide to permanently delete this data manually.
+    Anomalies are returned per dialog, oldest first. When a page is full, the X-Next-Cursor response header contains
+    the cursor to pass to get the next page.
     """
-    return service.get_anomalies(db=db)
+    anomaly_count, message_count, last_received_at = await run_db(db, service.get_anomalies_version)
+    headers = build_validator_headers(etag=compute_etag(limit, cursor, anomaly_count, message_count, last_received_at),
+                                      last_modified=last_received_at)
+    if is_not_modified(request, headers['ETag']):
+        return not_modified_response(headers)
+
+    body, next_cursor = await run_db(db, service.get_serialized_anomalies, limit=limit, cursor=cursor)
+    if next_cursor is not None:
+        headers['X-Next-Cursor'] = next_cursor
+
+    return FastJSONResponse(content=body, headers=headers)
@@ -1,5 +1,11 @@
-from fastapi import APIRouter, Response
+from typing import Any, Dict
 
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy.engine import Engine
+
+import app.services.health_service as service
+from app.data.database import get_engines
+from app.data.models import ReadinessModel
 from app.helpers.logging_helper import LoggingRoute
 
 health_router = APIRouter(
@@ -14,3 +20,16 @@ health_router = APIRouter(
 async def get_health_status(response: Response) -> str:
     response.status_code = 200
     return 'Ok'
+
+
+@health_router.get("/ready", response_model=ReadinessModel)
+async def get_readiness_status(response: Response,
+                               engines: Dict[str, Engine] = Depends(get_engines)) -> Dict[str, Any]:
+    """
+    Reports the statistics of the connection pools and the latency of a probe taking the write lock of the database.
+    Returns a 503 when a pool is nearly exhausted, or when the probe fails or is too slow, so that load balancers stop
+    sending requests to the worker.
+    """
+    readiness = await service.get_readiness(engines)
+    response.status_code = 200 if readiness['ready'] else 503
+    return readiness
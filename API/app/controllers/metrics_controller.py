@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from app.helpers.metrics_helper import generate_metrics
+
+# Scrapes are neither logged nor measured, so that they do not show up in the metrics they read
+metrics_router = APIRouter(
+    prefix='/metrics',
+    tags=['metrics'],
+    responses={404: {'description': 'Not found'}}
+)
+
+
+@metrics_router.get("", response_class=Response)
+async def get_metrics() -> Response:
+    """
+    Returns the metrics of the API in the Prometheus text format, aggregated over all the workers when
+    PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    return Response(content=generate_metrics(), media_type=CONTENT_TYPE_LATEST)
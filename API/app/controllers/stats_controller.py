@@ -0,0 +1,27 @@
+from datetime import date
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, Query
+
+import app.services.stats_service as service
+from app.data.database import DatabaseSession, get_read_session, run_db
+from app.data.models import StatsModel
+from app.helpers.logging_helper import LoggingRoute
+
+stats_router = APIRouter(
+    prefix='/stats',
+    tags=['stats'],
+    route_class=LoggingRoute
+)
+
+
+@stats_router.get("", response_model=StatsModel)
+async def get_stats(start: Optional[date] = Query(None, alias='from'),
+                    end: Optional[date] = Query(None, alias='to'),
+                    db: DatabaseSession = Depends(get_read_session)) -> Dict[str, Any]:
+    """
+    Message counts per language, customer and day, and consent decisions per day, between the optional from and to
+    days (inclusive, UTC). Read from rollups maintained when consent is given, so the cost depends on the number of
+    groups, not on the number of messages.
+    """
+    return await run_db(db, service.get_stats, start=start, end=end)
@@ -1,17 +1,123 @@
-from sqlalchemy import create_engine
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, TypeVar, Union
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, sessionmaker
 
 from app.config.config import settings
+from app.helpers.metrics_helper import TimedAsyncAdaptedQueuePool, TimedQueuePool, instrument_engine
+
+T = TypeVar('T')
+DatabaseSession = Union[Session, AsyncSession]
+
+
+def configure_sqlite_engine(engine: Engine, read_only: bool = False) -> None:
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {settings.SQLITE_BUSY_TIMEOUT_MS:d}')
+        cursor.execute(f'PRAGMA journal_mode = {settings.SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA mmap_size = {settings.SQLITE_MMAP_SIZE:d}')
+        cursor.execute(f'PRAGMA cache_size = {settings.SQLITE_CACHE_SIZE:d}')
+        cursor.execute(f'PRAGMA temp_store = {settings.SQLITE_TEMP_STORE}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+
+def create_sqlite_engine(database_uri: str, read_only: bool = False) -> Engine:
+    # Connections are kept open in a pool, so that their page cache and memory map outlive a single request
+    name = 'read' if read_only else 'write'
+    engine = create_engine(database_uri, pool_pre_ping=True, connect_args={"check_same_thread": False},
+                           poolclass=TimedQueuePool, pool_size=settings.DATABASE_POOL_SIZE,
+                           max_overflow=settings.DATABASE_MAX_OVERFLOW, pool_timeout=settings.DATABASE_POOL_TIMEOUT_S,
+                           pool_logging_name=name)
+    configure_sqlite_engine(engine, read_only=read_only)
+    instrument_engine(engine, name=name)
+    return engine
+
+
+def create_async_sqlite_engine(database_uri: str, read_only: bool = False) -> AsyncEngine:
+    name = 'async_read' if read_only else 'async_write'
+    async_engine = create_async_engine(database_uri, poolclass=TimedAsyncAdaptedQueuePool,
+                                       pool_size=settings.DATABASE_POOL_SIZE,
+                                       max_overflow=settings.DATABASE_MAX_OVERFLOW,
+                                       pool_timeout=settings.DATABASE_POOL_TIMEOUT_S, pool_logging_name=name)
+    configure_sqlite_engine(async_engine.sync_engine, read_only=read_only)
+    instrument_engine(async_engine.sync_engine, name=name)
+    return async_engine
+
 
-engine = create_engine(settings.DATABASE_URI, pool_pre_ping=True, connect_args={"check_same_thread": False})
+engine = create_sqlite_engine(settings.DATABASE_URI)
 sessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Read-only connections for the endpoints that only query data: with WAL, they are never blocked by writers
+read_engine = create_sqlite_engine(settings.DATABASE_URI, read_only=True)
+readSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
-def get_db() -> Session:
+# The async driver is only required when the async storage layer is enabled
+async_database_uri = settings.ASYNC_DATABASE_URI if settings.DATABASE_ASYNC else None
+async_engine = create_async_sqlite_engine(async_database_uri) if async_database_uri is not None else None
+asyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession)
+async_read_engine = (create_async_sqlite_engine(async_database_uri, read_only=True)
+                     if async_database_uri is not None else None)
+asyncReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=async_read_engine, class_=AsyncSession)
+
+
+def get_db() -> Iterator[Session]:
     db = sessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def get_read_db() -> Iterator[Session]:
+    db = readSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    db = asyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+async def get_async_read_db() -> AsyncIterator[AsyncSession]:
+    db = asyncReadSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+def get_engines() -> Dict[str, Engine]:
+    # By name, as in the metrics: the write engine is the one probed by the readiness check
+    engines = {'write': engine, 'read': read_engine}
+    if async_engine is not None and async_read_engine is not None:
+        engines.update(async_write=async_engine.sync_engine, async_read=async_read_engine.sync_engine)
+    return engines
+
+
+get_session = get_async_db if settings.DATABASE_ASYNC else get_db
+get_read_session = get_async_read_db if settings.DATABASE_ASYNC else get_read_db
+
+
+async def run_db(db: DatabaseSession, function: Callable[..., T], **kwargs: Any) -> T:
+    """
+    Runs a synchronous service function with the given session. With an async session, the function runs on the
+    event loop and its database calls are awaited through the async driver, instead of holding a worker thread.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(lambda session: function(db=session, **kwargs))
+    return await run_in_threadpool(function, db=db, **kwargs)
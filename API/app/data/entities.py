@@ -1,21 +1,28 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, DateTime, Integer, String
+from sqlalchemy import Boolean, Column, Date, DateTime, Index, Integer, String
 
 from app.data.database import Base
 
 
 class DialogDataEntityBase:
     id = Column(Integer, primary_key=True)
-    customer_id = Column(String, index=True)
-    dialog_id = Column(String)
+    customer_id = Column(String)
+    dialog_id = Column(String, index=True)
     text = Column(String)
     language = Column(String)
-    received_at_timestamp_utc = Column(DateTime, index=True, default=datetime.utcnow())
+    received_at_timestamp_utc = Column(DateTime, index=True, default=datetime.utcnow)
 
 
 class DialogDataEntity(Base, DialogDataEntityBase):
     __tablename__ = 'dialog_data'
+    # SQLite appends the rowid to every index entry, so these also cover the (timestamp, id) ordering of the listing
+    __table_args__ = (
+        Index('ix_dialog_data_language_received_at_timestamp_utc', 'language', 'received_at_timestamp_utc'),
+        Index('ix_dialog_data_customer_id_received_at_timestamp_utc', 'customer_id', 'received_at_timestamp_utc'),
+        # Ids of the rows moved to the partitions are never given again
+        {'sqlite_autoincrement': True},
+    )
 
 
 class TemporaryDialogDataEntity(Base, DialogDataEntityBase):
@@ -25,6 +32,58 @@ class TemporaryDialogDataEntity(Base, DialogDataEntityBase):
 class ConsentEntity(Base):
     __tablename__ = 'consents'
     id = Column(Integer, primary_key=True)
-    dialog_id = Column(String)
+    dialog_id = Column(String, index=True)
     has_given_consent = Column(Boolean)
-    received_at_timestamp_utc = Column(DateTime, index=True, default=datetime.utcnow())
+    received_at_timestamp_utc = Column(DateTime, index=True, default=datetime.utcnow)
+
+
+class PendingDialogEntity(Base):
+    __tablename__ = 'pending_dialogs'
+    dialog_id = Column(String, primary_key=True)
+    customer_id = Column(String)
+    first_received_at_timestamp_utc = Column(DateTime, index=True)
+    last_received_at_timestamp_utc = Column(DateTime)
+    message_count = Column(Integer)
+
+
+class ArchivedTemporaryDialogDataEntity(Base, DialogDataEntityBase):
+    __tablename__ = 'archived_temporary_dialog_data'
+
+
+class PurgedDialogEntity(Base):
+    __tablename__ = 'purged_dialogs'
+    id = Column(Integer, primary_key=True)
+    dialog_id = Column(String, index=True)
+    customer_id = Column(String)
+    first_received_at_timestamp_utc = Column(DateTime)
+    last_received_at_timestamp_utc = Column(DateTime)
+    message_count = Column(Integer)
+    action = Column(String)
+    purged_at_timestamp_utc = Column(DateTime, index=True)
+
+
+class DialogDataPartitionEntity(Base):
+    __tablename__ = 'dialog_data_partitions'
+    month = Column(String, primary_key=True)
+    file_name = Column(String)
+    state = Column(String)
+    row_count = Column(Integer)
+    max_id = Column(Integer)
+    first_received_at_timestamp_utc = Column(DateTime)
+    last_received_at_timestamp_utc = Column(DateTime)
+    updated_at_timestamp_utc = Column(DateTime)
+
+
+class DialogDataStatsEntity(Base):
+    __tablename__ = 'dialog_data_stats'
+    day = Column(Date, primary_key=True)
+    language = Column(String, primary_key=True)
+    customer_id = Column(String, primary_key=True)
+    message_count = Column(Integer)
+
+
+class ConsentStatsEntity(Base):
+    __tablename__ = 'consent_stats'
+    day = Column(Date, primary_key=True)
+    granted_count = Column(Integer)
+    denied_count = Column(Integer)
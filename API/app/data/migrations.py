@@ -0,0 +1,205 @@
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy.engine import Connection, Engine
+
+# Every migration has to be idempotent, and its DDL is written out as it was when the migration was added: entities
+# change over time, the schema a migration creates must not.
+# The version of the schema is stored in the user_version header field of the SQLite database.
+Migration = Callable[[Connection], None]
+
+
+def _create_initial_schema(connection: Connection) -> None:
+    for table_name in ('dialog_data', 'temporary_dialog_data'):
+        connection.exec_driver_sql(
+            f'CREATE TABLE IF NOT EXISTS {table_name} (id INTEGER NOT NULL, customer_id VARCHAR, dialog_id VARCHAR, '
+            'text VARCHAR, language VARCHAR, received_at_timestamp_utc DATETIME, PRIMARY KEY (id))'
+        )
+        connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{table_name}_customer_id ON {table_name} '
+                                   '(customer_id)')
+        connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{table_name}_received_at_timestamp_utc '
+                                   f'ON {table_name} (received_at_timestamp_utc)')
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS consents (id INTEGER NOT NULL, dialog_id VARCHAR, has_given_consent BOOLEAN, '
+        'received_at_timestamp_utc DATETIME, PRIMARY KEY (id))'
+    )
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_consents_received_at_timestamp_utc '
+                               'ON consents (received_at_timestamp_utc)')
+
+
+def _add_access_path_indexes(connection: Connection) -> None:
+    # Superseded by the composite (customer_id, received_at_timestamp_utc) index, or never used for filtering
+    connection.exec_driver_sql('DROP INDEX IF EXISTS ix_dialog_data_customer_id')
+    connection.exec_driver_sql('DROP INDEX IF EXISTS ix_temporary_dialog_data_customer_id')
+
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS ix_dialog_data_dialog_id ON dialog_data (dialog_id)',
+        'CREATE INDEX IF NOT EXISTS ix_dialog_data_language_received_at_timestamp_utc '
+        'ON dialog_data (language, received_at_timestamp_utc)',
+        'CREATE INDEX IF NOT EXISTS ix_dialog_data_customer_id_received_at_timestamp_utc '
+        'ON dialog_data (customer_id, received_at_timestamp_utc)',
+        'CREATE INDEX IF NOT EXISTS ix_temporary_dialog_data_dialog_id ON temporary_dialog_data (dialog_id)',
+        'CREATE INDEX IF NOT EXISTS ix_consents_dialog_id ON consents (dialog_id)',
+    ):
+        connection.exec_driver_sql(statement)
+
+
+def _add_pending_dialogs(connection: Connection) -> None:
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS pending_dialogs (dialog_id VARCHAR NOT NULL, customer_id VARCHAR, '
+        'first_received_at_timestamp_utc DATETIME, last_received_at_timestamp_utc DATETIME, message_count INTEGER, '
+        'PRIMARY KEY (dialog_id))'
+    )
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_pending_dialogs_first_received_at_timestamp_utc '
+                               'ON pending_dialogs (first_received_at_timestamp_utc)')
+    # SQLite takes the customer_id of the row holding the min() aggregate
+    connection.exec_driver_sql(
+        'INSERT OR IGNORE INTO pending_dialogs (dialog_id, customer_id, first_received_at_timestamp_utc, '
+        'last_received_at_timestamp_utc, message_count) '
+        'SELECT dialog_id, customer_id, min(received_at_timestamp_utc), max(received_at_timestamp_utc), count(*) '
+        'FROM temporary_dialog_data GROUP BY dialog_id'
+    )
+
+
+def _add_retention_tables(connection: Connection) -> None:
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS archived_temporary_dialog_data (id INTEGER NOT NULL, customer_id VARCHAR, '
+        'dialog_id VARCHAR, text VARCHAR, language VARCHAR, received_at_timestamp_utc DATETIME, PRIMARY KEY (id))'
+    )
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_archived_temporary_dialog_data_dialog_id '
+                               'ON archived_temporary_dialog_data (dialog_id)')
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_archived_temporary_dialog_data_received_at_timestamp_utc '
+                               'ON archived_temporary_dialog_data (received_at_timestamp_utc)')
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS purged_dialogs (id INTEGER NOT NULL, dialog_id VARCHAR, customer_id VARCHAR, '
+        'first_received_at_timestamp_utc DATETIME, last_received_at_timestamp_utc DATETIME, message_count INTEGER, '
+        'action VARCHAR, purged_at_timestamp_utc DATETIME, PRIMARY KEY (id))'
+    )
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_purged_dialogs_dialog_id ON purged_dialogs (dialog_id)')
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_purged_dialogs_purged_at_timestamp_utc '
+                               'ON purged_dialogs (purged_at_timestamp_utc)')
+
+
+def _add_dialog_data_partitions(connection: Connection) -> None:
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS dialog_data_partitions (month VARCHAR NOT NULL, file_name VARCHAR, state VARCHAR, '
+        'row_count INTEGER, max_id INTEGER, first_received_at_timestamp_utc DATETIME, '
+        'last_received_at_timestamp_utc DATETIME, updated_at_timestamp_utc DATETIME, PRIMARY KEY (month))'
+    )
+
+
+def _add_dialog_data_search_index(connection: Connection) -> None:
+    # Same index as the one created in the partitions by app.data.search_index, with triggers keeping it in sync with
+    # the promotions and the moves to the partitions, in the same transaction
+    connection.exec_driver_sql(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS dialog_data_fts USING fts5('
+        "text, content='dialog_data', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+    for statement in (
+        'CREATE TRIGGER IF NOT EXISTS dialog_data_fts_after_insert AFTER INSERT ON dialog_data BEGIN '
+        'INSERT INTO dialog_data_fts(rowid, text) VALUES (new.id, new.text); END',
+        'CREATE TRIGGER IF NOT EXISTS dialog_data_fts_after_delete AFTER DELETE ON dialog_data BEGIN '
+        "INSERT INTO dialog_data_fts(dialog_data_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+        'CREATE TRIGGER IF NOT EXISTS dialog_data_fts_after_update AFTER UPDATE OF text ON dialog_data BEGIN '
+        "INSERT INTO dialog_data_fts(dialog_data_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+        'INSERT INTO dialog_data_fts(rowid, text) VALUES (new.id, new.text); END',
+    ):
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql("INSERT INTO dialog_data_fts(dialog_data_fts) VALUES ('rebuild')")
+
+
+def _add_stats_rollups(connection: Connection) -> None:
+    # Sealed partitions cannot be attached within the migration: they are added by the stats rebuild command
+    for statement in (
+        'CREATE TABLE IF NOT EXISTS dialog_data_stats (day DATE NOT NULL, language VARCHAR NOT NULL, '
+        'customer_id VARCHAR NOT NULL, message_count INTEGER, PRIMARY KEY (day, language, customer_id))',
+        'CREATE TABLE IF NOT EXISTS consent_stats (day DATE NOT NULL, granted_count INTEGER, denied_count INTEGER, '
+        'PRIMARY KEY (day))',
+        # The WHERE clause lifts the ambiguity between the ON of a join and the ON CONFLICT of the upsert
+        'INSERT INTO dialog_data_stats (day, language, customer_id, message_count) '
+        'SELECT date(received_at_timestamp_utc), language, customer_id, count(*) FROM dialog_data WHERE true '
+        'GROUP BY date(received_at_timestamp_utc), language, customer_id '
+        'ON CONFLICT (day, language, customer_id) DO UPDATE SET '
+        'message_count = dialog_data_stats.message_count + excluded.message_count',
+        'INSERT INTO consent_stats (day, granted_count, denied_count) '
+        'SELECT date(received_at_timestamp_utc), sum(CASE WHEN has_given_consent THEN 1 ELSE 0 END), '
+        'sum(CASE WHEN has_given_consent THEN 0 ELSE 1 END) FROM consents WHERE true '
+        'GROUP BY date(received_at_timestamp_utc) '
+        'ON CONFLICT (day) DO UPDATE SET granted_count = consent_stats.granted_count + excluded.granted_count, '
+        'denied_count = consent_stats.denied_count + excluded.denied_count',
+    ):
+        connection.exec_driver_sql(statement)
+
+
+def _add_dialog_data_autoincrement(connection: Connection) -> None:
+    # Without AUTOINCREMENT, SQLite gives new rows the greatest id left plus one: once the newest rows are moved to a
+    # partition, their ids would be given again to the rows promoted next. The table is rebuilt with the same ids, so
+    # the search index stays valid, and the sequence starts after the greatest id ever given, sealed rows included.
+    table_sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'dialog_data'").scalar()
+    if 'AUTOINCREMENT' in table_sql:
+        return
+
+    for statement in (
+        'CREATE TABLE dialog_data_autoincrement (id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, customer_id VARCHAR, '
+        'dialog_id VARCHAR, text VARCHAR, language VARCHAR, received_at_timestamp_utc DATETIME)',
+        'INSERT INTO dialog_data_autoincrement (id, customer_id, dialog_id, text, language, received_at_timestamp_utc) '
+        'SELECT id, customer_id, dialog_id, text, language, received_at_timestamp_utc FROM dialog_data',
+        # Also drops the indexes of the table and the triggers keeping the search index in sync
+        'DROP TABLE dialog_data',
+        'ALTER TABLE dialog_data_autoincrement RENAME TO dialog_data',
+        'CREATE INDEX ix_dialog_data_dialog_id ON dialog_data (dialog_id)',
+        'CREATE INDEX ix_dialog_data_received_at_timestamp_utc ON dialog_data (received_at_timestamp_utc)',
+        'CREATE INDEX ix_dialog_data_language_received_at_timestamp_utc '
+        'ON dialog_data (language, received_at_timestamp_utc)',
+        'CREATE INDEX ix_dialog_data_customer_id_received_at_timestamp_utc '
+        'ON dialog_data (customer_id, received_at_timestamp_utc)',
+        'CREATE TRIGGER dialog_data_fts_after_insert AFTER INSERT ON dialog_data BEGIN '
+        'INSERT INTO dialog_data_fts(rowid, text) VALUES (new.id, new.text); END',
+        'CREATE TRIGGER dialog_data_fts_after_delete AFTER DELETE ON dialog_data BEGIN '
+        "INSERT INTO dialog_data_fts(dialog_data_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+        'CREATE TRIGGER dialog_data_fts_after_update AFTER UPDATE OF text ON dialog_data BEGIN '
+        "INSERT INTO dialog_data_fts(dialog_data_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+        'INSERT INTO dialog_data_fts(rowid, text) VALUES (new.id, new.text); END',
+        "DELETE FROM sqlite_sequence WHERE name = 'dialog_data'",
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'dialog_data', max("
+        'coalesce((SELECT max(id) FROM dialog_data), 0), '
+        'coalesce((SELECT max(max_id) FROM dialog_data_partitions), 0))',
+    ):
+        connection.exec_driver_sql(statement)
+
+
+MIGRATIONS: List[Tuple[str, Migration]] = [
+    ('Create the dialog data, temporary dialog data and consent tables', _create_initial_schema),
+    ('Add the indexes matching the dialog data and consent access paths', _add_access_path_indexes),
+    ('Add the summary of the dialogs waiting for a consent decision', _add_pending_dialogs),
+    ('Add the archive of the expired temporary dialog data and the record of the purged dialogs',
+     _add_retention_tables),
+    ('Add the registry of the monthly partitions of the dialog data', _add_dialog_data_partitions),
+    ('Add the full-text search index of the dialog data', _add_dialog_data_search_index),
+    ('Add the rollups of the dialog data and consent statistics', _add_stats_rollups),
+    ('Never reuse the ids of the dialog data moved to the partitions', _add_dialog_data_autoincrement),
+]
+
+
+def get_schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def run_migrations(engine: Engine) -> None:
+    """
+    Applies the migrations the database is missing, each in its own transaction. The transaction takes the write lock
+    before reading the version, so that workers starting together never apply the same migration twice.
+    """
+    with engine.connect() as connection:
+        if get_schema_version(connection) >= len(MIGRATIONS):
+            return
+
+    for version, (description, migration) in enumerate(MIGRATIONS, start=1):
+        with engine.begin() as connection:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+            if get_schema_version(connection) >= version:
+                continue
+
+            logging.info(f'Migrating database schema to version {version}: {description}')
+            migration(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {version}')
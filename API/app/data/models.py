@@ -1,4 +1,5 @@
-from datetime import datetime
+from datetime import date, datetime
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -8,6 +9,11 @@ class DialogDataCreateModel(BaseModel):
     language: str
 
 
+class DialogDataBatchItemModel(DialogDataCreateModel):
+    customer_id: str
+    dialog_id: str
+
+
 class DialogDataModel(DialogDataCreateModel):
     id: int
     customer_id: str
@@ -31,7 +37,69 @@ class ConsentModel(ConsentCreateModel):
         orm_mode = True
 
 
+class ConsentBatchItemModel(ConsentCreateModel):
+    dialog_id: str
+
+
+class ConsentBatchResultModel(BaseModel):
+    dialog_id: str
+    status_code: int
+    detail: Optional[str] = None
+    consent: Optional[ConsentModel] = None
+
+
 class AnomalyDataModel(BaseModel):
     dialog_id: str
     customer_id: str
     received_at_timestamp_utc: datetime
+    last_received_at_timestamp_utc: datetime
+    message_count: int
+
+
+class MessageStatsModel(BaseModel):
+    total: int
+    by_language: Dict[str, int]
+    by_customer: Dict[str, int]
+    by_day: Dict[date, int]
+
+
+class ConsentCountsModel(BaseModel):
+    granted: int
+    denied: int
+    grant_ratio: Optional[float]
+
+
+class ConsentStatsModel(ConsentCountsModel):
+    by_day: Dict[date, ConsentCountsModel]
+
+
+class PendingStatsModel(BaseModel):
+    dialogs: int
+    messages: int
+
+
+class StatsModel(BaseModel):
+    messages: MessageStatsModel
+    consents: ConsentStatsModel
+    pending: PendingStatsModel
+
+
+class PoolStatsModel(BaseModel):
+    size: int
+    max_overflow: Optional[int]
+    checked_in: int
+    checked_out: int
+    overflow: int
+    usage: Optional[float]
+
+
+class DatabaseProbeModel(BaseModel):
+    latency_ms: Optional[float]
+    error: Optional[str]
+
+
+class ReadinessModel(BaseModel):
+    ready: bool
+    failures: List[str]
+    database: DatabaseProbeModel
+    pools: Dict[str, PoolStatsModel]
@@ -0,0 +1,47 @@
+from typing import Optional
+
+from sqlalchemy import Float, Integer, String, column, table
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.expression import TableClause
+
+SEARCH_TABLE_NAME = 'dialog_data_fts'
+
+
+def get_search_table(schema: Optional[str] = None) -> TableClause:
+    # The FTS5 virtual table cannot be declared as an entity: it is created by the migrations, and queried from here
+    return table(SEARCH_TABLE_NAME, column('rowid', Integer), column('text', String), column('rank', Float),
+                 schema=schema)
+
+
+def create_search_table(connection: Connection, schema: str = 'main') -> None:
+    """
+    The index only stores the tokens of dialog_data.text: with an external content table, the text itself is read
+    from the indexed table, so the index does not duplicate it. Diacritics are removed so that searches match the
+    texts of every language regardless of accents.
+    """
+    connection.exec_driver_sql(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{schema}".{SEARCH_TABLE_NAME} USING fts5('
+        "text, content='dialog_data', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def rebuild_search_index(connection: Connection, schema: str = 'main') -> None:
+    connection.exec_driver_sql(f'INSERT INTO "{schema}".{SEARCH_TABLE_NAME}({SEARCH_TABLE_NAME}) VALUES (\'rebuild\')')
+
+
+def create_search_triggers(connection: Connection) -> None:
+    # Rows are promoted on consent and moved to the partitions by plain inserts and deletes: the triggers keep the
+    # index in sync with all of them, in the same transaction
+    connection.exec_driver_sql(
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE_NAME}_after_insert AFTER INSERT ON dialog_data BEGIN '
+        f'INSERT INTO {SEARCH_TABLE_NAME}(rowid, text) VALUES (new.id, new.text); END'
+    )
+    connection.exec_driver_sql(
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE_NAME}_after_delete AFTER DELETE ON dialog_data BEGIN '
+        f'INSERT INTO {SEARCH_TABLE_NAME}({SEARCH_TABLE_NAME}, rowid, text) VALUES (\'delete\', old.id, old.text); END'
+    )
+    connection.exec_driver_sql(
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE_NAME}_after_update AFTER UPDATE OF text ON dialog_data BEGIN '
+        f'INSERT INTO {SEARCH_TABLE_NAME}({SEARCH_TABLE_NAME}, rowid, text) VALUES (\'delete\', old.id, old.text); '
+        f'INSERT INTO {SEARCH_TABLE_NAME}(rowid, text) VALUES (new.id, new.text); END'
+    )
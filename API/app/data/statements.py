@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import Table, insert, literal
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import ColumnElement, Select
+
+
+def insert_from_select(table: Table, columns: List[str], rows: Select, stamp_column: str,
+                       db: Session) -> Tuple[int, ColumnElement]:
+    """
+    Inserts the selected rows, with the time of the statement in stamp_column, and returns the number of rows inserted
+    and the condition matching them, to read them back in the same transaction. SQLAlchemy only renders RETURNING for
+    SQLite from version 2.0, and the ids SQLite gives are not guaranteed to be consecutive: callers identify the rows
+    by their natural key and this stamp instead.
+    """
+    stamp = datetime.utcnow()
+    result = db.execute(insert(table).from_select(columns + [stamp_column], rows.add_columns(literal(stamp))))
+    return result.rowcount, table.c[stamp_column] == stamp
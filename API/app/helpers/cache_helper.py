@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, NamedTuple, Optional
+
+from fastapi import Response
+
+from app.config.config import settings
+from app.helpers.metrics_helper import (query_cache_entries, query_cache_evictions, query_cache_requests,
+                                        query_cache_size)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    headers: Dict[str, str]
+    expires_at: float
+
+    def to_response(self, media_type: str = 'application/json') -> Response:
+        return Response(content=self.body, media_type=media_type, headers={**self.headers, 'X-Cache': 'HIT'})
+
+
+class QueryResultCache:
+    """
+    In-process LRU cache of serialized responses, bounded in memory and in time.
+    Whoever changes the underlying data calls invalidate(), which bumps the generation of the cache: results computed
+    from an older generation are never stored, so a stale result cannot be cached after an invalidation.
+    Hits, misses, evictions and the size of the cache are exposed as metrics, labelled with the name of the cache.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.generation = 0
+        self.size_bytes = 0
+        self._entries: 'OrderedDict[Hashable, CachedResponse]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        if not settings.QUERY_CACHE_ENABLED:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                query_cache_requests.labels(cache=self.name, result='hit').inc()
+                return entry
+
+            if entry is not None:
+                self._remove(key)
+                self._observe_size()
+            query_cache_requests.labels(cache=self.name, result='miss').inc()
+            return None
+
+    def put(self, key: Hashable, generation: int, body: bytes, headers: Dict[str, str]) -> None:
+        if not settings.QUERY_CACHE_ENABLED or len(body) > settings.QUERY_CACHE_MAX_BYTES:
+            return
+
+        with self._lock:
+            if generation != self.generation:
+                return
+
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedResponse(body=body, headers=headers,
+                                                expires_at=time.monotonic() + settings.QUERY_CACHE_TTL_MS / 1000)
+            self.size_bytes += len(body)
+
+            while self.size_bytes > settings.QUERY_CACHE_MAX_BYTES:
+                self._remove(next(iter(self._entries)))
+                query_cache_evictions.labels(cache=self.name).inc()
+            self._observe_size()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size_bytes = 0
+            self._observe_size()
+
+    def _remove(self, key: Hashable) -> None:
+        self.size_bytes -= len(self._entries.pop(key).body)
+
+    def _observe_size(self) -> None:
+        query_cache_entries.labels(cache=self.name).set(len(self._entries))
+        query_cache_size.labels(cache=self.name).set(self.size_bytes)
+
+
+dialog_data_cache = QueryResultCache(name='dialog_data')
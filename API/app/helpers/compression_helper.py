@@ -0,0 +1,155 @@
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config.config import settings
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+class GzipCompressor:
+    def __init__(self) -> None:
+        # A window size of 31 produces the gzip container instead of the raw zlib one
+        self.compressor = zlib.compressobj(settings.COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, is_last: bool) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH)
+
+
+class ZstdCompressor:
+    def __init__(self) -> None:
+        self.compressor = zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes, is_last: bool) -> bytes:
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_FINISH if is_last else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self.compressor.compress(data) + self.compressor.flush(flush_mode)
+
+
+class BrotliCompressor:
+    def __init__(self) -> None:
+        self.compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes, is_last: bool) -> bytes:
+        compressed_data = self.compressor.process(data)
+        return compressed_data + (self.compressor.finish() if is_last else self.compressor.flush())
+
+
+# Formats that are compressed already
+INCOMPRESSIBLE_MEDIA_TYPES = ('application/vnd.apache.parquet',)
+
+# By order of preference, when the client accepts several encodings with the same weight
+COMPRESSORS: List[Tuple[str, Callable[[], Any]]] = [
+    (encoding, compressor) for encoding, compressor, module in (
+        ('zstd', ZstdCompressor, zstandard),
+        ('br', BrotliCompressor, brotli),
+        ('gzip', GzipCompressor, zlib),
+    ) if module is not None
+]
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    weights: Dict[str, float] = {}
+    for accepted in accept_encoding.split(','):
+        encoding, _, parameters = accepted.strip().partition(';')
+        try:
+            weights[encoding.strip().lower()] = float(parameters.strip()[2:]) if parameters.strip()[:2] == 'q=' else 1
+        except ValueError:
+            continue
+
+    candidates = [(weights.get(encoding, weights.get('*', 0)), -rank, encoding)
+                  for rank, (encoding, _) in enumerate(COMPRESSORS)]
+    weight, _, encoding = max(candidates)
+    return encoding if weight > 0 else None
+
+
+def weaken_etag(headers: MutableHeaders) -> None:
+    # The encoded body is not byte-for-byte the representation the strong validator was computed for
+    etag = headers.get('etag')
+    if etag is not None and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with the best encoding accepted by the client. Bodies are compressed message by message and
+    flushed after each of them, so streamed responses are neither buffered nor delayed.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding', '')) \
+            if scope['type'] == 'http' else None
+
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await CompressionResponder(self.app, encoding)(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str) -> None:
+        self.app = app
+        self.encoding = encoding
+        self.send: Send
+        self.start_message: Message = {}
+        self.compressor: Optional[Any] = None
+        self.is_passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message['type'] == 'http.response.start':
+            # Held back until the first body message tells whether the response is worth compressing
+            self.start_message = message
+        elif self.is_passthrough:
+            await self.send(message)
+        elif self.compressor is None:
+            await self.send_first_body(message)
+        else:
+            await self.send_next_body(self.compressor, message)
+
+    async def send_first_body(self, message: Message) -> None:
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        headers = MutableHeaders(raw=self.start_message['headers'])
+
+        if 'content-encoding' in headers or headers.get('content-type', '').startswith(INCOMPRESSIBLE_MEDIA_TYPES) \
+                or (not more_body and len(body) < settings.COMPRESSION_MINIMUM_SIZE):
+            self.is_passthrough = True
+            await self.send(self.start_message)
+            await self.send(message)
+            return
+
+        self.compressor = dict(COMPRESSORS)[self.encoding]()
+        compressed_body = self.compressor.compress(body, is_last=not more_body)
+
+        headers['Content-Encoding'] = self.encoding
+        headers.add_vary_header('Accept-Encoding')
+        weaken_etag(headers)
+        if more_body:
+            del headers['Content-Length']
+        else:
+            headers['Content-Length'] = str(len(compressed_body))
+
+        await self.send(self.start_message)
+        await self.send({'type': 'http.response.body', 'body': compressed_body, 'more_body': more_body})
+
+    async def send_next_body(self, compressor: Any, message: Message) -> None:
+        more_body = message.get('more_body', False)
+        compressed_body = compressor.compress(message.get('body', b''), is_last=not more_body)
+        await self.send({'type': 'http.response.body', 'body': compressed_body, 'more_body': more_body})
@@ -0,0 +1,32 @@
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Any, List, Type, Union
+
+from fastapi import HTTPException
+
+CursorValue = Union[str, int, float, datetime]
+
+
+def encode_cursor(*values: CursorValue) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str, *value_types: Type[CursorValue]) -> List[Any]:
+    try:
+        payload = json.loads(urlsafe_b64decode(cursor.encode()))
+        if not isinstance(payload, list) or len(payload) != len(value_types):
+            raise ValueError(cursor)
+        return [_parse_cursor_value(value, value_type) for value, value_type in zip(payload, value_types)]
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail=f'Invalid cursor {cursor}')
+
+
+def _parse_cursor_value(value: Any, value_type: Type[CursorValue]) -> CursorValue:
+    if value_type is datetime:
+        return datetime.fromisoformat(value)
+    if not isinstance(value, value_type) or isinstance(value, bool):
+        raise TypeError(value)
+    return value
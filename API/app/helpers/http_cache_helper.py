@@ -0,0 +1,31 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from hashlib import blake2b
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+
+def compute_etag(*parts: Any) -> str:
+    return f'"{blake2b(repr(parts).encode(), digest_size=12).hexdigest()}"'
+
+
+def build_validator_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is None:
+        return False
+
+    # Weak comparison, as required for If-None-Match
+    candidate_etags = {candidate.strip().replace('W/', '', 1) for candidate in if_none_match.split(',')}
+    return '*' in candidate_etags or etag.replace('W/', '', 1) in candidate_etags
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,32 @@
+import json
+from typing import Any
+
+from fastapi import Response
+from pydantic.json import pydantic_encoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+
+    # Same encoding as the JSON responses of FastAPI
+    return json.dumps(content, default=pydantic_encoder, ensure_ascii=False, allow_nan=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response whose content is either already serialized, or serialized with orjson when it is installed.
+    Unlike JSONResponse, the content is not validated against a response model.
+    """
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -1,53 +1,132 @@
+import atexit
+import json
 import logging
 import os
-from typing import Any, Callable, Coroutine
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, Callable, Coroutine, Dict, Optional
 
 from fastapi import Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.logger import logger as fastapi_logger
 from fastapi.routing import APIRoute
-from starlette.background import BackgroundTask
+from starlette.exceptions import HTTPException
 from starlette.requests import Request as StarletteRequest
 from starlette.responses import StreamingResponse
 
+from app.config.config import settings
+from app.helpers.metrics_helper import http_request_duration, http_requests, http_requests_in_progress
+
+request_logger = logging.getLogger('app.requests')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        log_record = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        log_record.update(getattr(record, 'request_info', {}))
+        return json.dumps(log_record, default=str)
+
 
 # https://stackoverflow.com/a/73464007
 class LoggingRoute(APIRoute):
-    @staticmethod
-    def log_request_info(request: Request, response: Response, req_body: Request, res_body: Request) -> None:
-        logging.info(
-            f'URL: {request.url}, '
-            f'QUERY_PARAMS: {request.query_params}, '
-            f'PATH_PARAMS: {request.path_params}, '
-            f'HEADERS: {request.headers}, '
-            f'REQUEST_BODY: {req_body}, '
-            f'RESPONSE_STATUS: {response.status_code}, '
-            f'RESPONSE_BODY: {res_body}, '
-        )
+    def is_sampled(self) -> bool:
+        sample_rate = settings.LOG_ROUTE_SAMPLE_RATES.get(self.path, settings.LOG_SAMPLE_RATE)
+        return sample_rate >= 1 or random.random() < sample_rate
+
+    def truncate_body(self, body: Optional[bytes]) -> Dict[str, Any]:
+        if body is None:
+            return {'body': '<streamed>'}
+
+        body_max_bytes = settings.LOG_ROUTE_BODY_MAX_BYTES.get(self.path, settings.LOG_BODY_MAX_BYTES)
+        return {
+            'body': body[:body_max_bytes].decode('utf-8', errors='replace'),
+            'body_size': len(body),
+            'body_truncated': len(body) > body_max_bytes
+        }
+
+    def build_request_info(self, request: Request, response: Response, req_body: bytes,
+                           duration_ms: float) -> Dict[str, Any]:
+        # Streamed bodies are passed through as they are produced, buffering them would defeat streaming
+        res_body = None if isinstance(response, StreamingResponse) else response.body
+        return {
+            'method': request.method,
+            'url': str(request.url),
+            'route': self.path,
+            'query_params': dict(request.query_params),
+            'path_params': request.path_params,
+            'headers': dict(request.headers),
+            'request': self.truncate_body(req_body),
+            'response_status': response.status_code,
+            'response': self.truncate_body(res_body),
+            'duration_ms': round(duration_ms, 3),
+        }
+
+    async def handle_logged(self, route_handler: Callable[[Request], Coroutine[Any, Any, Response]],
+                            request: Request) -> Response:
+        if not self.is_sampled():
+            return await route_handler(request)
+
+        start = time.perf_counter()
+        req_body = await request.body()
+        response = await route_handler(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        # The record is only built here: it is formatted and written by the listener thread of the queue
+        request_logger.info('request', extra={
+            'request_info': self.build_request_info(request, response, req_body, duration_ms)
+        })
+        return response
 
     def get_route_handler(self) -> Callable[[StarletteRequest], Coroutine[Any, Any, Response]]:
         original_route_handler = super().get_route_handler()
 
         async def custom_route_handler(request: Request) -> Response:
-            req_body = await request.body()
-            response = await original_route_handler(request)
-
-            if isinstance(response, StreamingResponse):
-                res_body = b''
-                async for item in response.body_iterator:
-                    res_body += item
-
-                task = BackgroundTask(LoggingRoute.log_request_info, request, response, req_body, res_body)
-                return Response(content=res_body, status_code=response.status_code,
-                                headers=dict(response.headers), media_type=response.media_type, background=task)
-            else:
-                res_body = response.body
-                response.background = BackgroundTask(LoggingRoute.log_request_info, request,
-                                                     response, req_body, res_body)
+            # Every request is measured, whether it is logged or not
+            in_progress = http_requests_in_progress.labels(method=request.method, route=self.path)
+            in_progress.inc()
+            start = time.perf_counter()
+            status_code = 500
+            try:
+                response = await self.handle_logged(original_route_handler, request)
+                status_code = response.status_code
                 return response
+            except HTTPException as exception:
+                status_code = exception.status_code
+                raise
+            except RequestValidationError:
+                status_code = 422
+                raise
+            finally:
+                in_progress.dec()
+                labels = {'method': request.method, 'route': self.path, 'status': str(status_code)}
+                http_requests.labels(**labels).inc()
+                http_request_duration.labels(**labels).observe(time.perf_counter() - start)
 
         return custom_route_handler
 
 
+def set_up_request_logging(handler: logging.Handler) -> None:
+    handler.setFormatter(JsonFormatter())
+    log_queue: 'SimpleQueue[logging.LogRecord]' = SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+
+    request_logger.handlers = [QueueHandler(log_queue)]
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+
+    listener.start()
+    atexit.register(listener.stop)
+
+
 # https://github.com/tiangolo/uvicorn-gunicorn-fastapi-docker/issues/19#issuecomment-885595200
 def set_up_logging() -> None:
     if "gunicorn" in os.environ.get("SERVER_SOFTWARE", ""):
@@ -68,3 +147,5 @@ def set_up_logging() -> None:
             level=logging.INFO,
             format=logging_format
         )
+
+    set_up_request_logging(logging.StreamHandler())
@@ -0,0 +1,98 @@
+import os
+import time
+from typing import Any
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Metrics are written to files shared by the workers when PROMETHEUS_MULTIPROC_DIR is set, see the README
+MULTIPROCESS_DIRECTORY_VARIABLE = 'PROMETHEUS_MULTIPROC_DIR'
+DATABASE_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+http_requests = Counter('http_requests_total', 'Requests handled, by route and status',
+                        ['method', 'route', 'status'])
+http_requests_in_progress = Gauge('http_requests_in_progress', 'Requests being handled, by route',
+                                  ['method', 'route'], multiprocess_mode='livesum')
+http_request_duration = Histogram('http_request_duration_seconds',
+                                  'Time until the response is returned by the route handler, by route and status',
+                                  ['method', 'route', 'status'])
+sql_statements = Counter('sql_statements_total', 'SQL statements executed, by engine and operation',
+                         ['engine', 'operation'])
+sql_statement_duration = Histogram('sql_statement_duration_seconds', 'Duration of the SQL statements',
+                                   ['engine', 'operation'], buckets=DATABASE_BUCKETS)
+pool_checkout_wait = Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection',
+                               ['engine'], buckets=DATABASE_BUCKETS)
+ingested_rows = Counter('dialog_data_ingested_rows_total', 'Messages stored as temporary dialog data')
+promoted_rows = Counter('dialog_data_promoted_rows_total', 'Messages promoted to the dialog data on consent')
+purged_rows = Counter('dialog_data_purged_rows_total', 'Expired temporary messages purged by the retention worker',
+                      ['action'])
+query_cache_requests = Counter('query_cache_requests_total', 'Lookups of the query result cache, by cache and result',
+                               ['cache', 'result'])
+query_cache_evictions = Counter('query_cache_evictions_total', 'Entries evicted from the query result cache to stay '
+                                'under QUERY_CACHE_MAX_BYTES', ['cache'])
+query_cache_entries = Gauge('query_cache_entries', 'Entries held by the query result cache', ['cache'],
+                            multiprocess_mode='livesum')
+query_cache_size = Gauge('query_cache_size_bytes', 'Size of the bodies held by the query result cache', ['cache'],
+                         multiprocess_mode='livesum')
+
+
+def get_statement_operation(statement: str) -> str:
+    keywords = statement.split(None, 1)
+    return keywords[0].upper() if len(keywords) > 0 else 'UNKNOWN'
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    # The start time is kept on the execution context, which is discarded with the statement if it fails
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_statement_timer(connection: Any, cursor: Any, statement: str, parameters: Any, context: Any,
+                              executemany: bool) -> None:
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def observe_statement(connection: Any, cursor: Any, statement: str, parameters: Any, context: Any,
+                          executemany: bool) -> None:
+        duration = time.perf_counter() - context._query_start
+        operation = get_statement_operation(statement)
+        sql_statements.labels(engine=name, operation=operation).inc()
+        sql_statement_duration.labels(engine=name, operation=operation).observe(duration)
+
+
+class CheckoutTimingMixin:
+    """
+    SQLAlchemy has no event before a connection is checked out of a pool, so the wait is measured around the internal
+    method that blocks until a connection is available. The engine name is the logging name of the pool.
+    """
+    logging_name: str
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()  # type: ignore
+        finally:
+            pool_checkout_wait.labels(engine=self.logging_name).observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(CheckoutTimingMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def generate_metrics() -> bytes:
+    if MULTIPROCESS_DIRECTORY_VARIABLE not in os.environ:
+        return generate_latest(REGISTRY)
+
+    # Every call aggregates the files written by all the workers
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_worker_stopped() -> None:
+    # Removes the live gauges of the worker, so that its in-flight requests are not counted once it has stopped
+    if MULTIPROCESS_DIRECTORY_VARIABLE in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,19 +1,31 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import inspect
 
 import app.helpers.logging_helper as logging_helper
 from app.config.config import settings
 from app.controllers.consent_controller import consent_router
 from app.controllers.data_controller import data_router
 from app.controllers.health_controller import health_router
-from app.data.database import Base, engine
+from app.controllers.metrics_controller import metrics_router
+from app.controllers.stats_controller import stats_router
+from app.data.database import engine, sessionLocal
+from app.data.migrations import run_migrations
+from app.helpers.compression_helper import CompressionMiddleware
+from app.helpers.metrics_helper import mark_worker_stopped
+from app.services.consent_index_service import consent_index
+from app.services.group_commit_service import ingest_buffer
+from app.services.retention_service import retention_worker
+from app.services.temporary_store_service import temporary_store
 
 app = FastAPI(title=settings.PROJECT_NAME)
 
 app.include_router(health_router)
 app.include_router(data_router)
 app.include_router(consent_router)
+app.include_router(stats_router)
+app.include_router(metrics_router)
+
+app.add_middleware(CompressionMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,9 +33,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Export-Watermark"],
 )
 
 logging_helper.set_up_logging()
 
-if not inspect(engine).has_table("temporary_dialog_data"):
-    Base.metadata.create_all(engine)
+
+@app.on_event("startup")
+def apply_migrations() -> None:
+    # Also run by the prestart script of the Docker image before the workers start, this is then a no-op
+    run_migrations(engine)
+
+
+@app.on_event("startup")
+def warm_consent_index() -> None:
+    db = sessionLocal()
+    try:
+        consent_index.refresh(db)
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def start_temporary_store() -> None:
+    # Started before the first request, so that ingestion only touches memory
+    if temporary_store.enabled:
+        temporary_store.start()
+
+
+@app.on_event("startup")
+def start_retention_worker() -> None:
+    if settings.RETENTION_ENABLED:
+        retention_worker.start()
+
+
+@app.on_event("shutdown")
+def stop_retention_worker() -> None:
+    retention_worker.stop()
+
+
+@app.on_event("shutdown")
+def flush_ingest_buffer() -> None:
+    ingest_buffer.stop()
+
+
+@app.on_event("shutdown")
+def spill_temporary_store() -> None:
+    temporary_store.stop()
+
+
+@app.on_event("shutdown")
+def remove_worker_metrics() -> None:
+    mark_worker_stopped()
@@ -0,0 +1,8 @@
+#! /usr/bin/env bash
+
+# Run by the base image before gunicorn starts: metrics of the previous run must not be aggregated with the new ones
+rm -rf "${PROMETHEUS_MULTIPROC_DIR:?}"
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+
+# Workers only check that the schema is up to date when they start
+python -m app.cli migrate
@@ -0,0 +1,59 @@
+import threading
+from typing import Iterable, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config.config import settings
+from app.data.entities import ConsentEntity
+
+
+class ConsentIndex:
+    """
+    In-process set of the dialogs that received a consent decision, so that checking whether a dialog has decided does
+    not query the database. Consents are never deleted: a dialog found in the index has decided for sure. A dialog that
+    is not found may have decided in another process since the last refresh, the database is still the reference then.
+    refresh() reads the consents saved since the last one, and reloads everything if the consents table was emptied.
+    """
+
+    def __init__(self) -> None:
+        self.last_consent_id = 0
+        self._dialog_ids: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._dialog_ids)
+
+    def contains(self, dialog_id: str) -> bool:
+        return settings.CONSENT_INDEX_ENABLED and dialog_id in self._dialog_ids
+
+    def add(self, dialog_ids: Iterable[str]) -> None:
+        # Consents committed by this process are added right away, the next refresh reads them again
+        if settings.CONSENT_INDEX_ENABLED:
+            with self._lock:
+                self._dialog_ids.update(dialog_ids)
+
+    def refresh(self, db: Session) -> None:
+        if not settings.CONSENT_INDEX_ENABLED:
+            return
+
+        with self._lock:
+            last_consent_id = db.query(func.max(ConsentEntity.id)).scalar() or 0
+            if last_consent_id < self.last_consent_id:
+                self._dialog_ids = set()
+                self.last_consent_id = 0
+
+            new_consents = (db.query(ConsentEntity.id, ConsentEntity.dialog_id)
+                            .filter(ConsentEntity.id > self.last_consent_id)
+                            .filter(ConsentEntity.id <= last_consent_id)
+                            .yield_per(settings.STREAM_BATCH_SIZE))
+            self._dialog_ids.update(dialog_id for _, dialog_id in new_consents)
+            self.last_consent_id = last_consent_id
+
+    def reset(self) -> None:
+        with self._lock:
+            self._dialog_ids = set()
+            self.last_consent_id = 0
+
+
+consent_index = ConsentIndex()
@@ -1,20 +1,60 @@
+from typing import Any, Collection, Dict, Iterable, List, Optional, Tuple
+
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Boolean, Integer, String, and_, column, delete, exists, insert, or_, select, table
 from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import ColumnElement
+
+from app.data.entities import ConsentEntity, DialogDataEntity, PendingDialogEntity, TemporaryDialogDataEntity
+from app.data.models import ConsentBatchItemModel, ConsentModel
+from app.data.statements import insert_from_select
+from app.helpers.cache_helper import dialog_data_cache
+from app.helpers.metrics_helper import promoted_rows
+from app.services.consent_index_service import consent_index
+from app.services.stats_service import (build_consent_stats_upsert, build_dialog_data_stats_upsert,
+                                        record_consent_stats, record_message_stats)
+from app.services.temporary_store_service import temporary_store
+
+PROMOTED_COLUMNS = ['customer_id', 'dialog_id', 'text', 'language', 'received_at_timestamp_utc']
+# The decisions of a batch are loaded in a temporary table of the connection, then checked and applied by joins
+CONSENT_BATCH = table('consent_batch', column('position', Integer), column('dialog_id', String),
+                      column('has_given_consent', Boolean), column('in_memory', Boolean))
+
+
+async def take_stored_dialog_data(dialog_ids: Collection[str]) -> Dict[str, List[TemporaryDialogDataEntity]]:
+    # Messages kept in memory by the temporary store are taken out for the consent transaction. Taking them waits for
+    # the dialogs being spilled: it runs on a worker thread, as the transaction may run on the event loop
+    if not temporary_store.enabled:
+        return {}
+    return await run_in_threadpool(temporary_store.take, dialog_ids)
 
-from app.data.entities import ConsentEntity, DialogDataEntity, TemporaryDialogDataEntity
-from app.data.models import ConsentModel
 
+def save_user_consent(dialog_id: str, has_given_consent: bool, stored_dialog_data: List[TemporaryDialogDataEntity],
+                      db: Session) -> ConsentModel:
+    # The messages taken from the temporary store are given back if the consent is rejected or its transaction fails
+    try:
+        # Repeated decisions are answered from the consent index, without querying the database
+        has_decided = consent_index.contains(dialog_id) or db.query(
+            exists().where(ConsentEntity.dialog_id == dialog_id)).scalar()
 
-def save_user_consent(dialog_id: str, has_given_consent: bool, db: Session) -> ConsentModel:
-    existing_consent = db.query(ConsentEntity).filter(ConsentEntity.dialog_id == dialog_id).first()
+        if has_decided:
+            raise HTTPException(status_code=409,
+                                detail=f'Consent was already given or denied for dialog_id {dialog_id}')
 
-    if existing_consent is not None:
-        raise HTTPException(status_code=409, detail=f'Consent was already given or denied for dialog_id {dialog_id}')
+        return apply_user_consent(dialog_id=dialog_id, has_given_consent=has_given_consent,
+                                  stored_dialog_data=stored_dialog_data, db=db)
+    except Exception:
+        temporary_store.restore(stored_dialog_data)
+        raise
 
-    existing_temporary_data = (db.query(TemporaryDialogDataEntity)
-                               .filter(TemporaryDialogDataEntity.dialog_id == dialog_id).all())
 
-    if len(existing_temporary_data) == 0:
+def apply_user_consent(dialog_id: str, has_given_consent: bool, stored_dialog_data: List[TemporaryDialogDataEntity],
+                       db: Session) -> ConsentModel:
+    has_temporary_data = len(stored_dialog_data) > 0 or db.query(
+        exists().where(PendingDialogEntity.dialog_id == dialog_id)).scalar()
+
+    if not has_temporary_data:
         raise HTTPException(status_code=404, detail=f'Cannot give consent: no temporary data for dialog_id {dialog_id}')
 
     consent_to_insert = ConsentEntity(
@@ -24,18 +64,183 @@ def save_user_consent(dialog_id: str, has_given_consent: bool, db: Session) -> C
 
     db.add(consent_to_insert)
 
-    for temporary_entry in existing_temporary_data:
-        if has_given_consent:
-            db.add(DialogDataEntity(
-                customer_id=temporary_entry.customer_id,
-                text=temporary_entry.text,
-                language=temporary_entry.language,
-                received_at_timestamp_utc=temporary_entry.received_at_timestamp_utc,
-                dialog_id=temporary_entry.dialog_id
-            ))
+    promoted_count = 0
+    if has_given_consent:
+        promoted_count = promote_temporary_dialog_data(dialog_id=dialog_id, db=db)
+        promoted_count += promote_stored_dialog_data(stored_dialog_data, db=db)
+        record_message_stats(stored_dialog_data, db=db)
+    record_consent_stats(dialog_id=dialog_id, has_given_consent=has_given_consent, db=db)
 
-        db.delete(temporary_entry)
+    db.query(TemporaryDialogDataEntity).filter(TemporaryDialogDataEntity.dialog_id == dialog_id).delete(
+        synchronize_session=False)
+    db.query(PendingDialogEntity).filter(PendingDialogEntity.dialog_id == dialog_id).delete(
+        synchronize_session=False)
 
     db.commit()
+    consent_index.add([dialog_id])
+    promoted_rows.inc(promoted_count)
+
+    if has_given_consent:
+        dialog_data_cache.invalidate()
+
     db.refresh(consent_to_insert)
     return consent_to_insert
+
+
+def promote_temporary_dialog_data(dialog_id: str, db: Session) -> int:
+    temporary_data = TemporaryDialogDataEntity.__table__
+    return promote_temporary_dialogs(temporary_data.c.dialog_id == dialog_id, db=db)
+
+
+def promote_temporary_dialogs(condition: Any, db: Session) -> int:
+    temporary_data = TemporaryDialogDataEntity.__table__
+    result = db.execute(
+        insert(DialogDataEntity.__table__).from_select(
+            PROMOTED_COLUMNS,
+            select([temporary_data.c[column] for column in PROMOTED_COLUMNS])
+            .where(condition)
+            .order_by(temporary_data.c.id)
+        )
+    )
+    return result.rowcount
+
+
+def promote_stored_dialog_data(dialog_data: Iterable[TemporaryDialogDataEntity], db: Session) -> int:
+    # Granted messages of the temporary store are written straight to the dialog data, in the order they were received
+    rows = [{column: getattr(entry, column) for column in PROMOTED_COLUMNS}
+            for entry in sorted(dialog_data, key=lambda entry: entry.id)]
+    if len(rows) > 0:
+        db.execute(insert(DialogDataEntity.__table__), rows)
+    return len(rows)
+
+
+def save_user_consents(consents: List[ConsentBatchItemModel],
+                       stored_dialog_data: Dict[str, List[TemporaryDialogDataEntity]],
+                       db: Session) -> List[Dict[str, Any]]:
+    """
+    Saves the consent decisions of many dialogs in one transaction, with a fixed number of statements whatever the
+    number of dialogs. Returns a result per decision, in the order of the request: the saved consent, or the status
+    code and detail of the single consent endpoint when a decision is rejected.
+    """
+    results: List[Dict[str, Any]] = [{'dialog_id': consent.dialog_id, 'status_code': 200} for consent in consents]
+    try:
+        positions = check_batch_consents(consents, results=results)
+        saved_consents: List[Dict[str, Any]] = []
+        if len(positions) > 0:
+            saved_consents = write_batch_consents([consents[position] for position in positions.values()],
+                                                  results=results, positions=positions,
+                                                  stored_dialog_data=stored_dialog_data, db=db)
+    except Exception:
+        temporary_store.restore(entry for entries in stored_dialog_data.values() for entry in entries)
+        raise
+
+    # Messages of the rejected decisions go back to the temporary store
+    saved_dialog_ids = {consent['dialog_id'] for consent in saved_consents}
+    temporary_store.restore(entry for dialog_id, entries in stored_dialog_data.items()
+                            if dialog_id not in saved_dialog_ids for entry in entries)
+    return results
+
+
+def check_batch_consents(consents: List[ConsentBatchItemModel], results: List[Dict[str, Any]]) -> Dict[str, int]:
+    # Rejects the decisions that can be answered without the database, returns the position of the other ones
+    positions: Dict[str, int] = {}
+    for position, consent in enumerate(consents):
+        if consent.dialog_id in positions:
+            results[position].update(status_code=409,
+                                     detail=f'Consent is given twice for dialog_id {consent.dialog_id}')
+        elif consent_index.contains(consent.dialog_id):
+            results[position].update(status_code=409,
+                                     detail=f'Consent was already given or denied for dialog_id {consent.dialog_id}')
+        else:
+            positions[consent.dialog_id] = position
+    return positions
+
+
+def write_batch_consents(consents: List[ConsentBatchItemModel], results: List[Dict[str, Any]],
+                         positions: Dict[str, int], stored_dialog_data: Dict[str, List[TemporaryDialogDataEntity]],
+                         db: Session) -> List[Dict[str, Any]]:
+    load_consent_batch(consents, in_memory=stored_dialog_data, db=db)
+    saved_consents, is_saved = insert_batch_consents(db=db)
+    for consent in saved_consents:
+        results[positions[consent['dialog_id']]]['consent'] = consent
+    reject_batch_consents(results, positions=positions, is_saved=is_saved, db=db)
+
+    promoted_count = apply_batch_consents(is_saved=is_saved, db=db) if is_saved is not None else 0
+    granted_dialog_data = [entry for consent in saved_consents if consent['has_given_consent']
+                           for entry in stored_dialog_data.get(consent['dialog_id'], [])]
+    promoted_count += promote_stored_dialog_data(granted_dialog_data, db=db)
+    record_message_stats(granted_dialog_data, db=db)
+    db.commit()
+    consent_index.add(consent['dialog_id'] for consent in saved_consents)
+    promoted_rows.inc(promoted_count)
+
+    if promoted_count > 0:
+        dialog_data_cache.invalidate()
+    return saved_consents
+
+
+def load_consent_batch(consents: List[ConsentBatchItemModel], in_memory: Collection[str], db: Session) -> None:
+    # in_memory are the dialogs whose messages are kept by the temporary store, and so are not pending in the database
+    connection = db.connection()
+    connection.exec_driver_sql('CREATE TEMP TABLE IF NOT EXISTS consent_batch (position INTEGER PRIMARY KEY, '
+                               'dialog_id VARCHAR UNIQUE, has_given_consent BOOLEAN, in_memory BOOLEAN)')
+    connection.execute(delete(CONSENT_BATCH))
+    connection.execute(insert(CONSENT_BATCH), [
+        {'position': position, 'dialog_id': consent.dialog_id, 'has_given_consent': consent.has_given_consent,
+         'in_memory': consent.dialog_id in in_memory}
+        for position, consent in enumerate(consents)
+    ])
+
+
+def insert_batch_consents(db: Session) -> Tuple[List[Dict[str, Any]], Optional[ColumnElement]]:
+    # Inserting the consents is the first write to the database: the checks run while holding its write lock, so
+    # concurrent requests cannot give a second consent for the same dialog
+    consents = ConsentEntity.__table__
+    saved_count, is_stamped = insert_from_select(
+        consents, columns=['dialog_id', 'has_given_consent'],
+        rows=select(CONSENT_BATCH.c.dialog_id, CONSENT_BATCH.c.has_given_consent)
+        .where(~exists().where(consents.c.dialog_id == CONSENT_BATCH.c.dialog_id))
+        .where(or_(CONSENT_BATCH.c.in_memory,
+                   exists().where(PendingDialogEntity.dialog_id == CONSENT_BATCH.c.dialog_id)))
+        .order_by(CONSENT_BATCH.c.position),
+        stamp_column='received_at_timestamp_utc', db=db
+    )
+    if saved_count == 0:
+        return [], None
+
+    # A dialog has a single consent: the one received with the batch is saved by this statement
+    is_saved = and_(consents.c.dialog_id.in_(select(CONSENT_BATCH.c.dialog_id)), is_stamped)
+    saved_consents = db.execute(select(consents).where(is_saved).order_by(consents.c.id))
+    return [dict(consent._mapping) for consent in saved_consents], is_saved
+
+
+def reject_batch_consents(results: List[Dict[str, Any]], positions: Dict[str, int],
+                          is_saved: Optional[ColumnElement], db: Session) -> None:
+    consents = ConsentEntity.__table__
+    previous_consents = select(consents.c.dialog_id).where(consents.c.dialog_id.in_(select(CONSENT_BATCH.c.dialog_id)))
+    if is_saved is not None:
+        previous_consents = previous_consents.where(~is_saved)
+    already_decided = set(db.execute(previous_consents).scalars())
+
+    for dialog_id, position in positions.items():
+        if dialog_id in already_decided:
+            results[position].update(status_code=409,
+                                     detail=f'Consent was already given or denied for dialog_id {dialog_id}')
+        elif 'consent' not in results[position]:
+            results[position].update(status_code=404,
+                                     detail=f'Cannot give consent: no temporary data for dialog_id {dialog_id}')
+
+
+def apply_batch_consents(is_saved: ColumnElement, db: Session) -> int:
+    consents = ConsentEntity.__table__
+    temporary_data = TemporaryDialogDataEntity.__table__
+    saved_dialog_ids = select(consents.c.dialog_id).where(is_saved)
+    granted_dialog_ids = saved_dialog_ids.where(consents.c.has_given_consent)
+
+    promoted_count = promote_temporary_dialogs(temporary_data.c.dialog_id.in_(granted_dialog_ids), db=db)
+    db.execute(build_consent_stats_upsert(is_saved))
+    db.execute(build_dialog_data_stats_upsert(temporary_data, temporary_data.c.dialog_id.in_(granted_dialog_ids)))
+
+    db.execute(delete(temporary_data).where(temporary_data.c.dialog_id.in_(saved_dialog_ids)))
+    db.execute(delete(PendingDialogEntity.__table__).where(PendingDialogEntity.dialog_id.in_(saved_dialog_ids)))
+    return promoted_count
@@ -1,40 +1,128 @@
+import heapq
 from datetime import datetime, timedelta
-from typing import List, Optional
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
-from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from sqlalchemy import Table, exists, func, select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncResult, AsyncSession
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Query, Session
 
 from app.config.config import settings
-from app.data.entities import ConsentEntity, DialogDataEntity, TemporaryDialogDataEntity
-from app.data.models import AnomalyDataModel, DialogDataCreateModel, DialogDataModel
+from app.data.database import DatabaseSession
+from app.data.entities import (ConsentEntity, DialogDataEntity, DialogDataPartitionEntity, PendingDialogEntity,
+                               TemporaryDialogDataEntity)
+from app.data.models import AnomalyDataModel, DialogDataBatchItemModel, DialogDataCreateModel, DialogDataModel
+from app.helpers.cursor_helper import decode_cursor, encode_cursor
+from app.helpers.json_helper import dumps
+from app.helpers.metrics_helper import ingested_rows
+from app.services.consent_index_service import consent_index
+from app.services.partition_service import get_attached_partitions, use_partition
 
+# Plain columns are selected instead of entities, in the order of the fields of the response models, so that rows can
+# be serialized as they are read, without going through the ORM nor pydantic
+DIALOG_DATA_FIELDS = list(DialogDataModel.__fields__)
+ANOMALY_FIELDS = list(AnomalyDataModel.__fields__)
+ANOMALY_COLUMNS = [
+    PendingDialogEntity.dialog_id,
+    PendingDialogEntity.customer_id,
+    PendingDialogEntity.first_received_at_timestamp_utc.label('received_at_timestamp_utc'),
+    PendingDialogEntity.last_received_at_timestamp_utc,
+    PendingDialogEntity.message_count
+]
 
-def save_dialog_data(dialog_data: DialogDataCreateModel, customer_id: str,
-                     dialog_id: str, db: Session) -> DialogDataModel:
-    dialog_data_to_insert = TemporaryDialogDataEntity(
+
+def build_temporary_dialog_data(dialog_data: DialogDataCreateModel, customer_id: str,
+                                dialog_id: str) -> TemporaryDialogDataEntity:
+    return TemporaryDialogDataEntity(
         customer_id=customer_id,
         dialog_id=dialog_id,
         language=dialog_data.language.lower(),
         text=dialog_data.text,
         received_at_timestamp_utc=datetime.utcnow()
     )
-    db.add(dialog_data_to_insert)
+
+
+def add_temporary_dialog_data(dialog_data_to_insert: List[TemporaryDialogDataEntity], db: Session) -> None:
+    db.add_all(dialog_data_to_insert)
+    db.flush()
+    update_pending_dialogs(dialog_data_to_insert=dialog_data_to_insert, db=db)
+
+
+def update_pending_dialogs(dialog_data_to_insert: List[TemporaryDialogDataEntity], db: Session) -> None:
+    # Executing the upsert without parameters would insert a row of default values
+    if len(dialog_data_to_insert) == 0:
+        return
+
+    pending_dialogs: Dict[str, Dict[str, Any]] = {}
+    for entry in dialog_data_to_insert:
+        pending_dialog = pending_dialogs.setdefault(entry.dialog_id, {
+            'dialog_id': entry.dialog_id,
+            'customer_id': entry.customer_id,
+            'first_received_at_timestamp_utc': entry.received_at_timestamp_utc,
+            'last_received_at_timestamp_utc': entry.received_at_timestamp_utc,
+            'message_count': 0
+        })
+        pending_dialog['last_received_at_timestamp_utc'] = max(pending_dialog['last_received_at_timestamp_utc'],
+                                                               entry.received_at_timestamp_utc)
+        pending_dialog['message_count'] += 1
+
+    pending_dialogs_table = PendingDialogEntity.__table__
+    upsert = sqlite_insert(pending_dialogs_table)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[pending_dialogs_table.c.dialog_id],
+        set_={
+            'last_received_at_timestamp_utc': func.max(pending_dialogs_table.c.last_received_at_timestamp_utc,
+                                                       upsert.excluded.last_received_at_timestamp_utc),
+            'message_count': pending_dialogs_table.c.message_count + upsert.excluded.message_count
+        }
+    )
+    db.execute(upsert, list(pending_dialogs.values()))
+
+
+def save_dialog_data(dialog_data: DialogDataCreateModel, customer_id: str,
+                     dialog_id: str, db: Session) -> DialogDataModel:
+    dialog_data_to_insert = build_temporary_dialog_data(dialog_data=dialog_data, customer_id=customer_id,
+                                                        dialog_id=dialog_id)
+    add_temporary_dialog_data(dialog_data_to_insert=[dialog_data_to_insert], db=db)
     db.commit()
+    ingested_rows.inc()
     db.refresh(dialog_data_to_insert)
     return dialog_data_to_insert
 
 
-def get_dialog_data(language: Optional[str], customer_id: Optional[str], db: Session,
-                    skip: Optional[int] = None, limit: Optional[int] = None) -> List[DialogDataModel]:
-    query_builder = db.query(DialogDataEntity)
+def save_dialog_data_batch(dialog_data_items: List[DialogDataBatchItemModel], db: Session) -> List[int]:
+    dialog_data_to_insert = [
+        build_temporary_dialog_data(dialog_data=item, customer_id=item.customer_id, dialog_id=item.dialog_id)
+        for item in dialog_data_items
+    ]
+    add_temporary_dialog_data(dialog_data_to_insert=dialog_data_to_insert, db=db)
 
-    if language is not None and language != '':
-        query_builder = query_builder.filter(DialogDataEntity.language == language.lower())
+    # Ids are read after the flush, as committing expires the entities and reading them would reload each row
+    inserted_ids = [entry.id for entry in dialog_data_to_insert]
+    db.commit()
+    ingested_rows.inc(len(inserted_ids))
+    return inserted_ids
 
-    if customer_id is not None and customer_id != '':
-        query_builder = query_builder.filter(DialogDataEntity.customer_id == customer_id)
 
-    # Order by has to be applied before skip and limit
-    query_builder = query_builder.order_by(DialogDataEntity.received_at_timestamp_utc.desc())
+def build_dialog_data_query(language: Optional[str], customer_id: Optional[str], skip: Optional[int] = None,
+                            limit: Optional[int] = None, cursor: Optional[str] = None,
+                            table: Table = DialogDataEntity.__table__) -> Query:
+    # The query is not bound to a session, so that it can be run by both the sync and the async storage layers
+    query_builder = filter_dialog_data(Query([table.c[field] for field in DIALOG_DATA_FIELDS]), language=language,
+                                       customer_id=customer_id, table=table)
+
+    if cursor is not None and cursor != '':
+        # Keyset pagination: resume right after the last row of the previous page, whatever the depth
+        received_at, last_id = decode_cursor_position(cursor=cursor, skip=skip)
+        query_builder = query_builder.filter(
+            tuple_(table.c.received_at_timestamp_utc, table.c.id) < tuple_(received_at, last_id)
+        )
+
+    # Order by has to be applied before skip and limit, the id makes the order stable when timestamps are equal
+    query_builder = query_builder.order_by(table.c.received_at_timestamp_utc.desc(), table.c.id.desc())
 
     if skip is not None and skip > 0:
         query_builder = query_builder.offset(skip)
@@ -42,24 +130,299 @@ def get_dialog_data(language: Optional[str], customer_id: Optional[str], db: Ses
     if limit is not None and limit > 0:
         query_builder = query_builder.limit(limit)
 
-    matching_data = query_builder.all()
-    return matching_data
+    return query_builder
+
+
+def filter_dialog_data(query_builder: Query, language: Optional[str], customer_id: Optional[str],
+                       table: Table) -> Query:
+    if language is not None and language != '':
+        query_builder = query_builder.filter(table.c.language == language.lower())
+
+    if customer_id is not None and customer_id != '':
+        query_builder = query_builder.filter(table.c.customer_id == customer_id)
+
+    return query_builder
+
+
+def decode_cursor_position(cursor: str, skip: Optional[int]) -> Tuple[datetime, int]:
+    if skip is not None and skip > 0:
+        raise HTTPException(status_code=400, detail='The cursor and skip parameters cannot be combined')
+
+    received_at, last_id = decode_cursor(cursor, datetime, int)
+    return received_at, last_id
+
+
+def get_dialog_data(language: Optional[str], customer_id: Optional[str], db: Session,
+                    skip: Optional[int] = None, limit: Optional[int] = None,
+                    cursor: Optional[str] = None) -> List[Row]:
+    partitions = get_attached_partitions(db)
+    if len(partitions) == 0:
+        query_builder = build_dialog_data_query(language=language, customer_id=customer_id, skip=skip, limit=limit,
+                                                cursor=cursor)
+        return query_builder.with_session(db).all()
+
+    # Every table is read up to the end of the requested page, newest first, and the results are merged
+    offset = skip if skip is not None and skip > 0 else 0
+    window = offset + limit if limit is not None and limit > 0 else None
+    matching_data = build_dialog_data_query(language=language, customer_id=customer_id, limit=window,
+                                            cursor=cursor).with_session(db).all()
+
+    for partition in get_partitions_to_read(partitions, cursor=cursor, skip=skip):
+        # Partitions are sorted newest first: once the page is full, the following ones only hold older rows
+        if window is not None and len(matching_data) >= window and \
+                partition.last_received_at_timestamp_utc < matching_data[-1].received_at_timestamp_utc:
+            break
+
+        partition_data = build_dialog_data_query(language=language, customer_id=customer_id, limit=window,
+                                                 cursor=cursor, table=use_partition(partition, db)).with_session(db)
+        matching_data = list(merge_dialog_data([matching_data, partition_data], limit=window))
+
+    return matching_data[offset:]
+
+
+def get_partitions_to_read(partitions: List[DialogDataPartitionEntity], cursor: Optional[str],
+                           skip: Optional[int]) -> List[DialogDataPartitionEntity]:
+    if cursor is None or cursor == '':
+        return partitions
+
+    # Partitions whose rows are all newer than the cursor were read by the previous pages
+    received_at, _ = decode_cursor_position(cursor=cursor, skip=skip)
+    return [partition for partition in partitions if partition.first_received_at_timestamp_utc <= received_at]
+
+
+def get_dialog_data_sort_key(row: Row) -> Tuple[datetime, int]:
+    return row.received_at_timestamp_utc, row.id
+
+
+def merge_dialog_data(sources: List[Iterable[Row]], limit: Optional[int] = None) -> Iterator[Row]:
+    """
+    Merges rows sorted newest first into a single sorted sequence of at most limit rows. Rows being moved to a partition
+    are briefly in two tables: they have the same id and are skipped the second time.
+    """
+    last_id = None
+    merged_count = 0
+    for row in heapq.merge(*sources, key=get_dialog_data_sort_key, reverse=True):
+        if limit is not None and merged_count >= limit:
+            return
+        if row.id != last_id:
+            last_id = row.id
+            merged_count += 1
+            yield row
+
+
+def get_serialized_dialog_data(language: Optional[str], customer_id: Optional[str], db: Session,
+                               skip: Optional[int] = None, limit: Optional[int] = None,
+                               cursor: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+    matching_data = get_dialog_data(language=language, customer_id=customer_id, db=db, skip=skip, limit=limit,
+                                    cursor=cursor)
+    return serialize_rows(matching_data, DIALOG_DATA_FIELDS), get_next_cursor(page=matching_data, limit=limit)
+
 
+def serialize_rows(rows: Iterable[Row], fields: List[str]) -> bytes:
+    return dumps([dict(zip(fields, row)) for row in rows])
 
-def get_anomalies(db: Session) -> List[AnomalyDataModel]:
+
+def get_dialog_data_version(db: Session) -> Tuple[Optional[int], Optional[int], Optional[datetime],
+                                                  Optional[datetime]]:
+    """
+    Cheap validator of the consented data: rows are only ever appended when a consent is given, or removed from the
+    oldest ones, so the id bounds change whenever the content does. Each aggregate is a single index lookup.
+    Moving rows to a partition changes the bounds too, and the partitions change state with their update date.
+    """
+    return db.execute(select(
+        select(func.min(DialogDataEntity.id)).scalar_subquery(),
+        select(func.max(DialogDataEntity.id)).scalar_subquery(),
+        select(func.max(DialogDataPartitionEntity.updated_at_timestamp_utc)).scalar_subquery(),
+        select(func.max(ConsentEntity.received_at_timestamp_utc)).scalar_subquery()
+    )).one()
+
+
+def stream_dialog_data(language: Optional[str], customer_id: Optional[str], db: DatabaseSession,
+                       skip: Optional[int] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> Union[Iterator[bytes], AsyncIterator[bytes]]:
+    # The query is built eagerly so that invalid parameters are reported before the response starts
+    build_dialog_data_query(language=language, customer_id=customer_id, skip=skip, limit=limit, cursor=cursor)
+
+    if isinstance(db, AsyncSession):
+        return serialize_as_ndjson_async(stream_dialog_data_rows_async(
+            language=language, customer_id=customer_id, db=db, skip=skip, limit=limit, cursor=cursor))
+    return serialize_as_ndjson(stream_dialog_data_rows(language=language, customer_id=customer_id, db=db, skip=skip,
+                                                       limit=limit, cursor=cursor))
+
+
+def stream_dialog_data_rows(language: Optional[str], customer_id: Optional[str], db: Session, skip: Optional[int],
+                            limit: Optional[int], cursor: Optional[str]) -> Iterator[Row]:
+    partitions = get_attached_partitions(db)
+    if len(partitions) == 0:
+        yield from build_dialog_data_query(language=language, customer_id=customer_id, skip=skip, limit=limit,
+                                           cursor=cursor).with_session(db).yield_per(settings.STREAM_BATCH_SIZE)
+        return
+
+    offset = skip if skip is not None and skip > 0 else 0
+    window = offset + limit if limit is not None and limit > 0 else None
+    tables = [DialogDataEntity.__table__] + [use_partition(partition, db) for partition in
+                                             get_partitions_to_read(partitions, cursor=cursor, skip=skip)]
+    sources = [
+        build_dialog_data_query(language=language, customer_id=customer_id, limit=window, cursor=cursor, table=table)
+        .with_session(db).yield_per(settings.STREAM_BATCH_SIZE)
+        for table in tables
+    ]
+    yield from islice(merge_dialog_data(sources, limit=window), offset, None)
+
+
+async def stream_dialog_data_rows_async(language: Optional[str], customer_id: Optional[str], db: AsyncSession,
+                                        skip: Optional[int], limit: Optional[int],
+                                        cursor: Optional[str]) -> AsyncIterator[Sequence[Row]]:
+    partitions = await db.run_sync(get_attached_partitions)
+    if len(partitions) == 0:
+        statement = build_dialog_data_query(language=language, customer_id=customer_id, skip=skip, limit=limit,
+                                            cursor=cursor).statement
+        result = await db.stream(statement.execution_options(yield_per=settings.STREAM_BATCH_SIZE))
+        async for batch in result.partitions():
+            yield batch
+        return
+
+    offset = skip if skip is not None and skip > 0 else 0
+    window = offset + limit if limit is not None and limit > 0 else None
+    tables = [DialogDataEntity.__table__] + await db.run_sync(lambda session: [
+        use_partition(partition, session)
+        for partition in get_partitions_to_read(partitions, cursor=cursor, skip=skip)
+    ])
+    sources = [
+        await db.stream(build_dialog_data_query(language=language, customer_id=customer_id, limit=window,
+                                                cursor=cursor, table=table).statement
+                        .execution_options(yield_per=settings.STREAM_BATCH_SIZE))
+        for table in tables
+    ]
+
+    rows: List[Row] = []
+    async for row in merge_dialog_data_async(sources, limit=window):
+        if offset > 0:
+            offset -= 1
+            continue
+        rows.append(row)
+        if len(rows) >= settings.STREAM_BATCH_SIZE:
+            yield rows
+            rows = []
+    yield rows
+
+
+async def merge_dialog_data_async(sources: List[AsyncResult], limit: Optional[int] = None) -> AsyncIterator[Row]:
+    # Same as merge_dialog_data, the smallest key of the heap being the newest row
+    heap: List[Tuple[timedelta, int, int, Row]] = []
+
+    async def push_next_row(index: int) -> None:
+        row = await sources[index].fetchone()
+        if row is not None:
+            heapq.heappush(heap, (datetime.max - row.received_at_timestamp_utc, -row.id, index, row))
+
+    for index in range(len(sources)):
+        await push_next_row(index)
+
+    last_id = None
+    merged_count = 0
+    while len(heap) > 0 and (limit is None or merged_count < limit):
+        _, _, index, row = heapq.heappop(heap)
+        await push_next_row(index)
+        if row.id != last_id:
+            last_id = row.id
+            merged_count += 1
+            yield row
+
+
+def serialize_as_ndjson(matching_data: Iterable[Row]) -> Iterator[bytes]:
+    # Rows are sent in chunks of STREAM_BATCH_SIZE lines, so that memory does not depend on the size of the result
+    lines: List[bytes] = []
+    for row in matching_data:
+        lines.append(dumps(dict(zip(DIALOG_DATA_FIELDS, row))) + b'\n')
+
+        if len(lines) >= settings.STREAM_BATCH_SIZE:
+            yield b''.join(lines)
+            lines = []
+
+    if len(lines) > 0:
+        yield b''.join(lines)
+
+
+async def serialize_as_ndjson_async(batches: AsyncIterator[Sequence[Row]]) -> AsyncIterator[bytes]:
+    async for rows in batches:
+        if len(rows) > 0:
+            yield b''.join(serialize_as_ndjson(rows))
+
+
+def get_next_cursor(page: List[Row], limit: Optional[int]) -> Optional[str]:
+    if limit is None or len(page) < limit:
+        return None
+
+    last_entry = page[-1]
+    return encode_cursor(last_entry.received_at_timestamp_utc, last_entry.id)
+
+
+def build_anomalies_query(db: Session, *entities: Any) -> Query:
     limit_date_anomaly = datetime.utcnow() - timedelta(milliseconds=settings.ANOMALY_PERIOD_MS)
-    consents_given = db.query(ConsentEntity.dialog_id)
 
     """
-    An anomaly is defined as an entry in the Temporary Data Table if no consent was given for the related dialog ID
-    and if it was received before a specific limit date, computed as follows: "NOW - ANOMALY_PERIOD"
+    An anomaly is defined as a dialog with entries in the Temporary Data Table if no consent was given for it
+    and if its first entry was received before a specific limit date, computed as follows: "NOW - ANOMALY_PERIOD".
+    Dialogs are read from the summary of the pending dialogs, so the cost does not depend on the number of entries.
     """
-    anomalies = (db.query(TemporaryDialogDataEntity)
-                 .filter(TemporaryDialogDataEntity.received_at_timestamp_utc < limit_date_anomaly)
-                 .filter(~TemporaryDialogDataEntity.dialog_id.in_(consents_given)))
-
-    return list(map(lambda temporary_data_row: AnomalyDataModel(
-        dialog_id=temporary_data_row.dialog_id,
-        customer_id=temporary_data_row.customer_id,
-        received_at_timestamp_utc=temporary_data_row.received_at_timestamp_utc
-    ), anomalies))
+    query_builder = db.query(*entities).filter(PendingDialogEntity.first_received_at_timestamp_utc < limit_date_anomaly)
+
+    # With the consent index, dialogs that already decided are skipped while reading instead of being looked up in the
+    # consents: aggregates then also cover them, which only makes the version change more often
+    if settings.CONSENT_INDEX_ENABLED:
+        return query_builder
+    return query_builder.filter(~exists().where(ConsentEntity.dialog_id == PendingDialogEntity.dialog_id))
+
+
+def get_anomalies(db: Session, limit: Optional[int] = None, cursor: Optional[str] = None) -> List[Row]:
+    query_builder = build_anomalies_query(db, *ANOMALY_COLUMNS)
+
+    if cursor is not None and cursor != '':
+        received_at, last_dialog_id = decode_cursor(cursor, datetime, str)
+        query_builder = query_builder.filter(
+            tuple_(PendingDialogEntity.first_received_at_timestamp_utc, PendingDialogEntity.dialog_id)
+            > tuple_(received_at, last_dialog_id)
+        )
+
+    query_builder = query_builder.order_by(PendingDialogEntity.first_received_at_timestamp_utc,
+                                           PendingDialogEntity.dialog_id)
+
+    if settings.CONSENT_INDEX_ENABLED:
+        return skip_decided_dialogs(query_builder, limit=limit, db=db)
+
+    if limit is not None and limit > 0:
+        query_builder = query_builder.limit(limit)
+
+    return query_builder.all()
+
+
+def skip_decided_dialogs(query_builder: Query, limit: Optional[int], db: Session) -> List[Row]:
+    consent_index.refresh(db)
+    anomalies = (anomaly for anomaly in query_builder.yield_per(settings.STREAM_BATCH_SIZE)
+                 if not consent_index.contains(anomaly.dialog_id))
+    return list(islice(anomalies, limit if limit is not None and limit > 0 else None))
+
+
+def get_serialized_anomalies(db: Session, limit: Optional[int] = None,
+                             cursor: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+    anomalies = get_anomalies(db=db, limit=limit, cursor=cursor)
+    return serialize_rows(anomalies, ANOMALY_FIELDS), get_next_anomaly_cursor(page=anomalies, limit=limit)
+
+
+def get_anomalies_version(db: Session) -> Tuple[int, Optional[int], Optional[datetime]]:
+    # Aggregates the anomalous dialogs without reading them, the result changes whenever one of them does
+    return build_anomalies_query(
+        db,
+        func.count(),
+        func.sum(PendingDialogEntity.message_count),
+        func.max(PendingDialogEntity.last_received_at_timestamp_utc)
+    ).one()
+
+
+def get_next_anomaly_cursor(page: List[Row], limit: Optional[int]) -> Optional[str]:
+    if limit is None or len(page) < limit:
+        return None
+
+    last_anomaly = page[-1]
+    return encode_cursor(last_anomaly.received_at_timestamp_utc, last_anomaly.dialog_id)
@@ -0,0 +1,187 @@
+import csv
+import heapq
+import io
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from fastapi import HTTPException
+from sqlalchemy import Table, func, select
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Query, Session
+
+from app.config.config import settings
+from app.data.entities import DialogDataEntity, DialogDataPartitionEntity
+from app.services.data_service import DIALOG_DATA_FIELDS, filter_dialog_data
+from app.services.partition_service import get_attached_partitions, use_partition
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+EXPORT_MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Arrow and Parquet are only available when pyarrow is installed
+EXPORT_FORMATS = [name for name in EXPORT_MEDIA_TYPES if name == 'csv' or pyarrow is not None]
+EXPORT_FILE_EXTENSIONS = {'csv': 'csv', 'arrow': 'arrows', 'parquet': 'parquet'}
+EXPORT_SCHEMA = pyarrow.schema([
+    ('text', pyarrow.string()),
+    ('language', pyarrow.string()),
+    ('id', pyarrow.int64()),
+    ('customer_id', pyarrow.string()),
+    ('dialog_id', pyarrow.string()),
+    ('received_at_timestamp_utc', pyarrow.timestamp('us', tz='UTC')),
+]) if pyarrow is not None else None
+
+
+class ExportFilters(NamedTuple):
+    """
+    Rows matching the language, customer and reception time filters, with an id greater than the watermark of the
+    previous export and at most the watermark of this one. Ids grow as consents are given, even for old messages, so
+    an export with the previous watermark returns exactly the rows added since.
+    """
+    language: Optional[str]
+    customer_id: Optional[str]
+    start: Optional[datetime]
+    end: Optional[datetime]
+    after_id: int
+    last_id: int
+
+    def apply(self, query_builder: Query, table: Table) -> Query:
+        query_builder = filter_dialog_data(query_builder, language=self.language, customer_id=self.customer_id,
+                                           table=table)
+        if self.start is not None:
+            query_builder = query_builder.filter(table.c.received_at_timestamp_utc >= self.start)
+        if self.end is not None:
+            query_builder = query_builder.filter(table.c.received_at_timestamp_utc < self.end)
+        return query_builder.filter(table.c.id > self.after_id).filter(table.c.id <= self.last_id)
+
+    def may_match(self, partition: DialogDataPartitionEntity) -> bool:
+        return (partition.max_id > self.after_id
+                and (self.start is None or partition.last_received_at_timestamp_utc >= self.start)
+                and (self.end is None or partition.first_received_at_timestamp_utc < self.end))
+
+
+def check_export_format(export_format: str) -> None:
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f'Unsupported export format {export_format}, expected one of '
+                                                    f'{", ".join(EXPORT_FORMATS)}')
+
+
+def get_export_watermark(db: Session, watermark: Optional[int] = None) -> int:
+    # The rows committed after this point are left to the next export, so the watermark is known before streaming
+    last_id = db.execute(select(
+        func.max(DialogDataEntity.id),
+        select(func.max(DialogDataPartitionEntity.max_id)).scalar_subquery()
+    )).one()
+    return max([value for value in last_id if value is not None] + [watermark or 0])
+
+
+def read_export_rows(filters: ExportFilters, db: Session) -> Iterator[Row]:
+    tables = [DialogDataEntity.__table__] + [use_partition(partition, db) for partition in get_attached_partitions(db)
+                                             if filters.may_match(partition)]
+    sources = [
+        filters.apply(Query([table.c[field] for field in DIALOG_DATA_FIELDS]), table=table).order_by(table.c.id)
+        .with_session(db).yield_per(settings.EXPORT_BATCH_SIZE)
+        for table in tables
+    ]
+
+    # Rows being moved to a partition are briefly in two tables: only their copies are skipped, not every row sharing
+    # the id of another, which ids given again before dialog_data had AUTOINCREMENT may do
+    last_id = None
+    rows_with_last_id: Set[Row] = set()
+    for row in heapq.merge(*sources, key=lambda source_row: source_row.id):
+        if row.id != last_id:
+            last_id = row.id
+            rows_with_last_id.clear()
+        if row not in rows_with_last_id:
+            rows_with_last_id.add(row)
+            yield row
+
+
+def read_export_batches(filters: ExportFilters, db: Session) -> Iterator[List[Row]]:
+    rows = read_export_rows(filters=filters, db=db)
+    while True:
+        batch = list(islice(rows, settings.EXPORT_BATCH_SIZE))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def export_dialog_data(export_format: str, filters: ExportFilters, db: Session) -> Iterator[bytes]:
+    """
+    Streams the matching rows in the given format, one chunk per batch of EXPORT_BATCH_SIZE rows, oldest id first:
+    memory depends on the batch size, not on the size of the export.
+    """
+    batches = read_export_batches(filters=filters, db=db)
+    if export_format == 'csv':
+        return serialize_as_csv(batches)
+    return serialize_as_arrow(batches, open_writer=EXPORT_WRITERS[export_format])
+
+
+def serialize_as_csv(batches: Iterable[List[Row]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(DIALOG_DATA_FIELDS)
+    for rows in batches:
+        writer.writerows(
+            [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell() > 0:
+        yield buffer.getvalue().encode()
+
+
+class ChunkSink(io.RawIOBase):
+    # Collects what the Arrow writers write, to be sent and dropped after every batch
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self.chunks.append(chunk)
+        self.position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def serialize_as_arrow(batches: Iterable[List[Row]], open_writer: Callable[[Any], Any]) -> Iterator[bytes]:
+    sink = ChunkSink()
+    writer = open_writer(pyarrow.PythonFile(sink, mode='w'))
+    for rows in batches:
+        # Every batch becomes a record batch of the IPC stream, or a row group of the Parquet file
+        columns = list(zip(*rows))
+        writer.write_batch(pyarrow.record_batch([
+            pyarrow.array(values, type=field.type) for values, field in zip(columns, EXPORT_SCHEMA)
+        ], schema=EXPORT_SCHEMA))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+EXPORT_WRITERS: Dict[str, Callable[[Any], Any]] = {
+    'arrow': lambda sink: pyarrow.ipc.new_stream(sink, EXPORT_SCHEMA),
+    'parquet': lambda sink: pyarrow.parquet.ParquetWriter(sink, EXPORT_SCHEMA),
+}
@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config.config import settings
+from app.data.database import sessionLocal
+from app.data.entities import TemporaryDialogDataEntity
+from app.data.models import DialogDataCreateModel, DialogDataModel
+from app.helpers.metrics_helper import ingested_rows
+from app.services.data_service import add_temporary_dialog_data, build_temporary_dialog_data
+
+PendingDialogData = Tuple[TemporaryDialogDataEntity, 'Future[DialogDataModel]']
+
+
+class GroupCommitBuffer:
+    """
+    Write-behind buffer for the temporary dialog data: rows submitted by concurrent requests are committed together by
+    a background thread, every max_rows rows or every max_delay_ms milliseconds, whichever comes first.
+    The future of every row is only resolved once the transaction containing it has been committed.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], max_rows: int, max_delay_ms: int) -> None:
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.max_delay_ms = max_delay_ms
+        self._queue: 'Queue[Optional[PendingDialogData]]' = Queue()
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def submit(self, dialog_data: DialogDataCreateModel, customer_id: str,
+               dialog_id: str) -> 'Future[DialogDataModel]':
+        self._ensure_started()
+        future: 'Future[DialogDataModel]' = Future()
+        dialog_data_to_insert = build_temporary_dialog_data(dialog_data=dialog_data, customer_id=customer_id,
+                                                            dialog_id=dialog_id)
+        self._queue.put((dialog_data_to_insert, future))
+        return future
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._flusher is None:
+                return
+            self._queue.put(None)
+            self._flusher.join()
+            self._flusher = None
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='GroupCommitFlusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self) -> None:
+        is_stopping = False
+        while not is_stopping:
+            first_pending = self._queue.get()
+            if first_pending is None:
+                return
+
+            batch, is_stopping = self._collect_batch(first_pending)
+            self._flush(batch)
+
+    def _collect_batch(self, first_pending: PendingDialogData) -> Tuple[List[PendingDialogData], bool]:
+        batch = [first_pending]
+        deadline = time.monotonic() + self.max_delay_ms / 1000
+        while len(batch) < self.max_rows:
+            try:
+                pending = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except Empty:
+                break
+
+            if pending is None:
+                return batch, True
+            batch.append(pending)
+
+        return batch, False
+
+    def _flush(self, batch: List[PendingDialogData]) -> None:
+        db = self.session_factory()
+        try:
+            dialog_data_to_insert = [dialog_data for dialog_data, _ in batch]
+            add_temporary_dialog_data(dialog_data_to_insert=dialog_data_to_insert, db=db)
+            saved_dialog_data = [DialogDataModel.from_orm(dialog_data) for dialog_data in dialog_data_to_insert]
+            db.commit()
+            ingested_rows.inc(len(saved_dialog_data))
+        except Exception as exception:
+            logging.exception('Could not commit a group of dialog data')
+            db.rollback()
+            for _, future in batch:
+                future.set_exception(exception)
+            return
+        finally:
+            db.close()
+
+        for (_, future), dialog_data_model in zip(batch, saved_dialog_data):
+            future.set_result(dialog_data_model)
+
+
+ingest_buffer = GroupCommitBuffer(session_factory=sessionLocal, max_rows=settings.INGEST_GROUP_COMMIT_MAX_ROWS,
+                                  max_delay_ms=settings.INGEST_GROUP_COMMIT_MAX_DELAY_MS)
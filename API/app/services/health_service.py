@@ -0,0 +1,84 @@
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import QueuePool
+
+from app.config.config import settings
+
+
+def get_pool_stats(pool: QueuePool) -> Dict[str, Any]:
+    # Usage is the share of the connections the pool can open that are checked out, unknown if overflow is unlimited.
+    # The limit is read from the pool itself, as engines may not be configured from the settings
+    size = pool.size()
+    max_overflow = pool._max_overflow if pool._max_overflow >= 0 else None
+    checked_out = pool.checkedout()
+    capacity = size + max_overflow if max_overflow is not None else None
+    return {
+        'size': size,
+        'max_overflow': max_overflow,
+        'checked_in': pool.checkedin(),
+        'checked_out': checked_out,
+        'overflow': max(pool.overflow(), 0),
+        'usage': round(checked_out / capacity, 3) if capacity else None
+    }
+
+
+def probe_database(probe_engine: Engine, timeout_ms: int) -> float:
+    """
+    Times checking out a connection, then taking and releasing the write lock of the database, which is what writes
+    wait for when the file is locked. The busy timeout of the connection bounds the wait for the lock.
+    """
+    start = time.perf_counter()
+    with probe_engine.connect() as connection:
+        connection.exec_driver_sql(f'PRAGMA busy_timeout = {timeout_ms:d}')
+        try:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+            connection.exec_driver_sql('ROLLBACK')
+        finally:
+            connection.exec_driver_sql(f'PRAGMA busy_timeout = {settings.SQLITE_BUSY_TIMEOUT_MS:d}')
+    return time.perf_counter() - start
+
+
+async def run_database_probe(write_engine: Engine, write_pool_stats: Dict[str, Any]) -> Dict[str, Any]:
+    if write_pool_stats['usage'] is not None and write_pool_stats['usage'] >= 1:
+        # Checking out a connection would wait for the pool timeout
+        return {'latency_ms': None, 'error': 'No connection available in the write pool'}
+
+    timeout_ms = settings.HEALTH_PROBE_TIMEOUT_MS
+    try:
+        latency = await asyncio.wait_for(run_in_threadpool(probe_database, write_engine, timeout_ms=timeout_ms),
+                                         timeout=timeout_ms / 1000)
+    except asyncio.TimeoutError:
+        return {'latency_ms': None, 'error': f'Probe did not complete within {timeout_ms} ms'}
+    except DBAPIError as exception:
+        return {'latency_ms': None, 'error': str(exception.orig)}
+    return {'latency_ms': round(latency * 1000, 3), 'error': None}
+
+
+def get_failures(database: Dict[str, Any], pools: Dict[str, Dict[str, Any]]) -> List[str]:
+    failures = [
+        f'Usage of the {name} pool is {stats["usage"]}, above {settings.HEALTH_MAX_POOL_USAGE}'
+        for name, stats in pools.items()
+        if stats['usage'] is not None and stats['usage'] > settings.HEALTH_MAX_POOL_USAGE
+    ]
+    if database['error'] is not None:
+        failures.append(f'Database probe failed: {database["error"]}')
+    elif database['latency_ms'] > settings.HEALTH_MAX_PROBE_LATENCY_MS:
+        failures.append(f'Database probe took {database["latency_ms"]} ms, above '
+                        f'{settings.HEALTH_MAX_PROBE_LATENCY_MS} ms')
+    return failures
+
+
+async def get_readiness(engines: Dict[str, Engine]) -> Dict[str, Any]:
+    """
+    Whether the worker can serve requests: the pools of its engines have connections left, and the write lock of the
+    database can be taken quickly. The probe never takes longer than HEALTH_PROBE_TIMEOUT_MS.
+    """
+    pools = {name: get_pool_stats(pool_engine.pool) for name, pool_engine in engines.items()}
+    database = await run_database_probe(engines['write'], write_pool_stats=pools['write'])
+    failures = get_failures(database, pools=pools)
+    return {'ready': len(failures) == 0, 'failures': failures, 'database': database, 'pools': pools}
@@ -0,0 +1,214 @@
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import MetaData, Table, and_, create_engine, delete, func, insert, select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from app.config.config import settings
+from app.data.entities import DialogDataEntity, DialogDataPartitionEntity
+from app.data.search_index import SEARCH_TABLE_NAME, create_search_table, rebuild_search_index
+
+ATTACHED = 'ATTACHED'
+DETACHED = 'DETACHED'
+ARCHIVED = 'ARCHIVED'
+# Default maximum number of databases attached to a SQLite connection
+MAX_ATTACHED_PARTITIONS = 10
+SEALING_SCHEMA = 'sealed_partition'
+
+_partition_tables: Dict[str, Table] = {}
+
+
+def parse_month(month: str) -> Tuple[datetime, datetime]:
+    try:
+        start = datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        raise ValueError(f'Invalid month {month}, expected YYYY-MM')
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def get_schema_name(month: str) -> str:
+    return f'dialog_data_{month.replace("-", "_")}'
+
+
+def get_partition_path(file_name: str) -> Path:
+    return Path(settings.PARTITION_DIRECTORY) / file_name
+
+
+def get_partition_table(schema_name: str) -> Table:
+    # Same columns and indexes as the live table, in the attached database
+    if schema_name not in _partition_tables:
+        _partition_tables[schema_name] = DialogDataEntity.__table__.to_metadata(MetaData(), schema=schema_name)
+    return _partition_tables[schema_name]
+
+
+def get_attached_partitions(db: Session) -> List[DialogDataPartitionEntity]:
+    """
+    Returns the partitions to query, newest first. Partitions that were attached to the connection of the session but
+    have been detached since are detached from it.
+    """
+    partitions = (db.query(DialogDataPartitionEntity)
+                  .filter(DialogDataPartitionEntity.state == ATTACHED)
+                  .order_by(DialogDataPartitionEntity.month.desc())
+                  .all())
+
+    connection = db.connection()
+    attached_schemas = connection.info.setdefault('attached_partitions', set())
+    for schema_name in attached_schemas - {get_schema_name(partition.month) for partition in partitions}:
+        connection.exec_driver_sql('DETACH DATABASE ?', (schema_name,))
+        attached_schemas.discard(schema_name)
+
+    return partitions
+
+
+def use_partition(partition: DialogDataPartitionEntity, db: Session) -> Table:
+    # Partitions are only attached to a connection when a query reaches them, and stay attached to it afterwards
+    schema_name = get_schema_name(partition.month)
+    connection = db.connection()
+    attached_schemas = connection.info.setdefault('attached_partitions', set())
+    if schema_name not in attached_schemas:
+        path = get_partition_path(partition.file_name)
+        connection.exec_driver_sql('ATTACH DATABASE ? AS ?', (str(path), schema_name))
+        attached_schemas.add(schema_name)
+    return get_partition_table(schema_name)
+
+
+def seal_partition(month: str, engine: Engine) -> Dict[str, object]:
+    """
+    Moves the dialog data received during a past month to its own database file, attached to the queries from then
+    on. Rows are copied first, then deleted from the live table in small transactions, so that the write lock of the
+    live database is never held for long.
+    """
+    start, end = parse_month(month)
+    if end > datetime.utcnow():
+        raise ValueError(f'Month {month} is not over yet')
+
+    file_name = f'{get_schema_name(month)}.db'
+    path = get_partition_path(file_name)
+    with engine.connect() as connection:
+        if connection.execute(select(DialogDataPartitionEntity.month)
+                              .where(DialogDataPartitionEntity.month == month)).first() is not None:
+            raise ValueError(f'Month {month} is already sealed')
+
+        # A file without registry entry is left over by an interrupted sealing
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+        partition_engine = create_engine(f'sqlite:///{path}')
+        DialogDataEntity.__table__.create(partition_engine)
+        partition_engine.dispose()
+
+        partition = copy_month(connection, path=path, start=start, end=end)
+        if partition['row_count'] == 0:
+            path.unlink()
+            raise ValueError(f'No dialog data was received in {month}')
+        index_partition(path)
+
+        partition.update(month=month, file_name=file_name, state=ATTACHED, updated_at_timestamp_utc=datetime.utcnow())
+        with connection.begin():
+            connection.execute(insert(DialogDataPartitionEntity.__table__).values(**partition))
+
+        # Until they are deleted, rows are in both tables: the listing skips the duplicates
+        delete_copied_rows(connection, start=start, end=end, max_id=partition['max_id'])
+
+    return partition
+
+
+def copy_month(connection: Connection, path: Path, start: datetime, end: datetime) -> Dict[str, Any]:
+    live_table = DialogDataEntity.__table__
+    sealed_table = get_partition_table(SEALING_SCHEMA)
+    connection.exec_driver_sql('ATTACH DATABASE ? AS ?', (str(path), SEALING_SCHEMA))
+    try:
+        with connection.begin():
+            # Only the partition file is written, the live database is only read
+            connection.execute(insert(sealed_table).from_select(
+                [column.name for column in live_table.columns],
+                select(live_table.columns)
+                .where(and_(live_table.c.received_at_timestamp_utc >= start,
+                            live_table.c.received_at_timestamp_utc < end))
+                .order_by(live_table.c.id)
+            ))
+        row_count, max_id, first_received_at, last_received_at = connection.execute(select(
+            func.count(), func.max(sealed_table.c.id), func.min(sealed_table.c.received_at_timestamp_utc),
+            func.max(sealed_table.c.received_at_timestamp_utc)
+        )).one()
+    finally:
+        connection.exec_driver_sql('DETACH DATABASE ?', (SEALING_SCHEMA,))
+
+    return {'row_count': row_count, 'max_id': max_id, 'first_received_at_timestamp_utc': first_received_at,
+            'last_received_at_timestamp_utc': last_received_at}
+
+
+def index_partition(path: Path) -> None:
+    # Partitions are read-only: their search index is built once, from the rows they hold
+    partition_engine = create_engine(f'sqlite:///{path}')
+    with partition_engine.begin() as connection:
+        if not has_search_index(connection, schema='main'):
+            create_search_table(connection)
+            rebuild_search_index(connection)
+    partition_engine.dispose()
+
+
+def has_search_index(connection: Connection, schema: str) -> bool:
+    return connection.exec_driver_sql(f'SELECT count(*) FROM "{schema}".sqlite_master WHERE name = ?',
+                                      (SEARCH_TABLE_NAME,)).scalar() > 0
+
+
+def delete_copied_rows(connection: Connection, start: datetime, end: datetime, max_id: int) -> None:
+    # Rows of the month promoted after the copy have greater ids: they stay in the live table
+    live_table = DialogDataEntity.__table__
+    delete_batch = delete(live_table).where(live_table.c.id.in_(
+        select(live_table.c.id)
+        .where(and_(live_table.c.received_at_timestamp_utc >= start, live_table.c.received_at_timestamp_utc < end,
+                    live_table.c.id <= max_id))
+        .limit(settings.PARTITION_DELETE_BATCH_SIZE)
+    ))
+
+    while True:
+        with connection.begin():
+            deleted_count = connection.execute(delete_batch).rowcount
+        if deleted_count < settings.PARTITION_DELETE_BATCH_SIZE:
+            return
+        time.sleep(settings.PARTITION_DELETE_PAUSE_MS / 1000)
+
+
+def set_partition_state(month: str, state: str, engine: Engine) -> None:
+    partitions = DialogDataPartitionEntity.__table__
+    with engine.begin() as connection:
+        partition = connection.execute(select(partitions).where(partitions.c.month == month)).first()
+        if partition is None:
+            raise ValueError(f'Month {month} is not sealed')
+
+        if state == ATTACHED:
+            if not get_partition_path(partition.file_name).exists():
+                raise ValueError(f'The partition file {partition.file_name} is not in {settings.PARTITION_DIRECTORY}')
+            attached_count = connection.execute(select(func.count()).where(partitions.c.state == ATTACHED)).scalar()
+            if partition.state != ATTACHED and attached_count >= MAX_ATTACHED_PARTITIONS:
+                raise ValueError(f'At most {MAX_ATTACHED_PARTITIONS} partitions can be attached')
+            # Months sealed before the search index existed are indexed when they are attached again
+            index_partition(get_partition_path(partition.file_name))
+
+        connection.execute(update(partitions).where(partitions.c.month == month)
+                           .values(state=state, updated_at_timestamp_utc=datetime.utcnow()))
+
+
+def archive_partition(month: str, destination: str, engine: Engine) -> Path:
+    # The partition is detached from the queries before its file is moved
+    set_partition_state(month, DETACHED, engine)
+    with engine.connect() as connection:
+        file_name = connection.execute(select(DialogDataPartitionEntity.file_name)
+                                       .where(DialogDataPartitionEntity.month == month)).scalar()
+    archived_path = Path(destination) / file_name
+    archived_path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(str(get_partition_path(file_name)), str(archived_path))
+    set_partition_state(month, ARCHIVED, engine)
+    return archived_path
+
+
+def list_partitions(engine: Engine) -> List[Dict[str, object]]:
+    with engine.connect() as connection:
+        return [dict(partition._mapping) for partition in connection.execute(
+            select(DialogDataPartitionEntity.__table__).order_by(DialogDataPartitionEntity.month))]
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import delete, insert, literal, select
+from sqlalchemy.orm import Session
+
+from app.config.config import settings
+from app.data.database import sessionLocal
+from app.data.entities import (ArchivedTemporaryDialogDataEntity, PendingDialogEntity, PurgedDialogEntity,
+                               TemporaryDialogDataEntity)
+from app.data.statements import insert_from_select
+from app.helpers.metrics_helper import purged_rows
+from app.services.consent_service import PROMOTED_COLUMNS
+
+PURGED_DIALOG_COLUMNS = ['dialog_id', 'customer_id', 'first_received_at_timestamp_utc',
+                         'last_received_at_timestamp_utc', 'message_count']
+
+
+def purge_stale_dialogs(cutoff: datetime, limit: int, archive: bool, db: Session) -> Tuple[int, int]:
+    """
+    Removes the temporary data of at most limit dialogs that have not received any message since the cutoff date,
+    oldest first, and records them in the purged dialogs. Returns the number of dialogs and messages. Dialogs with a
+    consent are purged too: their messages received after the decision are never promoted.
+    """
+    pending_dialogs = PendingDialogEntity.__table__
+    purged_dialogs = PurgedDialogEntity.__table__
+    temporary_data = TemporaryDialogDataEntity.__table__
+
+    # Recording the dialogs is the first write of the transaction: they are selected while holding the write lock,
+    # so concurrent workers never purge the same dialog twice
+    dialog_count, is_purged = insert_from_select(
+        purged_dialogs, columns=PURGED_DIALOG_COLUMNS + ['action'],
+        rows=select([pending_dialogs.c[column] for column in PURGED_DIALOG_COLUMNS]
+                    + [literal('ARCHIVE' if archive else 'DELETE')])
+        .where(pending_dialogs.c.first_received_at_timestamp_utc < cutoff)
+        .where(pending_dialogs.c.last_received_at_timestamp_utc < cutoff)
+        .order_by(pending_dialogs.c.first_received_at_timestamp_utc)
+        .limit(limit),
+        stamp_column='purged_at_timestamp_utc', db=db
+    )
+    if dialog_count == 0:
+        return 0, 0
+
+    # The dialogs purged by this statement are those still pending, as their pending summary is deleted below
+    purged_dialog_ids = select(purged_dialogs.c.dialog_id).where(is_purged).where(
+        purged_dialogs.c.dialog_id.in_(select(pending_dialogs.c.dialog_id)))
+
+    if archive:
+        db.execute(insert(ArchivedTemporaryDialogDataEntity.__table__).from_select(
+            PROMOTED_COLUMNS,
+            select([temporary_data.c[column] for column in PROMOTED_COLUMNS])
+            .where(temporary_data.c.dialog_id.in_(purged_dialog_ids))
+            .order_by(temporary_data.c.id)
+        ))
+
+    message_count = db.execute(delete(temporary_data).where(temporary_data.c.dialog_id.in_(purged_dialog_ids))).rowcount
+    db.execute(delete(pending_dialogs).where(pending_dialogs.c.dialog_id.in_(purged_dialog_ids)))
+    return dialog_count, message_count
+
+
+class RetentionWorker:
+    """
+    Background thread purging the temporary data of the dialogs that have received no message for the retention
+    period, every interval_s seconds. Dialogs are purged in short transactions separated by pauses, so that ingestion
+    is never blocked for long: the number of dialogs per transaction is halved whenever a transaction takes more than
+    batch_max_duration_ms, and doubled back up to batch_size when it is fast again.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], period_ms: int, archive: bool, interval_s: float,
+                 batch_size: int, batch_max_duration_ms: int, pause_ms: int) -> None:
+        self.session_factory = session_factory
+        self.period_ms = period_ms
+        self.archive = archive
+        self.interval_s = interval_s
+        self.batch_size = batch_size
+        self.batch_max_duration_ms = batch_max_duration_ms
+        self.pause_ms = pause_ms
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._purger: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._purger is None:
+                self._stopping.clear()
+                self._purger = threading.Thread(target=self._run, name='RetentionWorker', daemon=True)
+                self._purger.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._purger is None:
+                return
+            self._stopping.set()
+            self._purger.join()
+            self._purger = None
+
+    def purge(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(milliseconds=self.period_ms)
+        batch_size = self.batch_size
+        purged_dialog_count = 0
+        while not self._stopping.is_set():
+            start = time.perf_counter()
+            dialog_count = self._purge_batch(cutoff=cutoff, limit=batch_size)
+            purged_dialog_count += dialog_count
+            if dialog_count < batch_size:
+                break
+
+            batch_size = self._get_next_batch_size(batch_size, duration_ms=(time.perf_counter() - start) * 1000)
+            self._stopping.wait(self.pause_ms / 1000)
+
+        return purged_dialog_count
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self.purge()
+            except Exception:
+                logging.exception('Could not purge the expired temporary dialog data')
+            self._stopping.wait(self.interval_s)
+
+    def _purge_batch(self, cutoff: datetime, limit: int) -> int:
+        db = self.session_factory()
+        try:
+            dialog_count, message_count = purge_stale_dialogs(cutoff=cutoff, limit=limit, archive=self.archive, db=db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        if dialog_count > 0:
+            action = 'archived' if self.archive else 'deleted'
+            logging.info(f'Retention: {action} {message_count} messages of {dialog_count} dialogs older than {cutoff}')
+            purged_rows.labels(action=action).inc(message_count)
+        return dialog_count
+
+    def _get_next_batch_size(self, batch_size: int, duration_ms: float) -> int:
+        if duration_ms > self.batch_max_duration_ms:
+            return max(1, batch_size // 2)
+        if duration_ms < self.batch_max_duration_ms / 2:
+            return min(self.batch_size, batch_size * 2)
+        return batch_size
+
+
+retention_worker = RetentionWorker(
+    session_factory=sessionLocal, period_ms=settings.RETENTION_PERIOD_MS, archive=settings.RETENTION_MODE == 'ARCHIVE',
+    interval_s=settings.RETENTION_INTERVAL_S, batch_size=settings.RETENTION_BATCH_SIZE,
+    batch_max_duration_ms=settings.RETENTION_BATCH_MAX_DURATION_MS, pause_ms=settings.RETENTION_PAUSE_MS
+)
@@ -0,0 +1,99 @@
+import heapq
+import sqlite3
+from typing import List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Table, tuple_
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Query, Session
+from sqlalchemy.sql.expression import TableClause
+
+from app.data.entities import DialogDataEntity
+from app.data.search_index import get_search_table
+from app.helpers.cursor_helper import decode_cursor, encode_cursor
+from app.services.data_service import DIALOG_DATA_FIELDS, filter_dialog_data, serialize_rows
+from app.services.partition_service import get_attached_partitions, get_schema_name, has_search_index, use_partition
+
+
+def validate_search_query(search: str) -> None:
+    # The query is parsed against an empty index first, so that syntax errors are told apart from database errors
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute('CREATE VIRTUAL TABLE search_query USING fts5(text)')
+        connection.execute('SELECT rowid FROM search_query WHERE search_query MATCH ?', (search,)).fetchall()
+    except sqlite3.OperationalError as error:
+        raise HTTPException(status_code=400, detail=f'Invalid search query {search}: {error}')
+    finally:
+        connection.close()
+
+
+def build_search_query(search: str, language: Optional[str], customer_id: Optional[str], limit: int,
+                       cursor: Optional[str], table: Table = DialogDataEntity.__table__,
+                       search_table: TableClause = get_search_table()) -> Query:
+    """
+    Matching rows are ordered by relevance, the best bm25 score first, then by id. The cursor holds the score and the
+    id of the last row of the previous page.
+    """
+    query_builder = Query([table.c[field] for field in DIALOG_DATA_FIELDS] + [search_table.c.rank])
+    query_builder = query_builder.select_from(search_table).join(table, table.c.id == search_table.c.rowid)
+    query_builder = query_builder.filter(search_table.c.text.match(search))
+    query_builder = filter_dialog_data(query_builder, language=language, customer_id=customer_id, table=table)
+
+    if cursor is not None and cursor != '':
+        rank, last_id = decode_cursor(cursor, float, int)
+        query_builder = query_builder.filter(tuple_(search_table.c.rank, table.c.id) > tuple_(rank, last_id))
+
+    return query_builder.order_by(search_table.c.rank, table.c.id).limit(limit)
+
+
+def search_dialog_data(search: str, language: Optional[str], customer_id: Optional[str], db: Session, limit: int,
+                       cursor: Optional[str] = None) -> List[Row]:
+    validate_search_query(search)
+    sources = [build_search_query(search, language=language, customer_id=customer_id, limit=limit, cursor=cursor)
+               .with_session(db).all()]
+
+    # Each partition has its own index: the scores of its rows are computed against its own content
+    for partition in get_attached_partitions(db):
+        table = use_partition(partition, db)
+        schema_name = get_schema_name(partition.month)
+        if has_search_index(db.connection(), schema=schema_name):
+            sources.append(build_search_query(search, language=language, customer_id=customer_id, limit=limit,
+                                              cursor=cursor, table=table, search_table=get_search_table(schema_name))
+                           .with_session(db).all())
+
+    if len(sources) == 1:
+        return sources[0]
+    return merge_search_results(sources, limit=limit)
+
+
+def merge_search_results(sources: List[List[Row]], limit: int) -> List[Row]:
+    # Rows being moved to a partition are briefly in two tables, with different scores
+    merged: List[Row] = []
+    merged_ids: Set[int] = set()
+    for row in heapq.merge(*sources, key=get_search_sort_key):
+        if len(merged) >= limit:
+            break
+        if row.id not in merged_ids:
+            merged_ids.add(row.id)
+            merged.append(row)
+    return merged
+
+
+def get_search_sort_key(row: Row) -> Tuple[float, int]:
+    return row.rank, row.id
+
+
+def get_serialized_search_results(search: str, language: Optional[str], customer_id: Optional[str], db: Session,
+                                  limit: int, cursor: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+    matching_data = search_dialog_data(search=search, language=language, customer_id=customer_id, db=db, limit=limit,
+                                       cursor=cursor)
+    # The score is the last column of the rows, it is left out of the response fields
+    return serialize_rows(matching_data, DIALOG_DATA_FIELDS), get_next_search_cursor(page=matching_data, limit=limit)
+
+
+def get_next_search_cursor(page: List[Row], limit: int) -> Optional[str]:
+    if len(page) < limit:
+        return None
+
+    last_entry = page[-1]
+    return encode_cursor(last_entry.rank, last_entry.id)
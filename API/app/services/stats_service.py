@@ -0,0 +1,148 @@
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy import Table, case, delete, func, select
+from sqlalchemy.dialects.sqlite import Insert, insert as sqlite_insert
+from sqlalchemy.orm import Query, Session
+
+from app.data.entities import (ConsentEntity, ConsentStatsEntity, DialogDataEntity, DialogDataStatsEntity,
+                               PendingDialogEntity, TemporaryDialogDataEntity)
+from app.services.partition_service import get_attached_partitions, use_partition
+from app.services.temporary_store_service import temporary_store
+
+
+def build_dialog_data_stats_upsert(table: Table, *conditions: Any) -> Insert:
+    # Adds the messages of the given table, grouped per day, language and customer, to the existing counts
+    stats = DialogDataStatsEntity.__table__
+    day = func.date(table.c.received_at_timestamp_utc)
+    upsert = sqlite_insert(stats).from_select(
+        ['day', 'language', 'customer_id', 'message_count'],
+        select(day, table.c.language, table.c.customer_id, func.count())
+        .where(*conditions)
+        .group_by(day, table.c.language, table.c.customer_id)
+    )
+    return upsert.on_conflict_do_update(
+        index_elements=[stats.c.day, stats.c.language, stats.c.customer_id],
+        set_={'message_count': stats.c.message_count + upsert.excluded.message_count}
+    )
+
+
+def build_consent_stats_upsert(*conditions: Any) -> Insert:
+    stats = ConsentStatsEntity.__table__
+    consents = ConsentEntity.__table__
+    day = func.date(consents.c.received_at_timestamp_utc)
+    upsert = sqlite_insert(stats).from_select(
+        ['day', 'granted_count', 'denied_count'],
+        select(day, func.sum(case((consents.c.has_given_consent, 1), else_=0)),
+               func.sum(case((consents.c.has_given_consent, 0), else_=1)))
+        .where(*conditions)
+        .group_by(day)
+    )
+    return upsert.on_conflict_do_update(
+        index_elements=[stats.c.day],
+        set_={'granted_count': stats.c.granted_count + upsert.excluded.granted_count,
+              'denied_count': stats.c.denied_count + upsert.excluded.denied_count}
+    )
+
+
+def record_consent_stats(dialog_id: str, has_given_consent: bool, db: Session) -> None:
+    """
+    Counts a consent decision, and the messages it promotes, in the transaction that saves it: the statistics are
+    always those of the committed data. Has to run before the temporary data of the dialog is deleted.
+    """
+    db.flush()
+    db.execute(build_consent_stats_upsert(ConsentEntity.dialog_id == dialog_id))
+    if has_given_consent:
+        temporary_data = TemporaryDialogDataEntity.__table__
+        db.execute(build_dialog_data_stats_upsert(temporary_data, temporary_data.c.dialog_id == dialog_id))
+
+
+def record_message_stats(dialog_data: Iterable[TemporaryDialogDataEntity], db: Session) -> None:
+    # Counts messages promoted from memory, which are not in any table to group from
+    message_counts = Counter((entry.received_at_timestamp_utc.date(), entry.language, entry.customer_id)
+                             for entry in dialog_data)
+    if len(message_counts) == 0:
+        return
+
+    stats = DialogDataStatsEntity.__table__
+    upsert = sqlite_insert(stats)
+    db.execute(upsert.on_conflict_do_update(
+        index_elements=[stats.c.day, stats.c.language, stats.c.customer_id],
+        set_={'message_count': stats.c.message_count + upsert.excluded.message_count}
+    ), [{'day': day, 'language': language, 'customer_id': customer_id, 'message_count': message_count}
+        for (day, language, customer_id), message_count in message_counts.items()])
+
+
+def rebuild_stats(db: Session) -> None:
+    # Partitions have to be attached before the transaction starts
+    tables = [DialogDataEntity.__table__] + [use_partition(partition, db) for partition in get_attached_partitions(db)]
+
+    db.execute(delete(DialogDataStatsEntity.__table__))
+    db.execute(delete(ConsentStatsEntity.__table__))
+    for table in tables:
+        db.execute(build_dialog_data_stats_upsert(table))
+    db.execute(build_consent_stats_upsert())
+    db.commit()
+
+
+def filter_days(query_builder: Query, column: Any, start: Optional[date], end: Optional[date]) -> Query:
+    if start is not None:
+        query_builder = query_builder.filter(column >= start)
+    if end is not None:
+        query_builder = query_builder.filter(column <= end)
+    return query_builder
+
+
+def get_message_stats(db: Session, start: Optional[date], end: Optional[date]) -> Dict[str, Any]:
+    message_count = func.sum(DialogDataStatsEntity.message_count)
+    message_stats: Dict[str, Any] = {}
+    for name, column in (('by_language', DialogDataStatsEntity.language),
+                         ('by_customer', DialogDataStatsEntity.customer_id),
+                         ('by_day', DialogDataStatsEntity.day)):
+        query_builder = filter_days(db.query(column, message_count), DialogDataStatsEntity.day, start=start, end=end)
+        message_stats[name] = dict(query_builder.group_by(column).order_by(column).all())
+
+    message_stats['total'] = sum(message_stats['by_day'].values())
+    return message_stats
+
+
+def get_consent_stats(db: Session, start: Optional[date], end: Optional[date]) -> Dict[str, Any]:
+    query_builder = filter_days(db.query(ConsentStatsEntity), ConsentStatsEntity.day, start=start, end=end)
+    by_day = {
+        consent_stats.day: get_consent_counts(consent_stats.granted_count, consent_stats.denied_count)
+        for consent_stats in query_builder.order_by(ConsentStatsEntity.day)
+    }
+    return {
+        **get_consent_counts(sum(counts['granted'] for counts in by_day.values()),
+                             sum(counts['denied'] for counts in by_day.values())),
+        'by_day': by_day
+    }
+
+
+def get_consent_counts(granted_count: int, denied_count: int) -> Dict[str, Any]:
+    decision_count = granted_count + denied_count
+    return {
+        'granted': granted_count,
+        'denied': denied_count,
+        'grant_ratio': granted_count / decision_count if decision_count > 0 else None
+    }
+
+
+def get_stats(db: Session, start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Statistics of the consented messages and of the consent decisions received between the start and end days, read
+    from the rollups. Pending counts are those of the summary of the pending dialogs, maintained on ingestion, plus
+    those of the temporary store when messages are kept in memory.
+    """
+    pending_dialog_count, pending_message_count = db.query(
+        func.count(), func.coalesce(func.sum(PendingDialogEntity.message_count), 0)).one()
+    if temporary_store.enabled:
+        memory_dialog_count, memory_message_count = temporary_store.get_counts()
+        pending_dialog_count += memory_dialog_count
+        pending_message_count += memory_message_count
+    return {
+        'messages': get_message_stats(db, start=start, end=end),
+        'consents': get_consent_stats(db, start=start, end=end),
+        'pending': {'dialogs': pending_dialog_count, 'messages': pending_message_count}
+    }
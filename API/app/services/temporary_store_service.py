@@ -0,0 +1,226 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import IO, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config.config import settings
+from app.data.database import sessionLocal
+from app.data.entities import TemporaryDialogDataEntity
+from app.data.models import DialogDataBatchItemModel, DialogDataCreateModel, DialogDataModel
+from app.helpers.metrics_helper import ingested_rows
+from app.services.data_service import add_temporary_dialog_data, build_temporary_dialog_data
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+# Share of max_rows left in memory when dialogs are spilled because the store is full
+LOW_WATERMARK = 0.75
+
+
+class TemporaryStore:
+    """
+    Keeps the temporary dialog data in memory, by dialog, until consent is received: most messages are then never
+    written to the database, only the granted ones are, to the dialog data. Dialogs are spilled to the temporary dialog
+    data table by a background thread, oldest first, once their first message is older than max_age_ms, or when the
+    store holds more than max_rows messages. Messages in memory are lost if the process crashes.
+    Ids are allocated by the store, so the store has to be the only writer of the temporary dialog data: it only works
+    with a single process, and start() refuses to start it in a second process using the same database.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], max_rows: int, max_age_ms: int,
+                 interval_ms: int) -> None:
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.max_age_ms = max_age_ms
+        self.interval_ms = interval_ms
+        self.row_count = 0
+        self._dialogs: 'OrderedDict[str, List[TemporaryDialogDataEntity]]' = OrderedDict()
+        self._spilling: Set[str] = set()
+        self._last_id = 0
+        self._lock = threading.Lock()
+        # Held while dialogs are being written, so that their consent waits until they are in the database
+        self._spill_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stopping = threading.Event()
+        self._spiller: Optional[threading.Thread] = None
+        self._process_lock: Optional[IO[str]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.TEMPORARY_STORE_MODE == 'MEMORY'
+
+    def stop(self) -> None:
+        # Everything left in memory is written to the database on shutdown
+        with self._lock:
+            spiller = self._spiller
+            self._spiller = None
+        if spiller is not None:
+            self._stopping.set()
+            self._wake_up.set()
+            spiller.join()
+        self.spill(everything=True)
+        self._release_process_lock()
+
+    def save(self, dialog_data: DialogDataCreateModel, customer_id: str, dialog_id: str) -> DialogDataModel:
+        dialog_data_to_insert = build_temporary_dialog_data(dialog_data=dialog_data, customer_id=customer_id,
+                                                            dialog_id=dialog_id)
+        self.add([dialog_data_to_insert])
+        return dialog_data_to_insert
+
+    def save_batch(self, dialog_data_items: List[DialogDataBatchItemModel]) -> List[int]:
+        dialog_data_to_insert = [
+            build_temporary_dialog_data(dialog_data=item, customer_id=item.customer_id, dialog_id=item.dialog_id)
+            for item in dialog_data_items
+        ]
+        self.add(dialog_data_to_insert)
+        return [entry.id for entry in dialog_data_to_insert]
+
+    def add(self, dialog_data: List[TemporaryDialogDataEntity]) -> None:
+        with self._lock:
+            for entry in dialog_data:
+                self._last_id += 1
+                entry.id = self._last_id
+                self._dialogs.setdefault(entry.dialog_id, []).append(entry)
+            self.row_count += len(dialog_data)
+            is_full = self.row_count > self.max_rows
+        ingested_rows.inc(len(dialog_data))
+        if is_full:
+            self._wake_up.set()
+
+    def take(self, dialog_ids: Iterable[str]) -> Dict[str, List[TemporaryDialogDataEntity]]:
+        """
+        Removes the messages of the given dialogs from memory and returns them, to be written by a consent transaction.
+        They have to be given back with restore() if that transaction fails. Waits for the dialogs being spilled: it
+        must not be called on the event loop.
+        """
+        dialog_ids = set(dialog_ids)
+        while True:
+            # Checked and taken at once, so that a spill cannot remove the dialogs in between
+            with self._lock:
+                if self._spilling.isdisjoint(dialog_ids):
+                    taken = {dialog_id: self._dialogs.pop(dialog_id) for dialog_id in dialog_ids
+                             if dialog_id in self._dialogs}
+                    self.row_count -= sum(len(dialog_data) for dialog_data in taken.values())
+                    return taken
+
+            # Dialogs being spilled are read from the database by the consent once the spill is over, or taken from
+            # memory if it failed and gave them back
+            with self._spill_lock:
+                pass
+
+    def restore(self, dialog_data: Iterable[TemporaryDialogDataEntity]) -> None:
+        # Messages given back are older than the ones kept in memory: they go first, to be spilled first
+        with self._lock:
+            for entry in sorted(dialog_data, key=lambda e: e.id, reverse=True):
+                self._dialogs.setdefault(entry.dialog_id, []).insert(0, entry)
+                self._dialogs.move_to_end(entry.dialog_id, last=False)
+                self.row_count += 1
+
+    def get_counts(self) -> Tuple[int, int]:
+        with self._lock:
+            return len(self._dialogs), self.row_count
+
+    def spill(self, everything: bool = False) -> int:
+        with self._spill_lock:
+            dialogs = self._take_dialogs_to_spill(everything=everything)
+            if len(dialogs) == 0:
+                return 0
+
+            dialog_data = sorted((entry for entries in dialogs.values() for entry in entries), key=lambda e: e.id)
+            try:
+                self._write(dialog_data)
+            except Exception:
+                self.restore(dialog_data)
+                raise
+            finally:
+                with self._lock:
+                    self._spilling.clear()
+
+        logging.info(f'Temporary store: spilled {len(dialog_data)} messages of {len(dialogs)} dialogs')
+        return len(dialog_data)
+
+    def _take_dialogs_to_spill(self, everything: bool) -> Dict[str, List[TemporaryDialogDataEntity]]:
+        cutoff = datetime.utcnow() - timedelta(milliseconds=self.max_age_ms)
+        with self._lock:
+            dialogs: Dict[str, List[TemporaryDialogDataEntity]] = {}
+            # Dialogs are kept in the order of their first message
+            for dialog_id, entries in self._dialogs.items():
+                is_old = entries[0].received_at_timestamp_utc < cutoff
+                is_over_watermark = self.row_count > self.max_rows * LOW_WATERMARK
+                if not (everything or is_old or is_over_watermark):
+                    break
+                dialogs[dialog_id] = entries
+                self.row_count -= len(entries)
+
+            for dialog_id in dialogs:
+                del self._dialogs[dialog_id]
+            self._spilling.update(dialogs)
+            return dialogs
+
+    def _write(self, dialog_data: List[TemporaryDialogDataEntity]) -> None:
+        db = self.session_factory()
+        try:
+            add_temporary_dialog_data(dialog_data_to_insert=dialog_data, db=db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def start(self) -> None:
+        """
+        Called on startup, so that ingestion only touches memory: seeds the ids with those of the temporary dialog data
+        already in the database, and starts the spiller thread. Raises a RuntimeError if another process already
+        keeps the temporary dialog data of the same database in memory.
+        """
+        with self._lock:
+            if self._spiller is not None:
+                return
+            db = self.session_factory()
+            try:
+                self._acquire_process_lock(db.get_bind().url.database)
+                self._last_id = max(self._last_id, db.query(func.max(TemporaryDialogDataEntity.id)).scalar() or 0)
+            finally:
+                db.close()
+            self._stopping.clear()
+            self._spiller = threading.Thread(target=self._run, name='TemporaryStoreSpiller', daemon=True)
+            self._spiller.start()
+
+    def _acquire_process_lock(self, database: Optional[str]) -> None:
+        # Workers sharing the database would allocate the same ids, and receive and consent dialogs in different stores
+        if fcntl is None or not database or database == ':memory:' or self._process_lock is not None:
+            return
+        process_lock = open(f'{database}.temporary-store.lock', 'w')
+        try:
+            fcntl.flock(process_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            process_lock.close()
+            raise RuntimeError('TEMPORARY_STORE_MODE=MEMORY only works with a single worker process, but another '
+                               'process already keeps the temporary dialog data in memory: set WEB_CONCURRENCY=1')
+        self._process_lock = process_lock
+
+    def _release_process_lock(self) -> None:
+        if self._process_lock is not None:
+            self._process_lock.close()
+            self._process_lock = None
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self.spill()
+            except Exception:
+                logging.exception('Could not spill the temporary dialog data kept in memory')
+            self._wake_up.wait(self.interval_ms / 1000)
+            self._wake_up.clear()
+
+
+temporary_store = TemporaryStore(session_factory=sessionLocal, max_rows=settings.TEMPORARY_STORE_MAX_ROWS,
+                                 max_age_ms=settings.TEMPORARY_STORE_MAX_AGE_MS,
+                                 interval_ms=settings.TEMPORARY_STORE_SPILL_INTERVAL_MS)
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Runs the benchmark scenarios in-process against a synthetic dataset')
+    parser.add_argument('--database', default='./benchmark.db', help='path of the SQLite database to benchmark')
+    parser.add_argument('--messages', type=int, default=100000, help='number of messages of the generated dataset')
+    parser.add_argument('--messages-per-dialog', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reuse-dataset', action='store_true',
+                        help='run against the existing database instead of generating a new one')
+    parser.add_argument('--iterations', type=int, default=200, help='number of requests of every scenario')
+    parser.add_argument('--warmup', type=int, default=3, help='number of unmeasured requests of the read scenarios')
+    parser.add_argument('--output', help='file to write the results to, instead of the standard output')
+    parser.add_argument('--baseline', help='results of a previous run to compare the p95 latencies with')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='tolerated relative increase of the p95 latencies over the baseline')
+    return parser.parse_args()
+
+
+def find_regressions(results: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    regressions = []
+    for name, scenario in results['scenarios'].items():
+        baseline_scenario = baseline['scenarios'].get(name)
+        if baseline_scenario is None:
+            continue
+
+        p95, baseline_p95 = scenario['latency_ms']['p95'], baseline_scenario['latency_ms']['p95']
+        if p95 > baseline_p95 * (1 + max_regression):
+            regressions.append(f'{name}: p95 of {p95} ms, {baseline_p95} ms in the baseline')
+    return regressions
+
+
+def main() -> None:
+    args = parse_arguments()
+    database_path = Path(args.database)
+    if not args.reuse_dataset:
+        for suffix in ('', '-wal', '-shm'):
+            Path(f'{database_path}{suffix}').unlink(missing_ok=True)
+
+    # The settings are read when the app is imported: it has to run against the benchmark database, without logging
+    # every request
+    os.environ['DATABASE_URI'] = f'sqlite:///{database_path}'
+    os.environ.setdefault('LOG_SAMPLE_RATE', '0')
+    from fastapi.testclient import TestClient
+
+    from app.data.database import engine
+    from app.main import app
+    from benchmarks.dataset import count_rows, generate_dataset
+    from benchmarks.scenarios import run_scenarios
+
+    row_counts = count_rows(engine) if args.reuse_dataset else generate_dataset(
+        engine, message_count=args.messages, messages_per_dialog=args.messages_per_dialog, seed=args.seed)
+
+    with TestClient(app) as client:
+        scenarios = run_scenarios(client, engine, iterations=args.iterations, warmup=args.warmup)
+
+    results = {
+        'dataset': {'messages': args.messages, 'messages_per_dialog': args.messages_per_dialog, 'seed': args.seed,
+                    'rows': row_counts},
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'platform': platform.platform()},
+        'scenarios': scenarios
+    }
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        Path(args.output).write_text(output)
+
+    if args.baseline is not None:
+        regressions = find_regressions(results, json.loads(Path(args.baseline).read_text()), args.max_regression)
+        for regression in regressions:
+            print(f'Regression of {regression}', file=sys.stderr)
+        sys.exit(1 if len(regressions) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from app.data.database import create_sqlite_engine
+from app.data.entities import ConsentEntity, DialogDataEntity, PendingDialogEntity, TemporaryDialogDataEntity
+from app.data.migrations import run_migrations
+from app.services.stats_service import rebuild_stats
+
+LANGUAGES = ['en', 'en', 'en', 'fr', 'de', 'it', 'es']
+TEXTS = [
+    'Hello chatbot',
+    'What are your opening hours?',
+    'I would like to change the delivery address of my last order',
+    'Can I speak to a human, please?',
+    'Thanks, that was helpful!',
+]
+CHUNK_SIZE = 10000
+TABLES = [DialogDataEntity, TemporaryDialogDataEntity, ConsentEntity, PendingDialogEntity]
+
+
+class DatasetWriter:
+    """
+    Buffers the generated rows and inserts them table by table in chunks, so that memory does not depend on the size
+    of the dataset.
+    """
+
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+        self.rows: Dict[Any, List[Dict[str, Any]]] = {entity: [] for entity in TABLES}
+
+    def add(self, entity: Any, row: Dict[str, Any]) -> None:
+        rows = self.rows[entity]
+        rows.append(row)
+        if len(rows) >= CHUNK_SIZE:
+            self.flush(entity)
+
+    def flush(self, entity: Any) -> None:
+        if len(self.rows[entity]) > 0:
+            self.connection.execute(entity.__table__.insert(), self.rows[entity])
+            self.rows[entity] = []
+
+    def flush_all(self) -> None:
+        for entity in TABLES:
+            self.flush(entity)
+
+
+def generate_dialog(writer: DatasetWriter, rng: random.Random, dialog_id: str, customer_id: str,
+                    started_at: datetime, message_count: int, state: str) -> None:
+    # Denied dialogs only leave their consent behind, as their messages are deleted when the consent is received
+    received_at = started_at
+    messages = []
+    for index in range(message_count):
+        received_at += timedelta(seconds=rng.randint(1, 30))
+        messages.append({
+            'customer_id': customer_id,
+            'dialog_id': dialog_id,
+            'text': f'{rng.choice(TEXTS)} ({index})',
+            'language': rng.choice(LANGUAGES),
+            'received_at_timestamp_utc': received_at
+        })
+
+    if state == 'pending':
+        for message in messages:
+            writer.add(TemporaryDialogDataEntity, message)
+        writer.add(PendingDialogEntity, {
+            'dialog_id': dialog_id,
+            'customer_id': customer_id,
+            'first_received_at_timestamp_utc': messages[0]['received_at_timestamp_utc'],
+            'last_received_at_timestamp_utc': received_at,
+            'message_count': message_count
+        })
+        return
+
+    if state == 'granted':
+        for message in messages:
+            writer.add(DialogDataEntity, message)
+    writer.add(ConsentEntity, {
+        'dialog_id': dialog_id,
+        'has_given_consent': state == 'granted',
+        'received_at_timestamp_utc': received_at + timedelta(seconds=rng.randint(1, 300))
+    })
+
+
+def generate_dataset(engine: Engine, message_count: int, messages_per_dialog: int = 10, granted_share: float = 0.6,
+                     denied_share: float = 0.2, span_days: int = 30, seed: int = 0) -> Dict[str, int]:
+    """
+    Fills the database with message_count messages, grouped in dialogs of messages_per_dialog messages spread over
+    the last span_days days. Dialogs are granted, denied or still waiting for a consent decision according to the given
+    shares. The same seed always produces the same dataset, apart from the dates which are relative to now.
+    Returns the number of rows of every table.
+    """
+    run_migrations(engine)
+    rng = random.Random(seed)
+    dialog_count = max(1, message_count // messages_per_dialog)
+    customer_count = max(1, dialog_count // 20)
+    start = datetime.utcnow() - timedelta(days=span_days)
+    dialog_interval = timedelta(days=span_days) / dialog_count
+    states = ['granted', 'denied', 'pending']
+    weights = [granted_share, denied_share, max(0.0, 1 - granted_share - denied_share)]
+
+    with engine.begin() as connection:
+        writer = DatasetWriter(connection)
+        for dialog_index in range(dialog_count):
+            generate_dialog(writer, rng, dialog_id=f'dialog{dialog_index}',
+                            customer_id=f'customer{rng.randrange(customer_count)}',
+                            started_at=start + dialog_interval * dialog_index, message_count=messages_per_dialog,
+                            state=rng.choices(states, weights)[0])
+        writer.flush_all()
+
+    # Rows are inserted directly, without going through the consent transaction that maintains the rollups
+    with Session(engine) as db:
+        rebuild_stats(db)
+    return count_rows(engine)
+
+
+def count_rows(engine: Engine) -> Dict[str, int]:
+    with engine.connect() as connection:
+        return {
+            entity.__tablename__: connection.execute(select(func.count()).select_from(entity.__table__)).scalar()
+            for entity in TABLES
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fills a database with synthetic dialog, consent and temporary data')
+    parser.add_argument('--database', default='./benchmark.db', help='path of the SQLite database to fill')
+    parser.add_argument('--messages', type=int, default=100000, help='number of messages to generate')
+    parser.add_argument('--messages-per-dialog', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine(f'sqlite:///{args.database}')
+    row_counts = generate_dataset(engine, message_count=args.messages, messages_per_dialog=args.messages_per_dialog,
+                                  seed=args.seed)
+    print(row_counts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import statistics
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from fastapi.testclient import TestClient
+from requests import Response
+from sqlalchemy import exists, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.data.entities import ConsentEntity, DialogDataEntity, PendingDialogEntity
+from app.helpers.cursor_helper import encode_cursor
+from app.services.data_service import build_dialog_data_query
+
+LISTING_LANGUAGE = 'en'
+PAGE_SIZE = 100
+BATCH_SIZE = 100
+MESSAGES_PER_DIALOG = 10
+LISTING_DEPTHS = [0, 1000, 10000, 100000, 1000000]
+# Compression is left out, so that the measures only depend on the services
+HEADERS = {'Accept-Encoding': 'identity'}
+
+
+class Measurement(NamedTuple):
+    latencies: List[float]
+    rows: int
+    duration: float
+
+
+Scenario = Callable[[TestClient, Engine, int], Measurement]
+
+
+def send(client: TestClient, method: str, url: str, latencies: List[float], **kwargs: Any) -> Response:
+    start = time.perf_counter()
+    response = client.request(method, url, headers=HEADERS, **kwargs)
+    latencies.append(time.perf_counter() - start)
+    response.raise_for_status()
+    return response
+
+
+def run_requests(client: TestClient, method: str, urls: List[str], rows_per_request: Optional[int] = None,
+                 payloads: Optional[List[Any]] = None) -> Measurement:
+    latencies: List[float] = []
+    rows = 0
+    start = time.perf_counter()
+    for index, url in enumerate(urls):
+        response = send(client, method, url, latencies, json=None if payloads is None else payloads[index])
+        rows += len(response.json()) if rows_per_request is None else rows_per_request
+    return Measurement(latencies=latencies, rows=rows, duration=time.perf_counter() - start)
+
+
+def list_dialog_data(query_string: str) -> Scenario:
+    def scenario(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+        return run_requests(client, 'GET', [f'/data/?{query_string}'] * iterations)
+    return scenario
+
+
+def list_dialog_data_after_cursor(language: str, depth: int) -> Scenario:
+    def scenario(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+        # The cursor of the page starting at the given depth, as it would have been returned by the previous page
+        with Session(engine) as db:
+            last_row = build_dialog_data_query(language=language, customer_id=None, skip=depth - 1,
+                                               limit=1).with_session(db).one()
+        cursor = encode_cursor(last_row.received_at_timestamp_utc, last_row.id)
+        return run_requests(client, 'GET', [f'/data/?language={language}&limit={PAGE_SIZE}&cursor={cursor}']
+                            * iterations)
+    return scenario
+
+
+def scan_anomalies(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+    return run_requests(client, 'GET', [f'/data/anomaly?limit={PAGE_SIZE}'] * iterations)
+
+
+def search_text(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+    return run_requests(client, 'GET', [f'/data/search?q=delivery address&limit={PAGE_SIZE}'] * iterations)
+
+
+def read_stats(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+    return run_requests(client, 'GET', ['/stats'] * iterations, rows_per_request=1)
+
+
+def ingest_messages(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+    payload = {'text': 'Hello chatbot, is this a benchmark?', 'language': 'EN'}
+    urls = [f'/data/benchmark-customer/benchmark-dialog{index % 100}' for index in range(iterations)]
+    return run_requests(client, 'POST', urls, rows_per_request=1, payloads=[payload] * iterations)
+
+
+def ingest_batches(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+    payload = [
+        {'text': 'Hello chatbot, is this a benchmark?', 'language': 'EN', 'customer_id': 'benchmark-customer',
+         'dialog_id': f'benchmark-batch-dialog{index % 10}'}
+        for index in range(BATCH_SIZE)
+    ]
+    return run_requests(client, 'POST', ['/data/batch'] * iterations, rows_per_request=BATCH_SIZE,
+                        payloads=[payload] * iterations)
+
+
+def promote_on_consent(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+    # Every consent promotes the messages of a different pending dialog, consent can only be given once per dialog
+    with Session(engine) as db:
+        pending_dialogs = (db.query(PendingDialogEntity.dialog_id, PendingDialogEntity.message_count)
+                           .filter(~exists().where(ConsentEntity.dialog_id == PendingDialogEntity.dialog_id))
+                           .order_by(PendingDialogEntity.dialog_id).limit(iterations).all())
+    measurement = run_requests(client, 'POST', [f'/consents/{dialog_id}' for dialog_id, _ in pending_dialogs],
+                               rows_per_request=0, payloads=[True] * len(pending_dialogs))
+    return measurement._replace(rows=sum(message_count for _, message_count in pending_dialogs))
+
+
+def promote_on_consent_batch(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+    # Every request decides for BATCH_SIZE pending dialogs, as long as there are some left
+    with Session(engine) as db:
+        pending_dialogs = (db.query(PendingDialogEntity.dialog_id, PendingDialogEntity.message_count)
+                           .filter(~exists().where(ConsentEntity.dialog_id == PendingDialogEntity.dialog_id))
+                           .order_by(PendingDialogEntity.dialog_id).limit(iterations * BATCH_SIZE).all())
+    decisions = [{'dialog_id': dialog_id, 'has_given_consent': True} for dialog_id, _ in pending_dialogs]
+    payloads = [decisions[start:start + BATCH_SIZE] for start in range(0, len(decisions), BATCH_SIZE)]
+    measurement = run_requests(client, 'POST', ['/consents'] * len(payloads), rows_per_request=0, payloads=payloads)
+    return measurement._replace(rows=sum(message_count for _, message_count in pending_dialogs))
+
+
+def ingest_and_promote(client: TestClient, engine: Engine, iterations: int) -> Measurement:
+    # Whole life of new dialogs: their messages, then the consent promoting them
+    run_id = time.time_ns()
+    latencies: List[float] = []
+    start = time.perf_counter()
+    for index in range(iterations):
+        dialog_id = f'benchmark-lifecycle-{run_id}-{index}'
+        for _ in range(MESSAGES_PER_DIALOG):
+            send(client, 'POST', f'/data/benchmark-customer/{dialog_id}', latencies,
+                 json={'text': 'Hello chatbot, is this a benchmark?', 'language': 'EN'})
+        send(client, 'POST', f'/consents/{dialog_id}', latencies, json=True)
+    return Measurement(latencies=latencies, rows=iterations * MESSAGES_PER_DIALOG,
+                       duration=time.perf_counter() - start)
+
+
+def build_scenarios(listing_row_count: int) -> Dict[str, Scenario]:
+    # Read scenarios run first, as the write ones change the data they read
+    scenarios: Dict[str, Scenario] = {}
+    for depth in [depth for depth in LISTING_DEPTHS if depth < listing_row_count]:
+        scenarios[f'list_language_offset_{depth}'] = list_dialog_data(
+            f'language={LISTING_LANGUAGE}&limit={PAGE_SIZE}&skip={depth}')
+        if depth > 0:
+            scenarios[f'list_language_cursor_{depth}'] = list_dialog_data_after_cursor(language=LISTING_LANGUAGE,
+                                                                                       depth=depth)
+    scenarios['list_customer'] = list_dialog_data(f'customerId=customer0&limit={PAGE_SIZE}')
+    scenarios['scan_anomalies'] = scan_anomalies
+    scenarios['search_text'] = search_text
+    scenarios['read_stats'] = read_stats
+    scenarios['ingest_messages'] = ingest_messages
+    scenarios['ingest_batches'] = ingest_batches
+    scenarios['promote_on_consent'] = promote_on_consent
+    scenarios['promote_on_consent_batch'] = promote_on_consent_batch
+    scenarios['ingest_and_promote'] = ingest_and_promote
+    return scenarios
+
+
+def summarize(measurement: Measurement) -> Dict[str, Any]:
+    latencies_ms = [latency * 1000 for latency in measurement.latencies]
+    # Inclusive quantiles stay within the measured values, even with a handful of requests
+    percentiles = statistics.quantiles(latencies_ms, n=100, method='inclusive') if len(latencies_ms) > 1 \
+        else latencies_ms * 99
+    return {
+        'requests': len(latencies_ms),
+        'rows': measurement.rows,
+        'duration_s': round(measurement.duration, 6),
+        'requests_per_s': round(len(latencies_ms) / measurement.duration, 3) if measurement.duration > 0 else None,
+        'rows_per_s': round(measurement.rows / measurement.duration, 3) if measurement.duration > 0 else None,
+        'latency_ms': {
+            'p50': round(percentiles[49], 3),
+            'p95': round(percentiles[94], 3),
+            'p99': round(percentiles[98], 3),
+            'max': round(max(latencies_ms), 3)
+        }
+    }
+
+
+def run_scenarios(client: TestClient, engine: Engine, iterations: int, warmup: int = 3) -> Dict[str, Dict[str, Any]]:
+    with Session(engine) as db:
+        listing_row_count = (db.query(func.count(DialogDataEntity.id))
+                             .filter(DialogDataEntity.language == LISTING_LANGUAGE).scalar())
+
+    results = {}
+    for name, scenario in build_scenarios(listing_row_count).items():
+        # Warming up the read scenarios fills the page cache of SQLite, write ones are measured cold
+        if name.startswith(('list_', 'scan_', 'search_', 'read_')) and warmup > 0:
+            scenario(client, engine, warmup)
+        measurement = scenario(client, engine, iterations)
+        if len(measurement.latencies) > 0:
+            results[name] = summarize(measurement)
+    return results
@@ -0,0 +1,4 @@
+import os
+
+# The tests import the application, whose engines must not open the database of the .env file
+os.environ['DATABASE_URI'] = 'sqlite:///./test.db'
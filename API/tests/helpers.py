@@ -2,25 +2,32 @@ from pathlib import Path
 from typing import Dict, List
 
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session, sessionmaker
 from starlette.responses import Response
 
-from app.data.database import Base, get_db
-from app.data.entities import ConsentEntity, DialogDataEntity, TemporaryDialogDataEntity
+from app.data.database import create_sqlite_engine, get_db, get_engines, get_read_db
+from app.data.entities import (ArchivedTemporaryDialogDataEntity, ConsentEntity, ConsentStatsEntity, DialogDataEntity,
+                               DialogDataPartitionEntity, DialogDataStatsEntity, PendingDialogEntity,
+                               PurgedDialogEntity, TemporaryDialogDataEntity)
+from app.data.migrations import run_migrations
+from app.helpers.cache_helper import dialog_data_cache
 from app.main import app
+from app.services.consent_index_service import consent_index
 
 
 class HelperTestBase:
     def __init__(self) -> None:
         self.database_location = './test.db'
         self.DATABASE_URI = f'sqlite:///{self.database_location}'
-        self.engine = create_engine(
-            self.DATABASE_URI, connect_args={"check_same_thread": False}
-        )
-        Base.metadata.create_all(bind=self.engine)
+        self.engine = create_sqlite_engine(self.DATABASE_URI)
+        run_migrations(self.engine)
         self.testing_session_local = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.read_engine = create_sqlite_engine(self.DATABASE_URI, read_only=True)
+        self.testing_read_session_local = sessionmaker(autocommit=False, autoflush=False, bind=self.read_engine)
         app.dependency_overrides[get_db] = self.override_get_db
+        app.dependency_overrides[get_read_db] = self.override_get_read_db
+        app.dependency_overrides[get_engines] = self.override_get_engines
         self.test_client = TestClient(app)
 
     def override_get_db(self) -> Session:
@@ -30,19 +37,40 @@ class HelperTestBase:
         finally:
             db.close()
 
+    def override_get_read_db(self) -> Session:
+        try:
+            db = self.testing_read_session_local()
+            yield db
+        finally:
+            db.close()
+
+    def override_get_engines(self) -> Dict[str, Engine]:
+        return {'write': self.engine, 'read': self.read_engine}
+
     def get_test_client(self) -> TestClient:
         return self.test_client
 
     def remove_test_database(self) -> None:
-        database_location_path = Path(self.database_location)
-        database_location_path.unlink(missing_ok=True)
+        self.engine.dispose()
+        self.read_engine.dispose()
+        for suffix in ('', '-wal', '-shm', '.temporary-store.lock'):
+            database_location_path = Path(f'{self.database_location}{suffix}')
+            database_location_path.unlink(missing_ok=True)
 
     def empty_database(self) -> None:
         db = self.testing_session_local()
         db.query(DialogDataEntity).delete()
         db.query(TemporaryDialogDataEntity).delete()
         db.query(ConsentEntity).delete()
+        db.query(PendingDialogEntity).delete()
+        db.query(ArchivedTemporaryDialogDataEntity).delete()
+        db.query(PurgedDialogEntity).delete()
+        db.query(DialogDataPartitionEntity).delete()
+        db.query(DialogDataStatsEntity).delete()
+        db.query(ConsentStatsEntity).delete()
         db.commit()
+        dialog_data_cache.invalidate()
+        consent_index.reset()
 
     def get_database(self) -> Session:
         return self.testing_session_local()
@@ -70,6 +98,12 @@ class HelperTestBase:
             json=HelperTestBase.get_first_dialog_data_payload() if payload is None else payload
         )
 
+    def insert_dialog_data_batch(self, payload: List[Dict[str, str]]) -> Response:
+        return self.test_client.post(
+            '/data/batch',
+            json=payload
+        )
+
     @staticmethod
     def get_first_dialog_data_payload() -> Dict[str, str]:
         dialog_data_payloads = test_base.get_test_payloads_save_dialog_data()
@@ -0,0 +1,70 @@
+import json
+from typing import AsyncIterator, Iterator
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from tests.helpers import test_base
+
+from app.data.database import get_db, get_read_db
+from app.data.entities import ConsentEntity, DialogDataEntity, TemporaryDialogDataEntity
+from app.main import app
+
+pytest.importorskip('aiosqlite')
+
+
+@pytest.fixture
+def async_database() -> Iterator[None]:
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{test_base.database_location}')
+    async_session_local = sessionmaker(autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession)
+
+    async def override_get_db() -> AsyncIterator[AsyncSession]:
+        async with async_session_local() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    yield
+    app.dependency_overrides[get_db] = test_base.override_get_db
+    app.dependency_overrides[get_read_db] = test_base.override_get_read_db
+
+
+def test_async_database_should_save_and_get_data(async_database: None) -> None:
+    test_base.empty_database()
+    dialog_data_payloads = test_base.get_test_payloads_save_dialog_data()
+
+    response = test_base.insert_dialog_data(payload=dialog_data_payloads[0], customer_id='id11', dialog_id='did3')
+    assert response.status_code == 200
+    assert response.json()['dialog_id'] == 'did3'
+
+    response = test_base.insert_dialog_data_batch(payload=[
+        {'text': 'Hello!', 'language': 'EN', 'customer_id': 'id11', 'dialog_id': 'did3'},
+        {'text': 'Bonjour!', 'language': 'FR', 'customer_id': 'id12', 'dialog_id': 'did4'}
+    ])
+    assert response.status_code == 200
+    assert response.json() == [2, 3]
+
+    response = test_base.give_consent(has_given_consent=True, dialog_id='did3')
+    assert response.status_code == 200
+    assert response.json()['has_given_consent']
+
+    response = test_base.give_consent(has_given_consent=True, dialog_id='did3')
+    assert response.status_code == 409
+
+    db = test_base.get_database()
+    assert len(db.query(ConsentEntity).all()) == 1
+    assert len(db.query(DialogDataEntity).all()) == 2
+    assert len(db.query(TemporaryDialogDataEntity).all()) == 1
+
+    get_data = test_base.get_dialog_data(query_string='?limit=1')
+    assert get_data.status_code == 200
+    assert [item['text'] for item in get_data.json()] == ['Hello!']
+    assert 'X-Next-Cursor' in get_data.headers
+
+    get_data_stream = test_base.get_dialog_data(query_string='?stream=true')
+    assert get_data_stream.status_code == 200
+    assert [json.loads(line)['text'] for line in get_data_stream.text.splitlines()] == \
+        ['Hello!', dialog_data_payloads[0]['text']]
+
+    get_anomalies = test_base.get_test_client().get('/data/anomaly')
+    assert get_anomalies.status_code == 200
@@ -0,0 +1,41 @@
+from sqlalchemy import func
+
+from benchmarks.dataset import generate_dataset
+from benchmarks.scenarios import run_scenarios
+from tests.helpers import test_base
+
+from app.data.entities import PendingDialogEntity, TemporaryDialogDataEntity
+
+
+def test_generated_dataset_should_be_consistent() -> None:
+    test_base.empty_database()
+    row_counts = generate_dataset(test_base.engine, message_count=1000, messages_per_dialog=10, seed=1)
+
+    # Denied dialogs keep their consent but not their messages
+    assert row_counts['dialog_data'] % 10 == 0
+    assert row_counts['dialog_data'] + row_counts['temporary_dialog_data'] < 1000
+    assert row_counts['consents'] + row_counts['pending_dialogs'] == 100
+    assert row_counts['pending_dialogs'] * 10 == row_counts['temporary_dialog_data']
+
+    db = test_base.get_database()
+    pending_message_count = db.query(func.sum(PendingDialogEntity.message_count)).scalar()
+    assert pending_message_count == db.query(TemporaryDialogDataEntity).count()
+    db.close()
+    test_base.empty_database()
+
+
+def test_benchmark_scenarios_should_run_and_report_percentiles() -> None:
+    test_base.empty_database()
+    generate_dataset(test_base.engine, message_count=15000, messages_per_dialog=10)
+
+    results = run_scenarios(test_base.get_test_client(), test_base.engine, iterations=3, warmup=1)
+
+    assert {'list_language_offset_0', 'list_language_offset_1000', 'list_language_cursor_1000', 'list_customer',
+            'scan_anomalies', 'search_text', 'read_stats', 'ingest_messages', 'ingest_batches',
+            'promote_on_consent', 'promote_on_consent_batch', 'ingest_and_promote'} <= set(results)
+    for name, result in results.items():
+        # Every iteration of the lifecycle scenario sends the messages of a dialog, then its consent
+        assert result['requests'] == (33 if name == 'ingest_and_promote' else 3)
+        assert 0 < result['latency_ms']['p50'] <= result['latency_ms']['p95'] <= result['latency_ms']['p99']
+    assert results['list_language_cursor_1000']['rows'] == 300
+    test_base.empty_database()
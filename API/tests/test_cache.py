@@ -0,0 +1,97 @@
+import time
+from typing import Iterator, Optional
+
+import pytest
+from prometheus_client import REGISTRY
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.helpers.cache_helper import QueryResultCache
+
+
+@pytest.fixture
+def query_cache() -> Iterator[None]:
+    settings.QUERY_CACHE_ENABLED = True
+    yield
+    settings.QUERY_CACHE_ENABLED = False
+    settings.QUERY_CACHE_TTL_MS = 5000
+    settings.QUERY_CACHE_MAX_BYTES = 67108864
+
+
+def get_metric(name: str, **labels: str) -> Optional[float]:
+    return REGISTRY.get_sample_value(name, labels)
+
+
+def test_get_data_should_be_cached_until_consent_is_given(query_cache: None) -> None:
+    test_base.empty_database()
+    test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+
+    first_response = test_base.get_dialog_data(query_string='?language=en')
+    assert first_response.headers.get('X-Cache') is None
+    assert len(first_response.json()) == 1
+
+    hits = get_metric('query_cache_requests_total', cache='dialog_data', result='hit') or 0
+    second_response = test_base.get_dialog_data(query_string='?language=EN')
+    assert second_response.headers['X-Cache'] == 'HIT'
+    assert second_response.json() == first_response.json()
+    assert get_metric('query_cache_requests_total', cache='dialog_data', result='hit') == hits + 1
+
+    # A refused consent does not change the consented data
+    test_base.insert_dialog_data(customer_id='id12', dialog_id='did4')
+    test_base.give_consent(has_given_consent=False, dialog_id='did4')
+    assert test_base.get_dialog_data(query_string='?language=en').headers['X-Cache'] == 'HIT'
+
+    test_base.insert_dialog_data(customer_id='id13', dialog_id='did5')
+    test_base.give_consent(has_given_consent=True, dialog_id='did5')
+    third_response = test_base.get_dialog_data(query_string='?language=en')
+    assert third_response.headers.get('X-Cache') is None
+    assert len(third_response.json()) == 2
+
+
+def test_cached_responses_should_keep_the_next_cursor(query_cache: None) -> None:
+    test_base.empty_database()
+    test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+    test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+
+    first_response = test_base.get_dialog_data(query_string='?limit=1')
+    second_response = test_base.get_dialog_data(query_string='?limit=1')
+    assert second_response.headers['X-Cache'] == 'HIT'
+    assert second_response.headers['X-Next-Cursor'] == first_response.headers['X-Next-Cursor']
+
+
+def test_cache_entries_should_expire(query_cache: None) -> None:
+    settings.QUERY_CACHE_TTL_MS = 50
+    cache = QueryResultCache(name='test_expiry')
+
+    cache.put('key', generation=cache.generation, body=b'[]', headers={})
+    assert cache.get('key') is not None
+    time.sleep(0.1)
+    assert cache.get('key') is None
+    assert get_metric('query_cache_entries', cache='test_expiry') == 0
+    assert get_metric('query_cache_requests_total', cache='test_expiry', result='miss') == 1
+
+
+def test_cache_should_respect_memory_cap(query_cache: None) -> None:
+    settings.QUERY_CACHE_MAX_BYTES = 25
+    cache = QueryResultCache(name='test_memory_cap')
+
+    for key in range(4):
+        cache.put(key, generation=cache.generation, body=b'0123456789', headers={})
+
+    assert cache.get(0) is None
+    assert cache.get(1) is None
+    assert cache.get(3) is not None
+    assert get_metric('query_cache_size_bytes', cache='test_memory_cap') == 20
+    assert get_metric('query_cache_entries', cache='test_memory_cap') == 2
+    assert get_metric('query_cache_evictions_total', cache='test_memory_cap') == 2
+
+
+def test_cache_should_ignore_results_of_previous_generations(query_cache: None) -> None:
+    cache = QueryResultCache(name='test_generations')
+    generation = cache.generation
+    cache.invalidate()
+
+    cache.put('key', generation=generation, body=b'[]', headers={})
+    assert cache.get('key') is None
@@ -0,0 +1,98 @@
+import gzip
+import json
+import zlib
+
+import pytest
+from tests.helpers import test_base
+
+from app.helpers.compression_helper import GzipCompressor, negotiate_encoding
+
+
+def insert_consented_data(message_count: int) -> None:
+    test_base.empty_database()
+    test_base.insert_dialog_data_batch(payload=[
+        {'text': f'Hello chatbot, this is message {i}', 'language': 'EN', 'customer_id': 'id12', 'dialog_id': 'did3'}
+        for i in range(message_count)
+    ])
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+
+
+def test_large_responses_should_be_compressed() -> None:
+    insert_consented_data(message_count=100)
+
+    response = test_base.get_test_client().get('/data/', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert int(response.headers['Content-Length']) < len(response.content)
+    assert len(response.json()) == 100
+
+
+def test_etag_of_compressed_responses_should_be_weak() -> None:
+    insert_consented_data(message_count=100)
+
+    identity_response = test_base.get_test_client().get('/data/', headers={'Accept-Encoding': 'identity'})
+    etag = identity_response.headers['ETag']
+    assert not etag.startswith('W/')
+
+    response = test_base.get_test_client().get('/data/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == f'W/{etag}'
+
+    not_modified_response = test_base.get_test_client().get('/data/', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+    assert not_modified_response.status_code == 304
+
+
+def test_small_responses_should_not_be_compressed() -> None:
+    response = test_base.get_test_client().get('/health', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_responses_should_not_be_compressed_if_not_accepted() -> None:
+    insert_consented_data(message_count=100)
+
+    response = test_base.get_test_client().get('/data/', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.json()) == 100
+
+
+def test_streamed_responses_should_be_compressed() -> None:
+    insert_consented_data(message_count=100)
+
+    response = test_base.get_test_client().get('/data/?stream=true', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    lines = response.text.splitlines()
+    assert len(lines) == 100
+    assert json.loads(lines[-1])['text'] == 'Hello chatbot, this is message 0'
+
+
+def test_gzip_stream_should_be_decodable_chunk_by_chunk() -> None:
+    compressor = GzipCompressor()
+    chunks = [compressor.compress(b'{"id":1}\n', is_last=False), compressor.compress(b'{"id":2}\n', is_last=False)]
+    decompressor = zlib.decompressobj(31)
+
+    # Every chunk is flushed, so it can be decoded as soon as it is received
+    assert decompressor.decompress(chunks[0]) == b'{"id":1}\n'
+    assert decompressor.decompress(chunks[1]) == b'{"id":2}\n'
+    assert gzip.decompress(b''.join(chunks) + compressor.compress(b'', is_last=True)) == b'{"id":1}\n{"id":2}\n'
+
+
+def test_zstd_should_be_preferred_when_available() -> None:
+    zstandard = pytest.importorskip('zstandard')
+    insert_consented_data(message_count=100)
+
+    response = test_base.get_test_client().get('/data/', headers={'Accept-Encoding': 'gzip, zstd'})
+    assert response.headers['Content-Encoding'] == 'zstd'
+    decompressed_body = zstandard.ZstdDecompressor().decompressobj().decompress(response.content)
+    assert len(json.loads(decompressed_body)) == 100
+
+
+def test_negotiate_encoding_should_respect_weights() -> None:
+    assert negotiate_encoding('gzip') == 'gzip'
+    assert negotiate_encoding('gzip;q=1, br;q=0.5') == 'gzip'
+    assert negotiate_encoding('gzip;q=0, deflate') is None
+    assert negotiate_encoding('identity') is None
+    assert negotiate_encoding('') is None
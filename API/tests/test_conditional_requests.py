@@ -0,0 +1,64 @@
+from tests.helpers import test_base
+
+from app.config.config import settings
+
+
+def test_get_data_should_answer_not_modified_if_etag_matches() -> None:
+    test_base.empty_database()
+    test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+
+    first_response = test_base.get_dialog_data(query_string='?language=en')
+    etag = first_response.headers['ETag']
+    assert first_response.headers['Last-Modified'].endswith('GMT')
+
+    not_modified_response = test_base.get_test_client().get('/data/?language=en', headers={'If-None-Match': etag})
+    assert not_modified_response.status_code == 304
+    assert not_modified_response.content == b''
+    assert not_modified_response.headers['ETag'] == etag
+
+    # Different parameters are a different resource
+    other_response = test_base.get_test_client().get('/data/?language=fr', headers={'If-None-Match': etag})
+    assert other_response.status_code == 200
+    assert other_response.headers['ETag'] != etag
+
+    test_base.insert_dialog_data(customer_id='id12', dialog_id='did4')
+    test_base.give_consent(has_given_consent=True, dialog_id='did4')
+
+    modified_response = test_base.get_test_client().get('/data/?language=en', headers={'If-None-Match': etag})
+    assert modified_response.status_code == 200
+    assert len(modified_response.json()) == 2
+    assert modified_response.headers['ETag'] != etag
+
+
+def test_get_data_should_answer_not_modified_from_cache() -> None:
+    settings.QUERY_CACHE_ENABLED = True
+    try:
+        test_base.empty_database()
+        test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+        test_base.give_consent(has_given_consent=True, dialog_id='did3')
+
+        etag = test_base.get_dialog_data(query_string='').headers['ETag']
+        not_modified_response = test_base.get_test_client().get('/data/', headers={'If-None-Match': f'W/{etag}'})
+        assert not_modified_response.status_code == 304
+        assert not_modified_response.headers['X-Cache'] == 'HIT'
+    finally:
+        settings.QUERY_CACHE_ENABLED = False
+
+
+def test_get_anomalies_should_answer_not_modified_if_etag_matches() -> None:
+    settings.ANOMALY_PERIOD_MS = 0
+    test_base.empty_database()
+    test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+
+    first_response = test_base.get_test_client().get('/data/anomaly')
+    etag = first_response.headers['ETag']
+    assert len(first_response.json()) == 1
+
+    not_modified_response = test_base.get_test_client().get('/data/anomaly', headers={'If-None-Match': etag})
+    assert not_modified_response.status_code == 304
+
+    test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+    modified_response = test_base.get_test_client().get('/data/anomaly', headers={'If-None-Match': etag})
+    assert modified_response.status_code == 200
+    assert modified_response.json()[0]['message_count'] == 2
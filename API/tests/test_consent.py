@@ -112,3 +112,74 @@ def test_save_consent_should_erase_data_if_consent_is_not_given() -> None:
     assert len(db.query(ConsentEntity).all()) == 1
     assert len(db.query(TemporaryDialogDataEntity).all()) == 0
     assert len(db.query(DialogDataEntity).all()) == 0
+
+
+def test_save_consent_should_move_every_row_of_a_long_dialog() -> None:
+    test_base.empty_database()
+    db = test_base.get_database()
+
+    payload = [{'text': f'Message {i}', 'language': 'EN', 'customer_id': 'id12', 'dialog_id': 'did55'}
+               for i in range(250)]
+    test_base.insert_dialog_data_batch(payload=payload)
+    test_base.insert_dialog_data(dialog_id='did56')
+    temporary_data = db.query(TemporaryDialogDataEntity).filter(TemporaryDialogDataEntity.dialog_id == 'did55').all()
+
+    response = test_base.give_consent(has_given_consent=True, dialog_id='did55')
+    assert response.status_code == 200
+
+    promoted_data = db.query(DialogDataEntity).order_by(DialogDataEntity.id).all()
+    assert [(entry.text, entry.received_at_timestamp_utc) for entry in promoted_data] == \
+        [(entry.text, entry.received_at_timestamp_utc) for entry in temporary_data]
+    assert all(entry.customer_id == 'id12' and entry.dialog_id == 'did55' for entry in promoted_data)
+
+    remaining_temporary_data = db.query(TemporaryDialogDataEntity).all()
+    assert len(remaining_temporary_data) == 1
+    assert remaining_temporary_data[0].dialog_id == 'did56'
+
+
+def test_save_consents_batch_should_return_a_result_per_decision() -> None:
+    test_base.empty_database()
+    for dialog_id in ('did1', 'did2', 'did3', 'did4'):
+        test_base.insert_dialog_data(dialog_id=dialog_id)
+        test_base.insert_dialog_data(dialog_id=dialog_id)
+    test_base.give_consent(has_given_consent=True, dialog_id='did4')
+
+    response = test_base.get_test_client().post('/consents', json=[
+        {'dialog_id': 'did1', 'has_given_consent': True},
+        {'dialog_id': 'did2', 'has_given_consent': False},
+        {'dialog_id': 'did1', 'has_given_consent': False},
+        {'dialog_id': 'did4', 'has_given_consent': True},
+        {'dialog_id': 'did9', 'has_given_consent': True},
+        {'dialog_id': 'did3', 'has_given_consent': True},
+    ])
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [(result['dialog_id'], result['status_code']) for result in results] == [
+        ('did1', 200), ('did2', 200), ('did1', 409), ('did4', 409), ('did9', 404), ('did3', 200)
+    ]
+    assert results[0]['consent']['has_given_consent'] and not results[1]['consent']['has_given_consent']
+    assert results[0]['consent']['id'] < results[1]['consent']['id'] < results[5]['consent']['id']
+    assert results[3]['consent'] is None and 'already given' in results[3]['detail']
+
+    db = test_base.get_database()
+    assert db.query(ConsentEntity).count() == 4
+    promoted_dialog_ids = sorted(entry.dialog_id for entry in db.query(DialogDataEntity))
+    assert promoted_dialog_ids == ['did1', 'did1', 'did3', 'did3', 'did4', 'did4']
+    assert db.query(TemporaryDialogDataEntity).count() == 0
+    db.close()
+
+    stats = test_base.get_test_client().get('/stats').json()
+    assert (stats['messages']['total'], stats['consents']['granted'], stats['consents']['denied']) == (6, 3, 1)
+    assert stats['pending']['dialogs'] == 0
+
+
+def test_save_consents_batch_should_accept_empty_and_fully_rejected_batches() -> None:
+    test_base.empty_database()
+    client = test_base.get_test_client()
+    assert client.post('/consents', json=[]).json() == []
+
+    results = client.post('/consents', json=[{'dialog_id': 'did1', 'has_given_consent': True}]).json()
+    assert results == [{'dialog_id': 'did1', 'status_code': 404, 'consent': None,
+                        'detail': 'Cannot give consent: no temporary data for dialog_id did1'}]
+    assert client.post('/consents', json=[{'dialog_id': 'did1'}]).status_code == 422
@@ -0,0 +1,83 @@
+from typing import Iterator
+
+import pytest
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.data.entities import ConsentEntity
+from app.services.consent_index_service import consent_index
+
+
+@pytest.fixture
+def consent_index_enabled() -> Iterator[None]:
+    settings.CONSENT_INDEX_ENABLED = True
+    test_base.empty_database()
+    yield
+    settings.CONSENT_INDEX_ENABLED = False
+    test_base.empty_database()
+
+
+def test_repeated_decisions_should_be_answered_from_the_index(consent_index_enabled: None) -> None:
+    test_base.insert_dialog_data(dialog_id='did1')
+    assert test_base.give_consent(dialog_id='did1').status_code == 200
+    assert consent_index.contains('did1')
+
+    # The index is trusted for the dialogs it knows, even without a consent in the database
+    consent_index.add(['did2'])
+    test_base.insert_dialog_data(dialog_id='did2')
+    assert test_base.give_consent(dialog_id='did2').status_code == 409
+    results = test_base.get_test_client().post('/consents', json=[
+        {'dialog_id': 'did2', 'has_given_consent': True},
+        {'dialog_id': 'did1', 'has_given_consent': False},
+    ]).json()
+    assert [result['status_code'] for result in results] == [409, 409]
+
+    # Dialogs it does not know are still checked in the database
+    db = test_base.get_database()
+    db.add(ConsentEntity(dialog_id='did3', has_given_consent=True))
+    db.commit()
+    db.close()
+    test_base.insert_dialog_data(dialog_id='did3')
+    assert test_base.give_consent(dialog_id='did3').status_code == 409
+
+
+def test_refresh_should_catch_up_with_the_consents_table(consent_index_enabled: None) -> None:
+    db = test_base.get_database()
+    db.add_all([ConsentEntity(dialog_id=f'did{index}', has_given_consent=True) for index in range(3)])
+    db.commit()
+
+    consent_index.refresh(db)
+    assert len(consent_index) == 3 and consent_index.contains('did2')
+
+    db.add(ConsentEntity(dialog_id='did3', has_given_consent=False))
+    db.commit()
+    consent_index.refresh(db)
+    assert len(consent_index) == 4
+
+    # The whole index is reloaded when the consents were removed
+    db.query(ConsentEntity).delete()
+    db.add(ConsentEntity(dialog_id='did9', has_given_consent=True))
+    db.commit()
+    consent_index.refresh(db)
+    db.close()
+    assert len(consent_index) == 1 and not consent_index.contains('did0')
+
+
+def test_anomalies_should_skip_the_decided_dialogs_with_the_index(consent_index_enabled: None) -> None:
+    anomaly_period_ms = settings.ANOMALY_PERIOD_MS
+    settings.ANOMALY_PERIOD_MS = 0
+    for index in range(6):
+        test_base.insert_dialog_data(dialog_id=f'did{index}')
+    for index in range(0, 6, 2):
+        test_base.give_consent(dialog_id=f'did{index}')
+        # Messages received after the decision do not make the dialog an anomaly
+        test_base.insert_dialog_data(dialog_id=f'did{index}')
+
+    with_index = test_base.get_test_client().get('/data/anomaly?limit=2')
+    settings.CONSENT_INDEX_ENABLED = False
+    without_index = test_base.get_test_client().get('/data/anomaly?limit=2')
+    settings.ANOMALY_PERIOD_MS = anomaly_period_ms
+
+    assert [anomaly['dialog_id'] for anomaly in with_index.json()] == ['did1', 'did3']
+    assert with_index.json() == without_index.json()
+    assert with_index.headers['X-Next-Cursor'] == without_index.headers['X-Next-Cursor']
@@ -1,3 +1,4 @@
+import json
 import time
 from typing import List
 
@@ -5,7 +6,7 @@ import pytest
 from tests.helpers import test_base
 
 from app.config.config import settings
-from app.data.entities import ConsentEntity, DialogDataEntity, TemporaryDialogDataEntity
+from app.data.entities import ConsentEntity, DialogDataEntity, PendingDialogEntity, TemporaryDialogDataEntity
 
 
 def test_save_data_should_work() -> None:
@@ -87,6 +88,54 @@ def test_save_data_missing_path_param_should_return_not_found() -> None:
     assert response.status_code == 404
 
 
+def test_save_data_batch_should_work() -> None:
+    test_base.empty_database()
+    payload = [
+        {'text': 'Hello!', 'language': 'EN', 'customer_id': 'id12', 'dialog_id': 'did34'},
+        {'text': 'Bonjour!', 'language': 'FR', 'customer_id': 'id13', 'dialog_id': 'did35'},
+        {'text': 'What\'s up?', 'language': 'EN', 'customer_id': 'id12', 'dialog_id': 'did34'}
+    ]
+
+    response = test_base.insert_dialog_data_batch(payload=payload)
+
+    assert response.status_code == 200
+    assert response.json() == [1, 2, 3]
+
+    db = test_base.get_database()
+    assert len(db.query(DialogDataEntity).all()) == 0
+    saved_items = db.query(TemporaryDialogDataEntity).order_by(TemporaryDialogDataEntity.id).all()
+    assert len(saved_items) == 3
+    for saved_item, item_payload in zip(saved_items, payload):
+        assert saved_item.text == item_payload['text']
+        assert saved_item.language == item_payload['language'].lower()
+        assert saved_item.customer_id == item_payload['customer_id']
+        assert saved_item.dialog_id == item_payload['dialog_id']
+
+
+def test_save_data_batch_should_return_unprocessable_entity_if_invalid_item() -> None:
+    test_base.empty_database()
+    payload = [
+        {'text': 'Hello!', 'language': 'EN', 'customer_id': 'id12', 'dialog_id': 'did34'},
+        {'text': 'Bonjour!', 'language': 'FR', 'customer_id': 'id13'}
+    ]
+
+    response = test_base.insert_dialog_data_batch(payload=payload)
+    assert response.status_code == 422
+
+    db = test_base.get_database()
+    assert len(db.query(TemporaryDialogDataEntity).all()) == 0
+
+
+def test_save_data_batch_should_return_unprocessable_entity_if_empty() -> None:
+    test_base.empty_database()
+
+    response = test_base.insert_dialog_data_batch(payload=[])
+    assert response.status_code == 422
+
+    db = test_base.get_database()
+    assert len(db.query(PendingDialogEntity).all()) == 0
+
+
 def test_get_data_should_work_without_filters() -> None:
     test_base.empty_database()
     dialog_data_payloads = test_base.get_test_payloads_save_dialog_data()
@@ -351,6 +400,87 @@ def test_get_data_skip_and_limit_should_throw() -> None:
     assert get_data_incorrect_limit.status_code == 422
 
 
+def test_get_data_cursor_should_work() -> None:
+    test_base.empty_database()
+    dialog_data_payloads = test_base.get_test_payloads_save_dialog_data()
+
+    for _ in range(50):
+        test_base.insert_dialog_data(payload=dialog_data_payloads[0], customer_id='id11', dialog_id='did3')
+        test_base.insert_dialog_data(payload=dialog_data_payloads[1], customer_id='id89', dialog_id='did12')
+
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+    test_base.give_consent(has_given_consent=True, dialog_id='did12')
+
+    expected_ids = [item['id'] for item in test_base.get_dialog_data(query_string='').json()]
+
+    paged_ids: List[int] = []
+    query_string = '?limit=19'
+    while True:
+        page = test_base.get_dialog_data(query_string=query_string)
+        assert page.status_code == 200
+        paged_ids += [item['id'] for item in page.json()]
+
+        next_cursor = page.headers.get('X-Next-Cursor')
+        if next_cursor is None:
+            break
+        query_string = f'?limit=19&cursor={next_cursor}'
+
+    assert paged_ids == expected_ids
+
+    first_page = test_base.get_dialog_data(query_string='?customerId=id89&limit=30')
+    next_cursor = first_page.headers['X-Next-Cursor']
+    second_page = test_base.get_dialog_data(query_string=f'?customerId=id89&limit=30&cursor={next_cursor}')
+    second_page_json = second_page.json()
+    assert len(second_page_json) == 20
+    assert all(item['customer_id'] == 'id89' for item in second_page_json)
+    assert 'X-Next-Cursor' not in second_page.headers
+
+
+def test_get_data_cursor_should_throw() -> None:
+    test_base.empty_database()
+
+    get_data_invalid_cursor = test_base.get_dialog_data(query_string='?cursor=abc')
+    assert get_data_invalid_cursor.status_code == 400
+
+    test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+    test_base.insert_dialog_data(customer_id='id11', dialog_id='did3')
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+    next_cursor = test_base.get_dialog_data(query_string='?limit=1').headers['X-Next-Cursor']
+
+    get_data_cursor_and_skip = test_base.get_dialog_data(query_string=f'?skip=1&cursor={next_cursor}')
+    assert get_data_cursor_and_skip.status_code == 400
+
+
+def test_get_data_stream_should_work() -> None:
+    test_base.empty_database()
+    settings.STREAM_BATCH_SIZE = 7
+    dialog_data_payloads = test_base.get_test_payloads_save_dialog_data()
+
+    for _ in range(20):
+        test_base.insert_dialog_data(payload=dialog_data_payloads[0], customer_id='id11', dialog_id='did3')
+        test_base.insert_dialog_data(payload=dialog_data_payloads[1], customer_id='id89', dialog_id='did12')
+
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+    test_base.give_consent(has_given_consent=True, dialog_id='did12')
+
+    expected_data = test_base.get_dialog_data(query_string='?customerId=id89').json()
+
+    get_data_stream = test_base.get_dialog_data(query_string='?customerId=id89&stream=true')
+    assert get_data_stream.status_code == 200
+    assert get_data_stream.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line) for line in get_data_stream.text.splitlines()] == expected_data
+
+    get_data_accept = test_base.get_test_client().get('/data/?limit=11', headers={'Accept': 'application/x-ndjson'})
+    assert get_data_accept.status_code == 200
+    assert len(get_data_accept.text.splitlines()) == 11
+
+
+def test_get_data_stream_should_throw_before_streaming() -> None:
+    test_base.empty_database()
+    get_data_stream = test_base.get_dialog_data(query_string='?stream=true&cursor=abc')
+    assert get_data_stream.status_code == 400
+
+
 def test_get_anomalies_should_work() -> None:
     settings.ANOMALY_PERIOD_MS = 500
     test_base.empty_database()
@@ -394,6 +524,52 @@ def test_get_anomalies_work_if_there_are_no_anomalies() -> None:
     assert get_data_no_anomaly.status_code == 200
 
 
+def test_get_anomalies_should_be_grouped_by_dialog() -> None:
+    settings.ANOMALY_PERIOD_MS = 0
+    test_base.empty_database()
+    dialog_data_payloads = test_base.get_test_payloads_save_dialog_data()
+
+    for payload in dialog_data_payloads:
+        test_base.insert_dialog_data(payload=payload, customer_id='id11', dialog_id='did3')
+    test_base.insert_dialog_data(payload=dialog_data_payloads[0], customer_id='id12', dialog_id='did4')
+    test_base.insert_dialog_data(payload=dialog_data_payloads[0], customer_id='id13', dialog_id='did5')
+    test_base.give_consent(has_given_consent=True, dialog_id='did5')
+    # Data received after the consent decision is not an anomaly either
+    test_base.insert_dialog_data(payload=dialog_data_payloads[1], customer_id='id13', dialog_id='did5')
+
+    get_data_anomaly = test_base.get_test_client().get('/data/anomaly')
+    get_data_anomaly_json = get_data_anomaly.json()
+    assert [anomaly['dialog_id'] for anomaly in get_data_anomaly_json] == ['did3', 'did4']
+    assert get_data_anomaly_json[0]['customer_id'] == 'id11'
+    assert get_data_anomaly_json[0]['message_count'] == 3
+    assert get_data_anomaly_json[0]['received_at_timestamp_utc'] < \
+        get_data_anomaly_json[0]['last_received_at_timestamp_utc']
+    assert get_data_anomaly_json[1]['message_count'] == 1
+
+
+def test_get_anomalies_pagination_should_work() -> None:
+    settings.ANOMALY_PERIOD_MS = 0
+    test_base.empty_database()
+    test_base.insert_dialog_data_batch(payload=[
+        {'text': 'Hello!', 'language': 'EN', 'customer_id': 'id12', 'dialog_id': f'did{i}'} for i in range(25)
+    ])
+
+    dialog_ids: List[str] = []
+    query_string = '?limit=10'
+    while True:
+        page = test_base.get_test_client().get(f'/data/anomaly{query_string}')
+        assert page.status_code == 200
+        dialog_ids += [anomaly['dialog_id'] for anomaly in page.json()]
+
+        next_cursor = page.headers.get('X-Next-Cursor')
+        if next_cursor is None:
+            break
+        query_string = f'?limit=10&cursor={next_cursor}'
+
+    assert sorted(dialog_ids) == sorted(f'did{i}' for i in range(25))
+    assert len(dialog_ids) == 25
+
+
 @pytest.fixture(scope='session', autouse=True)
 def cleanup(request: pytest.FixtureRequest) -> None:
     def clean_test_db() -> None:
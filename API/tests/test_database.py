@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import literal, select, true, union_all
+from sqlalchemy.exc import OperationalError
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.data.entities import ConsentEntity
+from app.data.statements import insert_from_select
+
+
+def test_sqlite_performance_profile_should_be_applied() -> None:
+    with test_base.engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == settings.SQLITE_JOURNAL_MODE.lower()
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == settings.SQLITE_BUSY_TIMEOUT_MS
+        assert connection.exec_driver_sql('PRAGMA cache_size').scalar() == settings.SQLITE_CACHE_SIZE
+        assert connection.exec_driver_sql('PRAGMA query_only').scalar() == 0
+
+
+def test_read_only_engine_should_refuse_writes() -> None:
+    test_base.empty_database()
+    db = test_base.testing_read_session_local()
+
+    assert db.query(ConsentEntity).all() == []
+
+    db.add(ConsentEntity(dialog_id='did55', has_given_consent=True))
+    with pytest.raises(OperationalError):
+        db.commit()
+    db.close()
+
+
+def test_inserted_rows_should_be_read_back() -> None:
+    test_base.empty_database()
+    db = test_base.get_database()
+    db.add_all([ConsentEntity(id=5, dialog_id='did5', has_given_consent=False),
+                ConsentEntity(id=100, dialog_id='did100', has_given_consent=True)])
+    db.commit()
+
+    consents = ConsentEntity.__table__
+    inserted_count, is_inserted = insert_from_select(
+        consents, columns=['dialog_id', 'has_given_consent'],
+        rows=union_all(select(literal('did6'), true()), select(literal('did7'), true())).subquery().select(),
+        stamp_column='received_at_timestamp_utc', db=db
+    )
+    assert inserted_count == 2
+    assert db.execute(select(consents.c.dialog_id).where(is_inserted).order_by(consents.c.id)).scalars().all() \
+        == ['did6', 'did7']
+    db.commit()
+    db.close()
+    test_base.empty_database()
@@ -0,0 +1,155 @@
+import csv
+import io
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.data.entities import DialogDataEntity
+from app.services import partition_service
+
+
+@pytest.fixture
+def export_batch_size() -> Iterator[int]:
+    batch_size = settings.EXPORT_BATCH_SIZE
+    settings.EXPORT_BATCH_SIZE = 4
+    yield settings.EXPORT_BATCH_SIZE
+    settings.EXPORT_BATCH_SIZE = batch_size
+    test_base.empty_database()
+
+
+def insert_dialog_data(count: int, received_at: datetime, language: str = 'en') -> None:
+    db = test_base.get_database()
+    for index in range(count):
+        db.add(DialogDataEntity(customer_id=f'id{index % 2}', dialog_id=f'did{index}', text=f'Message, "{index}"',
+                                language=language, received_at_timestamp_utc=received_at + timedelta(hours=index)))
+    db.commit()
+    db.close()
+
+
+def read_csv_export(query_string: str) -> List[dict]:
+    response = test_base.get_test_client().get(f'/data/export?{query_string}')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    return list(csv.DictReader(io.StringIO(response.text)))
+
+
+def test_csv_export_should_stream_the_filtered_rows(export_batch_size: int) -> None:
+    test_base.empty_database()
+    insert_dialog_data(10, received_at=datetime(2022, 5, 1))
+    insert_dialog_data(3, received_at=datetime(2022, 5, 1), language='fr')
+
+    rows = read_csv_export('format=csv')
+    assert len(rows) == 13
+    assert list(rows[0]) == ['text', 'language', 'id', 'customer_id', 'dialog_id', 'received_at_timestamp_utc']
+    assert [int(row['id']) for row in rows] == sorted(int(row['id']) for row in rows)
+    assert rows[0]['text'] == 'Message, "0"'
+
+    assert len(read_csv_export('language=EN&customerId=id1')) == 5
+    assert len(read_csv_export('from=2022-05-01T02:00:00&to=2022-05-01T05:00:00')) == 4
+    assert read_csv_export('language=de') == []
+
+
+def test_export_watermark_should_only_return_the_new_rows(export_batch_size: int) -> None:
+    test_base.empty_database()
+    insert_dialog_data(5, received_at=datetime(2022, 5, 1))
+
+    response = test_base.get_test_client().get('/data/export')
+    watermark = response.headers['X-Export-Watermark']
+    assert len(list(csv.DictReader(io.StringIO(response.text)))) == 5
+
+    # Messages promoted later are exported by the next run, even if they were received before the exported ones
+    insert_dialog_data(2, received_at=datetime(2022, 4, 1))
+    rows = read_csv_export(f'watermark={watermark}')
+    assert [row['received_at_timestamp_utc'][:10] for row in rows] == ['2022-04-01', '2022-04-01']
+
+    response = test_base.get_test_client().get(f'/data/export?watermark={watermark}')
+    next_watermark = response.headers['X-Export-Watermark']
+    assert read_csv_export(f'watermark={next_watermark}') == []
+    assert test_base.get_test_client().get(f'/data/export?watermark={next_watermark}') \
+        .headers['X-Export-Watermark'] == next_watermark
+
+
+def test_columnar_exports_should_write_one_row_group_per_batch(export_batch_size: int) -> None:
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    test_base.empty_database()
+    insert_dialog_data(10, received_at=datetime(2022, 5, 1))
+    client = test_base.get_test_client()
+
+    response = client.get('/data/export?format=parquet', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'content-encoding' not in response.headers
+    parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(response.content))
+    assert parquet_file.metadata.num_row_groups == 3
+    table = parquet_file.read()
+    assert table.num_rows == 10
+    assert table.column('received_at_timestamp_utc')[0].as_py().isoformat() == '2022-05-01T00:00:00+00:00'
+
+    response = client.get('/data/export?format=arrow&customerId=id0')
+    assert response.headers['content-type'] == 'application/vnd.apache.arrow.stream'
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column('customer_id').to_pylist() == ['id0'] * 5
+
+    empty_table = pyarrow.parquet.read_table(io.BytesIO(client.get('/data/export?format=parquet&language=de').content))
+    assert empty_table.num_rows == 0
+    assert empty_table.schema.names == table.schema.names
+
+
+def test_export_should_reject_unknown_formats() -> None:
+    client = test_base.get_test_client()
+    assert client.get('/data/export?format=xlsx').status_code == 400
+    assert client.get('/data/export?watermark=-1').status_code == 422
+
+
+def test_export_should_include_the_attached_partitions(tmp_path: Path, export_batch_size: int) -> None:
+    directory = settings.PARTITION_DIRECTORY
+    settings.PARTITION_DIRECTORY = str(tmp_path)
+    test_base.empty_database()
+    insert_dialog_data(6, received_at=datetime(2022, 1, 1))
+    insert_dialog_data(3, received_at=datetime.utcnow() - timedelta(hours=5))
+    try:
+        before_sealing = read_csv_export('')
+        partition_service.seal_partition('2022-01', test_base.engine)
+
+        assert read_csv_export('') == before_sealing
+        assert len(read_csv_export('from=2022-01-01T03:00:00&to=2022-02-01T00:00:00')) == 3
+    finally:
+        test_base.empty_database()
+        settings.PARTITION_DIRECTORY = directory
+
+
+def test_export_watermark_should_return_the_rows_promoted_after_sealing(tmp_path: Path,
+                                                                        export_batch_size: int) -> None:
+    directory = settings.PARTITION_DIRECTORY
+    settings.PARTITION_DIRECTORY = str(tmp_path)
+    test_base.empty_database()
+    insert_dialog_data(6, received_at=datetime(2022, 1, 1))
+    try:
+        response = test_base.get_test_client().get('/data/export')
+        watermark = response.headers['X-Export-Watermark']
+        # The newest rows leave the live table, whose greatest id drops below the watermark
+        partition_service.seal_partition('2022-01', test_base.engine)
+
+        test_base.insert_dialog_data(customer_id='id5', dialog_id='did5')
+        test_base.give_consent(has_given_consent=True, dialog_id='did5')
+
+        assert [row['dialog_id'] for row in read_csv_export(f'watermark={watermark}')] == ['did5']
+        rows = read_csv_export('')
+        assert len(rows) == len({row['id'] for row in rows}) == 7
+
+        # A different row given the id of a sealed one, as happened before dialog_data had AUTOINCREMENT, is kept
+        db = test_base.get_database()
+        db.add(DialogDataEntity(id=int(rows[0]['id']), customer_id='id6', dialog_id='did6', text='Reused id',
+                                language='en', received_at_timestamp_utc=datetime(2022, 2, 1)))
+        db.commit()
+        db.close()
+        assert {row['text'] for row in read_csv_export('')[:2]} == {'Message, "0"', 'Reused id'}
+    finally:
+        test_base.empty_database()
+        settings.PARTITION_DIRECTORY = directory
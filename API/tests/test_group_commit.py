@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator
+
+import pytest
+from sqlalchemy import event
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.data.entities import TemporaryDialogDataEntity
+from app.data.models import DialogDataCreateModel
+from app.services.group_commit_service import GroupCommitBuffer, ingest_buffer
+
+
+@pytest.fixture
+def group_commit_ingestion() -> Iterator[None]:
+    session_factory = ingest_buffer.session_factory
+    ingest_buffer.session_factory = test_base.testing_session_local
+    settings.INGEST_GROUP_COMMIT = True
+    yield
+    settings.INGEST_GROUP_COMMIT = False
+    ingest_buffer.stop()
+    ingest_buffer.session_factory = session_factory
+
+
+def test_group_commit_buffer_should_commit_rows_together() -> None:
+    test_base.empty_database()
+    commit_count = 0
+
+    def count_commit(connection: Any) -> None:
+        nonlocal commit_count
+        commit_count += 1
+
+    event.listen(test_base.engine, 'commit', count_commit)
+    buffer = GroupCommitBuffer(session_factory=test_base.testing_session_local, max_rows=10, max_delay_ms=200)
+
+    try:
+        with ThreadPoolExecutor(max_workers=25) as executor:
+            futures = list(executor.map(
+                lambda i: buffer.submit(dialog_data=DialogDataCreateModel(text=f'Message {i}', language='EN'),
+                                        customer_id='id12', dialog_id=f'did{i % 3}'),
+                range(25)
+            ))
+            results = [future.result(timeout=5) for future in futures]
+    finally:
+        buffer.stop()
+        event.remove(test_base.engine, 'commit', count_commit)
+
+    assert commit_count < 25
+    assert len({result.id for result in results}) == 25
+    assert [result.text for result in results] == [f'Message {i}' for i in range(25)]
+    assert all(result.language == 'en' for result in results)
+
+    db = test_base.get_database()
+    assert len(db.query(TemporaryDialogDataEntity).all()) == 25
+
+
+def test_save_data_with_group_commit_should_work(group_commit_ingestion: None) -> None:
+    test_base.empty_database()
+
+    response = test_base.insert_dialog_data(dialog_id='did34', customer_id='id12')
+    assert response.status_code == 200
+    response_json = response.json()
+    assert response_json['id'] == 1
+    assert response_json['dialog_id'] == 'did34'
+    assert response_json['received_at_timestamp_utc'] is not None
+
+    db = test_base.get_database()
+    saved_item = db.query(TemporaryDialogDataEntity).one()
+    assert saved_item.customer_id == 'id12'
+
+    response = test_base.give_consent(has_given_consent=True, dialog_id='did34')
+    assert response.status_code == 200
@@ -1,7 +1,74 @@
+import sqlite3
+from typing import Iterator
+
+import pytest
+from sqlalchemy.pool import QueuePool
 from tests.helpers import test_base
 
+from app.config.config import settings
+from app.services.health_service import get_pool_stats
+
+
+@pytest.fixture
+def health_thresholds() -> Iterator[None]:
+    thresholds = (settings.HEALTH_PROBE_TIMEOUT_MS, settings.HEALTH_MAX_PROBE_LATENCY_MS,
+                  settings.HEALTH_MAX_POOL_USAGE)
+    yield
+    settings.HEALTH_PROBE_TIMEOUT_MS, settings.HEALTH_MAX_PROBE_LATENCY_MS, settings.HEALTH_MAX_POOL_USAGE = thresholds
+
 
 def test_health_check() -> None:
     response = test_base.get_test_client().get('/health')
     assert response.status_code == 200
     assert response.json() == 'Ok'
+
+
+def test_readiness_should_report_the_probe_and_the_pools() -> None:
+    response = test_base.get_test_client().get('/health/ready')
+    assert response.status_code == 200
+    readiness = response.json()
+    assert readiness['ready'] and readiness['failures'] == []
+    assert readiness['database']['latency_ms'] > 0 and readiness['database']['error'] is None
+    assert readiness['pools']['write']['size'] == settings.DATABASE_POOL_SIZE
+    assert set(readiness['pools']['read']) == {'size', 'max_overflow', 'checked_in', 'checked_out', 'overflow', 'usage'}
+
+
+def test_pool_stats_should_use_the_capacity_of_the_pool() -> None:
+    pool = QueuePool(lambda: sqlite3.connect(':memory:'), pool_size=2, max_overflow=2)
+    connection = pool.connect()
+    assert get_pool_stats(pool) == {'size': 2, 'max_overflow': 2, 'checked_in': 0, 'checked_out': 1, 'overflow': 0,
+                                    'usage': 0.25}
+
+    unlimited_pool = QueuePool(lambda: sqlite3.connect(':memory:'), pool_size=2, max_overflow=-1)
+    assert get_pool_stats(unlimited_pool)['max_overflow'] is None
+    assert get_pool_stats(unlimited_pool)['usage'] is None
+    connection.close()
+
+
+def test_readiness_should_fail_when_the_database_is_locked(health_thresholds: None) -> None:
+    settings.HEALTH_PROBE_TIMEOUT_MS = 50
+    connection = sqlite3.connect(test_base.database_location, isolation_level=None)
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        response = test_base.get_test_client().get('/health/ready')
+    finally:
+        connection.execute('ROLLBACK')
+        connection.close()
+
+    assert response.status_code == 503
+    readiness = response.json()
+    assert not readiness['ready'] and readiness['database']['latency_ms'] is None
+    assert readiness['failures'][0].startswith('Database probe')
+    assert test_base.get_test_client().get('/health/ready').status_code == 200
+
+
+def test_readiness_should_fail_above_the_thresholds(health_thresholds: None) -> None:
+    settings.HEALTH_MAX_PROBE_LATENCY_MS = 0
+    settings.HEALTH_MAX_POOL_USAGE = 0
+    with test_base.engine.connect():
+        response = test_base.get_test_client().get('/health/ready')
+
+    assert response.status_code == 503
+    failures = response.json()['failures']
+    assert failures[0].startswith('Usage of the write pool is')
+    assert failures[-1].startswith('Database probe took')
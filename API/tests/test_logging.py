@@ -0,0 +1,70 @@
+import json
+import logging
+from typing import Iterator, List
+
+import pytest
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.helpers.logging_helper import JsonFormatter, request_logger
+
+
+class RecordCollector(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+@pytest.fixture
+def collector() -> Iterator[RecordCollector]:
+    handlers = request_logger.handlers
+    record_collector = RecordCollector()
+    request_logger.handlers = [record_collector]
+    yield record_collector
+    request_logger.handlers = handlers
+    settings.LOG_SAMPLE_RATE = 1.0
+    settings.LOG_ROUTE_SAMPLE_RATES = {}
+    settings.LOG_ROUTE_BODY_MAX_BYTES = {}
+
+
+def test_requests_should_be_logged_as_structured_records(collector: RecordCollector) -> None:
+    test_base.empty_database()
+    test_base.insert_dialog_data(customer_id='id12', dialog_id='did34')
+
+    assert len(collector.records) == 1
+    request_info = json.loads(JsonFormatter().format(collector.records[0]))
+    assert request_info['method'] == 'POST'
+    assert request_info['route'] == '/data/{customerId}/{dialogId}'
+    assert request_info['path_params'] == {'customerId': 'id12', 'dialogId': 'did34'}
+    assert request_info['response_status'] == 200
+    assert json.loads(request_info['request']['body']) == test_base.get_first_dialog_data_payload()
+    assert json.loads(request_info['response']['body'])['dialog_id'] == 'did34'
+    assert request_info['duration_ms'] >= 0
+
+
+def test_request_logging_should_be_sampled(collector: RecordCollector) -> None:
+    settings.LOG_SAMPLE_RATE = 0
+    test_base.get_test_client().get('/health')
+    assert len(collector.records) == 0
+
+    settings.LOG_ROUTE_SAMPLE_RATES = {'/health': 1}
+    test_base.get_test_client().get('/health')
+    test_base.get_dialog_data(query_string='')
+    assert [record.request_info['route'] for record in collector.records] == ['/health']
+
+
+def test_logged_bodies_should_be_truncated(collector: RecordCollector) -> None:
+    test_base.empty_database()
+    settings.LOG_ROUTE_BODY_MAX_BYTES = {'/data/{customerId}/{dialogId}': 10}
+
+    test_base.insert_dialog_data(customer_id='id12', dialog_id='did34')
+    test_base.get_dialog_data(query_string='?stream=true')
+
+    ingest_info, stream_info = [record.request_info for record in collector.records]
+    assert len(ingest_info['request']['body']) == 10
+    assert ingest_info['request']['body_truncated']
+    assert ingest_info['request']['body_size'] > 10
+    assert stream_info['response']['body'] == '<streamed>'
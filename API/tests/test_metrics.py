@@ -0,0 +1,104 @@
+from typing import Dict, Optional
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy.exc import OperationalError
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.data.database import engine
+
+
+def get_sample_values() -> Dict[str, Dict[tuple, float]]:
+    response = test_base.get_test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+
+    values: Dict[str, Dict[tuple, float]] = {}
+    for family in text_string_to_metric_families(response.text):
+        for sample in family.samples:
+            values.setdefault(sample.name, {})[tuple(sorted(sample.labels.items()))] = sample.value
+    return values
+
+
+def get_sample_value(name: str, **labels: str) -> Optional[float]:
+    return get_sample_values().get(name, {}).get(tuple(sorted(labels.items())))
+
+
+def test_requests_should_be_counted_and_timed_per_route_and_status() -> None:
+    route = {'method': 'POST', 'route': '/consents/{dialogId}'}
+    count_before = get_sample_value('http_requests_total', status='404', **route) or 0
+
+    response = test_base.give_consent(has_given_consent=True, dialog_id='unknown')
+    assert response.status_code == 404
+
+    assert get_sample_value('http_requests_total', status='404', **route) == count_before + 1
+    assert get_sample_value('http_request_duration_seconds_count', status='404', **route) == count_before + 1
+    assert get_sample_value('http_requests_in_progress', **route) == 0
+
+
+def test_validation_errors_should_be_counted_with_their_status() -> None:
+    route = {'method': 'GET', 'route': '/data/', 'status': '422'}
+    count_before = get_sample_value('http_requests_total', **route) or 0
+
+    assert test_base.get_test_client().get('/data/?limit=0').status_code == 422
+
+    assert get_sample_value('http_requests_total', **route) == count_before + 1
+
+
+def test_sql_statements_and_pool_checkouts_should_be_measured() -> None:
+    select_count_before = get_sample_value('sql_statements_total', engine='read', operation='SELECT') or 0
+    checkout_count_before = get_sample_value('db_pool_checkout_wait_seconds_count', engine='read') or 0
+
+    assert test_base.get_test_client().get('/data/').status_code == 200
+
+    assert get_sample_value('sql_statements_total', engine='read', operation='SELECT') > select_count_before
+    assert get_sample_value('sql_statement_duration_seconds_count', engine='read', operation='SELECT') > 0
+    assert get_sample_value('db_pool_checkout_wait_seconds_count', engine='read') > checkout_count_before
+
+
+def test_ingested_and_promoted_rows_should_be_counted() -> None:
+    test_base.empty_database()
+    ingested_before = get_sample_value('dialog_data_ingested_rows_total')
+    promoted_before = get_sample_value('dialog_data_promoted_rows_total')
+
+    test_base.insert_dialog_data(dialog_id='did3')
+    test_base.insert_dialog_data_batch(payload=[
+        {'text': 'Hello chatbot', 'language': 'EN', 'customer_id': 'id12', 'dialog_id': 'did3'},
+        {'text': 'Hello again', 'language': 'EN', 'customer_id': 'id12', 'dialog_id': 'did4'}
+    ])
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+    test_base.give_consent(has_given_consent=False, dialog_id='did4')
+
+    assert get_sample_value('dialog_data_ingested_rows_total') == ingested_before + 3
+    assert get_sample_value('dialog_data_promoted_rows_total') == promoted_before + 2
+
+
+def test_query_cache_lookups_should_be_counted() -> None:
+    hits_before = get_sample_value('query_cache_requests_total', cache='dialog_data', result='hit') or 0
+    misses_before = get_sample_value('query_cache_requests_total', cache='dialog_data', result='miss') or 0
+
+    settings.QUERY_CACHE_ENABLED = True
+    try:
+        test_base.get_dialog_data(query_string='?language=de')
+        test_base.get_dialog_data(query_string='?language=de')
+    finally:
+        settings.QUERY_CACHE_ENABLED = False
+
+    assert get_sample_value('query_cache_requests_total', cache='dialog_data', result='miss') == misses_before + 1
+    assert get_sample_value('query_cache_requests_total', cache='dialog_data', result='hit') == hits_before + 1
+    assert get_sample_value('query_cache_entries', cache='dialog_data') >= 1
+
+
+def test_failed_statements_should_not_leave_timers_behind() -> None:
+    count_before = get_sample_value('sql_statement_duration_seconds_count', engine='write', operation='SELECT') or 0
+
+    with engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.exec_driver_sql('SELECT * FROM missing_table')
+        assert connection.exec_driver_sql('SELECT 1').scalar() == 1
+        assert 'statement_start_times' not in connection.info
+
+    # Only the statement that completed is observed
+    assert get_sample_value('sql_statement_duration_seconds_count', engine='write', operation='SELECT') \
+        == count_before + 1
@@ -0,0 +1,104 @@
+from pathlib import Path
+from typing import Set
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine.reflection import Inspector
+
+from app.data.database import Base
+from app.data.migrations import MIGRATIONS, get_schema_version, run_migrations
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE dialog_data (id INTEGER NOT NULL, customer_id VARCHAR, dialog_id VARCHAR, text VARCHAR, '
+    'language VARCHAR, received_at_timestamp_utc DATETIME, PRIMARY KEY (id))',
+    'CREATE INDEX ix_dialog_data_received_at_timestamp_utc ON dialog_data (received_at_timestamp_utc)',
+    'CREATE INDEX ix_dialog_data_customer_id ON dialog_data (customer_id)',
+    'CREATE TABLE temporary_dialog_data (id INTEGER NOT NULL, customer_id VARCHAR, dialog_id VARCHAR, text VARCHAR, '
+    'language VARCHAR, received_at_timestamp_utc DATETIME, PRIMARY KEY (id))',
+    'CREATE INDEX ix_temporary_dialog_data_customer_id ON temporary_dialog_data (customer_id)',
+    'CREATE INDEX ix_temporary_dialog_data_received_at_timestamp_utc ON temporary_dialog_data '
+    '(received_at_timestamp_utc)',
+    'CREATE TABLE consents (id INTEGER NOT NULL, dialog_id VARCHAR, has_given_consent BOOLEAN, '
+    'received_at_timestamp_utc DATETIME, PRIMARY KEY (id))',
+    'CREATE INDEX ix_consents_received_at_timestamp_utc ON consents (received_at_timestamp_utc)',
+    "INSERT INTO dialog_data (customer_id, dialog_id, text, language, received_at_timestamp_utc) "
+    "VALUES ('id12', 'did34', 'Hello!', 'en', '2023-01-09 20:30:38.942000')",
+    "INSERT INTO temporary_dialog_data (customer_id, dialog_id, text, language, received_at_timestamp_utc) "
+    "VALUES ('id13', 'did35', 'Hello!', 'en', '2023-01-09 20:31:38.942000'), "
+    "('id13', 'did35', 'Bye!', 'en', '2023-01-09 20:32:38.942000')",
+    "INSERT INTO consents (dialog_id, has_given_consent, received_at_timestamp_utc) "
+    "VALUES ('did34', 1, '2023-01-09 20:30:40.000000')",
+]
+
+
+def get_index_names(engine_inspector: Inspector, table_name: str) -> Set[str]:
+    return {index['name'] for index in engine_inspector.get_indexes(table_name)}
+
+
+def test_migrations_should_create_schema_on_empty_database(tmp_path: Path) -> None:
+    engine = create_engine(f'sqlite:///{tmp_path / "empty.db"}')
+
+    run_migrations(engine)
+
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == len(MIGRATIONS)
+
+    engine_inspector = inspect(engine)
+    assert {'dialog_data', 'temporary_dialog_data', 'consents'} <= set(engine_inspector.get_table_names())
+    assert 'ix_dialog_data_language_received_at_timestamp_utc' in get_index_names(engine_inspector, 'dialog_data')
+    assert 'ix_consents_dialog_id' in get_index_names(engine_inspector, 'consents')
+
+
+def test_migrated_schema_should_match_the_entities(tmp_path: Path) -> None:
+    # The migrations write their DDL out: the tables they create have to stay those the entities are mapped to
+    engine = create_engine(f'sqlite:///{tmp_path / "empty.db"}')
+    run_migrations(engine)
+
+    engine_inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {column['name']: str(column['type']) for column in engine_inspector.get_columns(table.name)}
+        assert columns == {column.name: str(column.type.compile(engine.dialect)) for column in table.columns}
+        assert {index.name for index in table.indexes} == get_index_names(engine_inspector, table.name)
+
+
+def test_migrations_should_upgrade_legacy_database(tmp_path: Path) -> None:
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.exec_driver_sql(statement)
+
+    run_migrations(engine)
+    # Running the migrations again should not fail nor change anything
+    run_migrations(engine)
+
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == len(MIGRATIONS)
+        assert connection.exec_driver_sql('SELECT count(*) FROM dialog_data').scalar() == 1
+        assert connection.exec_driver_sql(
+            'SELECT dialog_id, customer_id, first_received_at_timestamp_utc, last_received_at_timestamp_utc, '
+            'message_count FROM pending_dialogs'
+        ).all() == [('did35', 'id13', '2023-01-09 20:31:38.942000', '2023-01-09 20:32:38.942000', 2)]
+        # The rollups are computed from the existing dialog data and consents
+        assert connection.exec_driver_sql('SELECT * FROM dialog_data_stats').all() == [('2023-01-09', 'en', 'id12', 1)]
+        assert connection.exec_driver_sql('SELECT * FROM consent_stats').all() == [('2023-01-09', 1, 0)]
+        # The dialog data table is rebuilt with AUTOINCREMENT, keeping its search index in sync
+        assert connection.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = 'dialog_data'").scalar() == 1
+        connection.exec_driver_sql("INSERT INTO dialog_data (text) VALUES ('Hello again!')")
+        assert connection.exec_driver_sql(
+            "SELECT rowid FROM dialog_data_fts WHERE dialog_data_fts MATCH 'hello' ORDER BY rowid"
+        ).scalars().all() == [1, 2]
+
+    engine_inspector = inspect(engine)
+    assert get_index_names(engine_inspector, 'dialog_data') == {
+        'ix_dialog_data_received_at_timestamp_utc',
+        'ix_dialog_data_dialog_id',
+        'ix_dialog_data_language_received_at_timestamp_utc',
+        'ix_dialog_data_customer_id_received_at_timestamp_utc',
+    }
+    assert get_index_names(engine_inspector, 'temporary_dialog_data') == {
+        'ix_temporary_dialog_data_received_at_timestamp_utc',
+        'ix_temporary_dialog_data_dialog_id',
+    }
+    assert get_index_names(engine_inspector, 'consents') == {
+        'ix_consents_received_at_timestamp_utc',
+        'ix_consents_dialog_id',
+    }
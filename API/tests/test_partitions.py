@@ -0,0 +1,201 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from tests.helpers import test_base
+
+from app.config.config import Settings, settings
+from app.data.database import get_read_db
+from app.data.entities import DialogDataEntity, DialogDataPartitionEntity, TemporaryDialogDataEntity
+from app.services import partition_service
+from app.main import app
+from app.services.data_service import add_temporary_dialog_data
+
+MONTHS = [datetime(2022, 1, 1), datetime(2022, 2, 1), datetime(2022, 3, 1)]
+
+
+@pytest.fixture
+def partition_directory(tmp_path: Path) -> Iterator[Path]:
+    directory = settings.PARTITION_DIRECTORY
+    delete_batch_size = settings.PARTITION_DELETE_BATCH_SIZE
+    settings.PARTITION_DIRECTORY = str(tmp_path / 'partitions')
+    settings.PARTITION_DELETE_BATCH_SIZE = 4
+    settings.PARTITION_DELETE_PAUSE_MS = 0
+    yield tmp_path / 'partitions'
+    test_base.empty_database()
+    settings.PARTITION_DIRECTORY = directory
+    settings.PARTITION_DELETE_BATCH_SIZE = delete_batch_size
+
+
+def insert_monthly_dialog_data() -> None:
+    test_base.empty_database()
+    db = test_base.get_database()
+    for month_index, month in enumerate(MONTHS):
+        for index in range(10):
+            db.add(DialogDataEntity(customer_id=f'id{index % 2}', dialog_id=f'did{month_index}',
+                                    text=f'Message {index} of {month:%Y-%m}', language='en' if index % 3 else 'fr',
+                                    received_at_timestamp_utc=month + timedelta(days=index, hours=month_index)))
+    db.add(DialogDataEntity(customer_id='id0', dialog_id='did9', text='Recent message', language='en',
+                            received_at_timestamp_utc=datetime.utcnow()))
+    db.commit()
+    db.close()
+
+
+def get_all_pages(query_string: str, limit: int) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    cursor = ''
+    while True:
+        response = test_base.get_dialog_data(f'?{query_string}&limit={limit}&cursor={cursor}')
+        assert response.status_code == 200
+        rows += response.json()
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            return rows
+
+
+def get_listings() -> Dict[str, Any]:
+    return {
+        'all': test_base.get_dialog_data('').json(),
+        'language': test_base.get_dialog_data('?language=en').json(),
+        'customer': test_base.get_dialog_data('?customerId=id1&limit=7').json(),
+        'skip': test_base.get_dialog_data('?skip=8&limit=15').json(),
+        'deep_skip': test_base.get_dialog_data('?skip=25&limit=15').json(),
+        'pages': get_all_pages('language=en', limit=4),
+        'stream': [json.loads(line) for line in test_base.get_dialog_data('?stream=true&skip=3&limit=20').iter_lines()]
+    }
+
+
+def test_sealed_partitions_should_be_listed_like_the_live_table(partition_directory: Path) -> None:
+    insert_monthly_dialog_data()
+    listings = get_listings()
+
+    partition = partition_service.seal_partition('2022-01', test_base.engine)
+    partition_service.seal_partition('2022-02', test_base.engine)
+
+    assert partition['row_count'] == 10
+    assert (partition_directory / 'dialog_data_2022_01.db').exists()
+    db = test_base.get_database()
+    assert db.query(DialogDataEntity).count() == 11
+    db.close()
+    assert get_listings() == listings
+    assert len(listings['all']) == 31
+
+
+def test_newest_pages_should_not_read_older_partitions(partition_directory: Path) -> None:
+    insert_monthly_dialog_data()
+    partition_service.seal_partition('2022-01', test_base.engine)
+    # Reading the partition would fail once its file is gone
+    (partition_directory / 'dialog_data_2022_01.db').unlink()
+
+    response = test_base.get_dialog_data('?limit=5')
+    assert response.status_code == 200
+    assert [row['text'] for row in response.json()][:2] == ['Recent message', 'Message 9 of 2022-03']
+
+
+def test_rows_promoted_after_sealing_should_be_merged(partition_directory: Path) -> None:
+    insert_monthly_dialog_data()
+    partition_service.seal_partition('2022-01', test_base.engine)
+
+    db = test_base.get_database()
+    add_temporary_dialog_data([TemporaryDialogDataEntity(
+        customer_id='id5', dialog_id='did5', text='Late message', language='en',
+        received_at_timestamp_utc=datetime(2022, 1, 5, 12)
+    )], db=db)
+    db.commit()
+    db.close()
+    test_base.give_consent(has_given_consent=True, dialog_id='did5')
+
+    texts = [row['text'] for row in test_base.get_dialog_data('').json()]
+    assert texts.index('Late message') == texts.index('Message 4 of 2022-01') - 1
+    assert len(texts) == 32
+
+
+def test_ids_of_sealed_rows_should_not_be_given_again(partition_directory: Path) -> None:
+    insert_monthly_dialog_data()
+    db = test_base.get_database()
+    db.query(DialogDataEntity).filter(DialogDataEntity.text == 'Recent message').delete()
+    db.commit()
+    db.close()
+    # The newest rows are moved to the partition, the live table is left with smaller ids only
+    partition = partition_service.seal_partition('2022-03', test_base.engine)
+
+    test_base.insert_dialog_data(customer_id='id5', dialog_id='did5')
+    test_base.give_consent(has_given_consent=True, dialog_id='did5')
+
+    rows = test_base.get_dialog_data('').json()
+    assert rows[0]['dialog_id'] == 'did5' and rows[0]['id'] > partition['max_id']
+    assert len({row['id'] for row in rows}) == len(rows) == 31
+
+
+def test_detached_partitions_should_not_be_listed(partition_directory: Path, tmp_path: Path) -> None:
+    insert_monthly_dialog_data()
+    partition_service.seal_partition('2022-01', test_base.engine)
+    etag = test_base.get_dialog_data('').headers['ETag']
+
+    partition_service.set_partition_state('2022-01', partition_service.DETACHED, test_base.engine)
+    response = test_base.get_dialog_data('')
+    assert len(response.json()) == 21
+    assert response.headers['ETag'] != etag
+
+    partition_service.set_partition_state('2022-01', partition_service.ATTACHED, test_base.engine)
+    assert len(test_base.get_dialog_data('').json()) == 31
+
+    archived_path = partition_service.archive_partition('2022-01', str(tmp_path / 'archive'), test_base.engine)
+    assert archived_path.exists()
+    assert len(test_base.get_dialog_data('').json()) == 21
+    assert [(partition['month'], partition['state']) for partition in
+            partition_service.list_partitions(test_base.engine)] == [('2022-01', partition_service.ARCHIVED)]
+    with pytest.raises(ValueError):
+        partition_service.set_partition_state('2022-01', partition_service.ATTACHED, test_base.engine)
+
+
+def test_only_past_months_should_be_sealed_once(partition_directory: Path) -> None:
+    insert_monthly_dialog_data()
+
+    with pytest.raises(ValueError):
+        partition_service.seal_partition(f'{datetime.utcnow():%Y-%m}', test_base.engine)
+    with pytest.raises(ValueError):
+        partition_service.seal_partition('2021-12', test_base.engine)
+
+    partition_service.seal_partition('2022-01', test_base.engine)
+    with pytest.raises(ValueError):
+        partition_service.seal_partition('2022-01', test_base.engine)
+
+    db = test_base.get_database()
+    assert [partition.month for partition in db.query(DialogDataPartitionEntity).all()] == ['2022-01']
+    db.close()
+
+
+def test_partitions_should_be_streamed_by_the_async_storage_layer(partition_directory: Path) -> None:
+    pytest.importorskip('aiosqlite')
+    insert_monthly_dialog_data()
+    partition_service.seal_partition('2022-01', test_base.engine)
+    partition_service.seal_partition('2022-02', test_base.engine)
+    expected_rows = test_base.get_dialog_data('').json()
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{test_base.database_location}')
+
+    async def override_get_read_db() -> AsyncIterator[AsyncSession]:
+        async with AsyncSession(async_engine) as db:
+            yield db
+
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    try:
+        response = test_base.get_dialog_data('?stream=true')
+        partial_response = test_base.get_dialog_data('?stream=true&skip=9&limit=12')
+    finally:
+        app.dependency_overrides[get_read_db] = test_base.override_get_read_db
+        asyncio.run(async_engine.dispose())
+
+    assert [json.loads(line) for line in response.iter_lines()] == expected_rows
+    assert [json.loads(line) for line in partial_response.iter_lines()] == expected_rows[9:21]
+
+
+def test_partition_directory_should_default_to_the_directory_of_the_database() -> None:
+    assert Settings(DATABASE_URI='sqlite:////data/chatbot_dialog.db').PARTITION_DIRECTORY == '/data/partitions'
+    assert Settings(DATABASE_URI='sqlite:///data/chatbot_dialog.db').PARTITION_DIRECTORY == 'data/partitions'
+    assert Settings(DATABASE_URI='sqlite:////data/chatbot_dialog.db',
+                    PARTITION_DIRECTORY='/partitions').PARTITION_DIRECTORY == '/partitions'
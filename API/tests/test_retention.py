@@ -0,0 +1,96 @@
+import time
+
+from tests.helpers import test_base
+
+from app.data.entities import (ArchivedTemporaryDialogDataEntity, PendingDialogEntity, PurgedDialogEntity,
+                               TemporaryDialogDataEntity)
+from app.services.retention_service import RetentionWorker
+
+
+def build_worker(period_ms: int = 0, archive: bool = False, batch_size: int = 100) -> RetentionWorker:
+    return RetentionWorker(session_factory=test_base.testing_session_local, period_ms=period_ms, archive=archive,
+                           interval_s=0.05, batch_size=batch_size, batch_max_duration_ms=50, pause_ms=0)
+
+
+def insert_dialogs() -> None:
+    test_base.empty_database()
+    test_base.insert_dialog_data(customer_id='id12', dialog_id='did1')
+    test_base.insert_dialog_data(customer_id='id12', dialog_id='did1')
+    test_base.insert_dialog_data(customer_id='id13', dialog_id='did2')
+    test_base.insert_dialog_data(customer_id='id14', dialog_id='did3')
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+    # Received after the consent of its dialog, so it can never be promoted: it is purged like the undecided dialogs
+    test_base.insert_dialog_data(customer_id='id14', dialog_id='did3')
+    time.sleep(0.01)
+
+
+def test_retention_should_delete_and_record_stale_dialogs() -> None:
+    insert_dialogs()
+
+    assert build_worker().purge() == 3
+
+    db = test_base.get_database()
+    assert db.query(TemporaryDialogDataEntity).count() == 0
+    assert db.query(PendingDialogEntity).count() == 0
+    purged_dialogs = db.query(PurgedDialogEntity).order_by(PurgedDialogEntity.dialog_id).all()
+    assert [(entry.dialog_id, entry.customer_id, entry.message_count, entry.action) for entry in purged_dialogs] == \
+        [('did1', 'id12', 2, 'DELETE'), ('did2', 'id13', 1, 'DELETE'), ('did3', 'id14', 1, 'DELETE')]
+    assert db.query(ArchivedTemporaryDialogDataEntity).count() == 0
+    db.close()
+
+    assert test_base.get_test_client().get('/data/anomaly').json() == []
+    assert test_base.get_test_client().get('/stats').json()['pending'] == {'dialogs': 0, 'messages': 0}
+
+
+def test_retention_should_archive_stale_dialogs_in_batches() -> None:
+    insert_dialogs()
+
+    assert build_worker(archive=True, batch_size=1).purge() == 3
+
+    db = test_base.get_database()
+    assert [(entry.dialog_id, entry.text) for entry in db.query(ArchivedTemporaryDialogDataEntity).all()] == \
+        [(dialog_id, 'Good afternoon chatbot') for dialog_id in ['did1', 'did1', 'did2', 'did3']]
+    assert {entry.action for entry in db.query(PurgedDialogEntity).all()} == {'ARCHIVE'}
+    assert db.query(PurgedDialogEntity).count() == 3
+    db.close()
+
+
+def test_retention_should_keep_dialogs_within_the_retention_period() -> None:
+    insert_dialogs()
+
+    assert build_worker(period_ms=3600000).purge() == 0
+
+    db = test_base.get_database()
+    assert db.query(TemporaryDialogDataEntity).count() == 4
+    assert db.query(PurgedDialogEntity).count() == 0
+    db.close()
+
+
+def test_retention_worker_should_purge_in_the_background() -> None:
+    insert_dialogs()
+    worker = build_worker()
+
+    worker.start()
+    try:
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            db = test_base.get_database()
+            purged_count = db.query(PurgedDialogEntity).count()
+            db.close()
+            if purged_count == 3:
+                break
+            time.sleep(0.01)
+    finally:
+        worker.stop()
+
+    assert purged_count == 3
+
+
+def test_retention_batch_size_should_adapt_to_the_duration_of_the_batches() -> None:
+    worker = build_worker(batch_size=64)
+
+    assert worker._get_next_batch_size(64, duration_ms=80) == 32
+    assert worker._get_next_batch_size(1, duration_ms=80) == 1
+    assert worker._get_next_batch_size(32, duration_ms=10) == 64
+    assert worker._get_next_batch_size(64, duration_ms=10) == 64
+    assert worker._get_next_batch_size(32, duration_ms=40) == 32
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import pytest
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.data.entities import DialogDataEntity
+from app.services import partition_service
+
+
+def search(query_string: str) -> List[Dict[str, Any]]:
+    response = test_base.get_test_client().get(f'/data/search?{query_string}')
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_search_should_match_promoted_dialog_data() -> None:
+    test_base.empty_database()
+    test_base.insert_dialog_data({'text': 'My delivery is late', 'language': 'EN'}, dialog_id='did1')
+    test_base.insert_dialog_data({'text': 'Où est ma livraison ? Le délai est dépassé', 'language': 'FR'},
+                                 customer_id='id13', dialog_id='did2')
+    test_base.insert_dialog_data({'text': 'Where is my delivery?', 'language': 'EN'}, dialog_id='did3')
+
+    # Only the consented data is searchable
+    assert search('q=delivery') == []
+    test_base.give_consent(dialog_id='did1')
+    test_base.give_consent(dialog_id='did2')
+    test_base.give_consent(has_given_consent=False, dialog_id='did3')
+
+    results = search('q=delivery')
+    assert [result['text'] for result in results] == ['My delivery is late']
+    assert set(results[0]) == {'id', 'customer_id', 'dialog_id', 'text', 'language', 'received_at_timestamp_utc'}
+
+    # Diacritics are ignored, and the usual filters apply
+    assert [result['dialog_id'] for result in search('q=delai')] == ['did2']
+    assert [result['dialog_id'] for result in search('q=livr*')] == ['did2']
+    assert search('q=delai&language=EN') == []
+    assert search('q=late OR delai&customerId=id13')[0]['dialog_id'] == 'did2'
+    test_base.empty_database()
+
+
+def test_search_should_rank_and_paginate_results() -> None:
+    test_base.empty_database()
+    db = test_base.get_database()
+    for index in range(9):
+        text = 'refund ' * (index % 3 + 1) + f'please, order {index}'
+        db.add(DialogDataEntity(customer_id='id12', dialog_id=f'did{index}', text=text, language='en',
+                                received_at_timestamp_utc=datetime.utcnow()))
+    db.add(DialogDataEntity(customer_id='id12', dialog_id='did9', text='Hello', language='en',
+                            received_at_timestamp_utc=datetime.utcnow()))
+    db.commit()
+    db.close()
+
+    all_results = search('q=refund&limit=20')
+    assert len(all_results) == 9
+    assert [result['text'].count('refund') for result in all_results[:3]] == [3, 3, 3]
+
+    pages = []
+    cursor = ''
+    while cursor is not None:
+        response = test_base.get_test_client().get(f'/data/search?q=refund&limit=4&cursor={cursor}')
+        pages += response.json()
+        cursor = response.headers.get('X-Next-Cursor')
+    assert pages == all_results
+
+    # Deleted rows leave the index
+    db = test_base.get_database()
+    db.query(DialogDataEntity).filter(DialogDataEntity.dialog_id == 'did2').delete()
+    db.commit()
+    db.close()
+    assert 'did2' not in [result['dialog_id'] for result in search('q=refund&limit=20')]
+    test_base.empty_database()
+
+
+def test_search_should_reject_invalid_queries() -> None:
+    client = test_base.get_test_client()
+    assert client.get('/data/search').status_code == 422
+    assert client.get('/data/search?q=').status_code == 422
+    assert client.get('/data/search?q="unterminated').status_code == 400
+    assert client.get('/data/search?q=refund&cursor=abc').status_code == 400
+
+
+@pytest.fixture
+def partition_directory(tmp_path: Path) -> Iterator[Path]:
+    directory = settings.PARTITION_DIRECTORY
+    settings.PARTITION_DIRECTORY = str(tmp_path / 'partitions')
+    yield tmp_path / 'partitions'
+    test_base.empty_database()
+    settings.PARTITION_DIRECTORY = directory
+
+
+def test_search_should_include_the_attached_partitions(partition_directory: Path) -> None:
+    test_base.empty_database()
+    db = test_base.get_database()
+    for index in range(6):
+        db.add(DialogDataEntity(customer_id='id12', dialog_id=f'did{index}', text=f'Invoice number {index}',
+                                language='en', received_at_timestamp_utc=datetime(2022, 1, 1) + timedelta(days=index)))
+    db.add(DialogDataEntity(customer_id='id12', dialog_id='did9', text='Invoice missing', language='en',
+                            received_at_timestamp_utc=datetime.utcnow()))
+    db.commit()
+    db.close()
+    before_sealing = search('q=invoice')
+
+    partition_service.seal_partition('2022-01', test_base.engine)
+    assert sorted(result['id'] for result in search('q=invoice')) == sorted(result['id'] for result in before_sealing)
+    assert len(search('q=invoice&limit=3')) == 3
+
+    partition_service.set_partition_state('2022-01', partition_service.DETACHED, test_base.engine)
+    assert [result['dialog_id'] for result in search('q=invoice')] == ['did9']
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import pytest
+from tests.helpers import test_base
+
+import app.helpers.json_helper as json_helper
+from app.config.config import settings
+from app.data.models import AnomalyDataModel, DialogDataModel
+
+
+def test_fallback_encoding_should_match_orjson(monkeypatch: pytest.MonkeyPatch) -> None:
+    content = [{'text': 'Grüezi chatbot', 'id': 1, 'received_at_timestamp_utc': datetime(2023, 1, 9, 20, 30, 0, 12)}]
+    fast_body = json_helper.dumps(content)
+
+    monkeypatch.setattr(json_helper, 'orjson', None)
+    assert json_helper.dumps(content) == fast_body
+
+
+def test_get_dialog_data_should_match_response_model() -> None:
+    test_base.empty_database()
+    test_base.insert_dialog_data(payload={'text': 'Grüezi chatbot', 'language': 'DE'}, dialog_id='did3')
+    test_base.give_consent(has_given_consent=True, dialog_id='did3')
+
+    response = test_base.get_test_client().get('/data/')
+    assert response.status_code == 200
+    dialog_data = [DialogDataModel(**item) for item in response.json()]
+    assert response.content == json_helper.dumps([item.dict() for item in dialog_data])
+
+
+def test_get_anomalies_should_match_response_model() -> None:
+    settings.ANOMALY_PERIOD_MS = 0
+    test_base.empty_database()
+    test_base.insert_dialog_data(dialog_id='did3')
+    test_base.insert_dialog_data(dialog_id='did3')
+
+    response = test_base.get_test_client().get('/data/anomaly')
+    assert response.status_code == 200
+    anomalies = [AnomalyDataModel(**item) for item in response.json()]
+    assert response.content == json_helper.dumps([item.dict() for item in anomalies])
+    assert anomalies[0].message_count == 2
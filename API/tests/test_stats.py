@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from tests.helpers import test_base
+
+from app.services.stats_service import rebuild_stats
+
+
+def get_stats(query_string: str = '') -> Dict[str, Any]:
+    response = test_base.get_test_client().get(f'/stats{query_string}')
+    assert response.status_code == 200
+    return response.json()
+
+
+def insert_dialogs() -> None:
+    test_base.empty_database()
+    for index in range(3):
+        test_base.insert_dialog_data({'text': f'Hello {index}', 'language': 'EN'}, customer_id='id1', dialog_id='did1')
+    test_base.insert_dialog_data({'text': 'Bonjour', 'language': 'FR'}, customer_id='id2', dialog_id='did2')
+    test_base.insert_dialog_data({'text': 'Hallo', 'language': 'DE'}, customer_id='id2', dialog_id='did3')
+    test_base.insert_dialog_data({'text': 'Hola', 'language': 'ES'}, customer_id='id3', dialog_id='did4')
+    test_base.insert_dialog_data({'text': 'Hola otra vez', 'language': 'ES'}, customer_id='id3', dialog_id='did4')
+    test_base.give_consent(has_given_consent=True, dialog_id='did1')
+    test_base.give_consent(has_given_consent=True, dialog_id='did2')
+    test_base.give_consent(has_given_consent=False, dialog_id='did3')
+
+
+def test_stats_should_be_maintained_on_consent() -> None:
+    insert_dialogs()
+    today = datetime.utcnow().date().isoformat()
+
+    stats = get_stats()
+
+    assert stats['messages'] == {'total': 4, 'by_language': {'en': 3, 'fr': 1}, 'by_customer': {'id1': 3, 'id2': 1},
+                                 'by_day': {today: 4}}
+    assert stats['consents'] == {'granted': 2, 'denied': 1, 'grant_ratio': 2 / 3,
+                                 'by_day': {today: {'granted': 2, 'denied': 1, 'grant_ratio': 2 / 3}}}
+    assert stats['pending'] == {'dialogs': 1, 'messages': 2}
+    test_base.empty_database()
+
+
+def test_stats_should_be_filtered_by_day() -> None:
+    insert_dialogs()
+    tomorrow = (datetime.utcnow().date() + timedelta(days=1)).isoformat()
+
+    assert get_stats(f'?to={datetime.utcnow().date().isoformat()}')['messages']['total'] == 4
+    stats = get_stats(f'?from={tomorrow}')
+    assert stats['messages'] == {'total': 0, 'by_language': {}, 'by_customer': {}, 'by_day': {}}
+    assert stats['consents'] == {'granted': 0, 'denied': 0, 'grant_ratio': None, 'by_day': {}}
+    assert test_base.get_test_client().get('/stats?from=yesterday').status_code == 422
+    test_base.empty_database()
+
+
+def test_rebuilt_stats_should_match_the_incremental_ones() -> None:
+    insert_dialogs()
+    stats = get_stats()
+
+    db = test_base.get_database()
+    rebuild_stats(db)
+    db.close()
+
+    assert get_stats() == stats
+    test_base.empty_database()
@@ -0,0 +1,187 @@
+import fcntl
+import threading
+import time
+from typing import Any, Iterator, List
+
+import pytest
+from tests.helpers import test_base
+
+from app.config.config import settings
+from app.data.entities import DialogDataEntity, PendingDialogEntity, TemporaryDialogDataEntity
+from app.services.temporary_store_service import temporary_store
+
+
+@pytest.fixture
+def memory_store() -> Iterator[None]:
+    session_factory = temporary_store.session_factory
+    max_rows = temporary_store.max_rows
+    interval_ms = temporary_store.interval_ms
+    temporary_store.session_factory = test_base.testing_session_local
+    # Dialogs are only spilled when the tests ask for it
+    temporary_store.interval_ms = 60000
+    settings.TEMPORARY_STORE_MODE = 'MEMORY'
+    test_base.empty_database()
+    temporary_store.start()
+    yield
+    settings.TEMPORARY_STORE_MODE = 'DATABASE'
+    temporary_store.stop()
+    temporary_store.session_factory = session_factory
+    temporary_store.max_rows = max_rows
+    temporary_store.interval_ms = interval_ms
+    test_base.empty_database()
+
+
+def count_rows(entity: type, **filters: str) -> int:
+    db = test_base.get_database()
+    count = db.query(entity).filter_by(**filters).count()
+    db.close()
+    return count
+
+
+def test_only_granted_messages_should_be_written(memory_store: None) -> None:
+    first_id = test_base.insert_dialog_data(dialog_id='did1').json()['id']
+    assert test_base.insert_dialog_data_batch([
+        {'customer_id': 'id12', 'dialog_id': 'did1', 'text': 'Second message', 'language': 'EN'},
+        {'customer_id': 'id12', 'dialog_id': 'did2', 'text': 'Other message', 'language': 'FR'},
+    ]).json() == [first_id + 1, first_id + 2]
+    assert count_rows(TemporaryDialogDataEntity) == 0
+    assert test_base.get_test_client().get('/stats').json()['pending'] == {'dialogs': 2, 'messages': 3}
+
+    assert test_base.give_consent(dialog_id='did1').status_code == 200
+    assert test_base.give_consent(dialog_id='did2', has_given_consent=False).status_code == 200
+    assert test_base.give_consent(dialog_id='did1').status_code == 409
+    assert test_base.give_consent(dialog_id='did3').status_code == 404
+
+    rows = test_base.get_dialog_data('').json()
+    assert rows[0]['id'] > rows[1]['id']
+    assert [row['text'] for row in rows] == ['Second message', test_base.get_first_dialog_data_payload()['text']]
+    stats = test_base.get_test_client().get('/stats').json()
+    assert stats['messages']['total'] == 2 and stats['pending'] == {'dialogs': 0, 'messages': 0}
+    assert count_rows(TemporaryDialogDataEntity) == 0 and count_rows(PendingDialogEntity) == 0
+
+
+def test_old_dialogs_should_be_spilled_when_the_store_is_full(memory_store: None) -> None:
+    for dialog_id in ['did1', 'did2', 'did1', 'did3', 'did2']:
+        test_base.insert_dialog_data(dialog_id=dialog_id)
+    temporary_store.max_rows = 4
+
+    # The oldest dialogs are written to the database, until three quarters of max_rows are left in memory
+    assert temporary_store.spill() == 2
+    assert temporary_store.get_counts() == (2, 3)
+    assert count_rows(TemporaryDialogDataEntity, dialog_id='did1') == 2
+    assert count_rows(PendingDialogEntity) == 1
+
+    # Messages of a spilled dialog are promoted from both the database and memory
+    test_base.insert_dialog_data(dialog_id='did1')
+    assert test_base.give_consent(dialog_id='did1').status_code == 200
+    assert count_rows(DialogDataEntity, dialog_id='did1') == 3
+    assert temporary_store.get_counts() == (2, 3)
+
+    temporary_store.stop()
+    assert temporary_store.get_counts() == (0, 0)
+    assert count_rows(TemporaryDialogDataEntity) == 3
+
+
+def test_bulk_consent_should_promote_the_messages_in_memory(memory_store: None) -> None:
+    test_base.insert_dialog_data(dialog_id='did1')
+    test_base.insert_dialog_data(dialog_id='did2')
+    temporary_store.spill(everything=True)
+    test_base.insert_dialog_data(dialog_id='did3')
+    assert test_base.give_consent(dialog_id='did4', has_given_consent=False).status_code == 404
+    test_base.insert_dialog_data(dialog_id='did4')
+    assert test_base.give_consent(dialog_id='did4', has_given_consent=False).status_code == 200
+    # Messages received after the decision are kept, as they are with the database
+    test_base.insert_dialog_data(dialog_id='did4')
+
+    results = test_base.get_test_client().post('/consents', json=[
+        {'dialog_id': 'did1', 'has_given_consent': True},
+        {'dialog_id': 'did3', 'has_given_consent': True},
+        {'dialog_id': 'did4', 'has_given_consent': True},
+        {'dialog_id': 'did5', 'has_given_consent': True},
+    ]).json()
+    assert [result['status_code'] for result in results] == [200, 200, 409, 404]
+    assert count_rows(DialogDataEntity) == 2
+    assert count_rows(DialogDataEntity, dialog_id='did3') == 1
+    assert temporary_store.get_counts() == (1, 1)
+
+
+def test_store_should_not_start_in_a_second_process(memory_store: None) -> None:
+    temporary_store.stop()
+    # The lock file of the database is held by another worker process
+    with open(f'{test_base.database_location}.temporary-store.lock', 'w') as process_lock:
+        fcntl.flock(process_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with pytest.raises(RuntimeError):
+            temporary_store.start()
+
+    temporary_store.start()
+    test_base.insert_dialog_data(dialog_id='did1')
+    assert temporary_store.get_counts() == (1, 1)
+
+
+@pytest.fixture
+def slow_spill(monkeypatch: pytest.MonkeyPatch) -> threading.Event:
+    # The spill keeps the dialogs it took out of memory for a while before writing them
+    write = temporary_store._write
+    taken = threading.Event()
+    take_dialogs_to_spill = temporary_store._take_dialogs_to_spill
+
+    def take_and_signal(everything: bool) -> Any:
+        dialogs = take_dialogs_to_spill(everything=everything)
+        # Only the spills started by the tests are waited for, not those of the background thread
+        if threading.current_thread().name != 'TemporaryStoreSpiller':
+            taken.set()
+        return dialogs
+
+    def slow_write(dialog_data: List[TemporaryDialogDataEntity]) -> None:
+        time.sleep(0.2)
+        write(dialog_data)
+
+    monkeypatch.setattr(temporary_store, '_take_dialogs_to_spill', take_and_signal)
+    monkeypatch.setattr(temporary_store, '_write', slow_write)
+    return taken
+
+
+class SpillOnFirstRelease:
+    # Starts a spill the first time the lock of the store is released, and lets it take its dialogs before going on
+    def __init__(self, lock: Any, spilled: threading.Event) -> None:
+        self.lock = lock
+        self.spilled = spilled
+        self.spiller = threading.Thread(target=temporary_store.spill, kwargs={'everything': True})
+
+    def __enter__(self) -> None:
+        self.lock.acquire()
+
+    def __exit__(self, *args: Any) -> None:
+        self.lock.release()
+        if not self.spiller.is_alive() and not self.spilled.is_set():
+            self.spiller.start()
+            assert self.spilled.wait(5)
+
+
+def test_taken_dialogs_should_not_be_spilled(memory_store: None, slow_spill: threading.Event,
+                                             monkeypatch: pytest.MonkeyPatch) -> None:
+    test_base.insert_dialog_data(dialog_id='did1')
+    test_base.insert_dialog_data(dialog_id='did1')
+    store_lock = SpillOnFirstRelease(temporary_store._lock, spilled=slow_spill)
+    monkeypatch.setattr(temporary_store, '_lock', store_lock)
+
+    taken = temporary_store.take(['did1'])
+    store_lock.spiller.join()
+
+    # Whatever the spill does in between, the messages are either taken or already in the database
+    assert len(taken.get('did1', [])) + count_rows(TemporaryDialogDataEntity, dialog_id='did1') == 2
+    assert len(taken['did1']) == 2
+
+
+def test_consent_should_wait_for_the_dialogs_being_spilled(memory_store: None, slow_spill: threading.Event) -> None:
+    test_base.insert_dialog_data(dialog_id='did1')
+    test_base.insert_dialog_data(dialog_id='did1')
+    spiller = threading.Thread(target=temporary_store.spill, kwargs={'everything': True})
+    spiller.start()
+    assert slow_spill.wait(5)
+
+    # The messages are neither in memory nor in the database until the spill is over
+    assert test_base.give_consent(dialog_id='did1').status_code == 200
+    spiller.join()
+    assert count_rows(DialogDataEntity, dialog_id='did1') == 2
+    assert count_rows(TemporaryDialogDataEntity) == 0